@@ -0,0 +1,115 @@
+# admission.py - connection admission control: global cap, per-IP limits, rate buckets
+import time
+from collections import Counter
+
+import metrics
+
+REJECTED = metrics.Counter("honeypot_rejected_total", "Connections refused or cut short, by reason", labels=("reason",))
+
+class IPState:
+    """Per-source state: open sessions and a connection-rate token bucket."""
+
+    __slots__ = ("active", "tokens", "stamp")
+
+    def __init__(self, tokens, now):
+        self.active = 0
+        self.tokens = tokens
+        self.stamp = now
+
+class AdmissionControl:
+    """Decides whether a new connection may start a session.
+
+    - max_sessions: global cap on concurrent sessions
+    - per_ip_sessions: concurrent sessions allowed from one source IP
+    - per_ip_rate / per_ip_burst: token bucket on new connections per IP
+      (connections/second, bucket size)
+
+    Idle IP entries (no open sessions, bucket refilled) expire after
+    `expiry` seconds, and at most `max_tracked` IPs are kept, so the table
+    itself stays bounded under spoofed/scanning traffic. Rejections are
+    only counted; take_report() returns them in aggregated form.
+    """
+
+    def __init__(self, max_sessions=1000, per_ip_sessions=20, per_ip_rate=2.0, per_ip_burst=10,
+                 expiry=300.0, max_tracked=100_000):
+        self.max_sessions = max_sessions
+        self.per_ip_sessions = per_ip_sessions
+        self.per_ip_rate = per_ip_rate
+        self.per_ip_burst = per_ip_burst
+        self.expiry = expiry
+        self.max_tracked = max_tracked
+        self.active = 0
+        self.ips = {}
+        self.rejected = Counter()
+        self.rejected_ips = Counter()
+        self._next_sweep = 0.0
+        self._report_start = time.monotonic()
+
+    def admit(self, ip, now=None):
+        """Return None if admitted (call release() later), else the rejection reason."""
+        now = time.monotonic() if now is None else now
+        if now >= self._next_sweep or len(self.ips) >= self.max_tracked:
+            self.sweep(now)
+        state = self.ips.get(ip)
+        if state is None:
+            state = self.ips[ip] = IPState(self.per_ip_burst, now)
+        else:
+            # refill the bucket for the time since the last connection
+            state.tokens = min(self.per_ip_burst, state.tokens + (now - state.stamp) * self.per_ip_rate)
+            state.stamp = now
+        if self.active >= self.max_sessions:
+            reason = "global_cap"
+        elif state.active >= self.per_ip_sessions:
+            reason = "ip_concurrency"
+        elif state.tokens < 1.0:
+            reason = "ip_rate"
+        else:
+            state.tokens -= 1.0
+            state.active += 1
+            self.active += 1
+            return None
+        self.reject(ip, reason)
+        return reason
+
+    def release(self, ip):
+        state = self.ips.get(ip)
+        if state is not None and state.active > 0:
+            state.active -= 1
+        self.active = max(0, self.active - 1)
+
+    def reject(self, ip, reason):
+        """Count a rejection (also used for sessions cut short by timeouts/limits)."""
+        self.rejected[reason] += 1
+        REJECTED.labels(reason).inc()
+        if ip in self.rejected_ips or len(self.rejected_ips) < 1000:
+            self.rejected_ips[ip] += 1
+
+    def sweep(self, now):
+        """Forget idle IPs; when over max_tracked, drop the oldest idle ones first."""
+        idle_after = self.expiry
+        stale = [ip for ip, s in self.ips.items() if s.active == 0 and now - s.stamp >= idle_after]
+        for ip in stale:
+            del self.ips[ip]
+        if len(self.ips) >= self.max_tracked:
+            idle = sorted((s.stamp, ip) for ip, s in self.ips.items() if s.active == 0)
+            for _, ip in idle[:len(self.ips) - self.max_tracked // 2]:
+                del self.ips[ip]
+        self._next_sweep = now + min(idle_after, 60.0)
+
+    def take_report(self, top=10):
+        """Aggregated rejections since the last report (None if there were none)."""
+        now = time.monotonic()
+        if not self.rejected:
+            self._report_start = now
+            return None
+        report = {
+            "window_s": round(now - self._report_start, 1),
+            "rejected": dict(self.rejected),
+            "top_ips": self.rejected_ips.most_common(top),
+            "active_sessions": self.active,
+            "tracked_ips": len(self.ips),
+        }
+        self.rejected.clear()
+        self.rejected_ips.clear()
+        self._report_start = now
+        return report
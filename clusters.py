@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+# clusters.py - approximate campaigns: MinHash/LSH clustering of session inputs
+#
+#   python3 clusters.py update                 # assign sessions logged since the last run
+#   python3 clusters.py list -n 20 --min-size 5
+#   python3 clusters.py show 42
+#
+# Transcript dedup only groups sessions that sent exactly the same thing;
+# bots that vary a download URL or a file name end up with a hash each.
+# Here the client input of a session (transcript "in" lines, "recv"
+# events) becomes a set of shingles: pairs of adjacent tokens, where
+# words and runs of punctuation are separate tokens, so a random file name
+# or a different download host changes only a few of them. MinHash signatures
+# (NUM_PERM values) are computed for a whole batch of sessions at once with
+# NumPy, and LSH (BANDS bands of ROWS values) finds the clusters a session
+# may belong to without comparing it to every other one. A candidate is
+# accepted when the estimated Jaccard similarity to one of its exemplars
+# is at least THRESHOLD; otherwise the session starts a new cluster.
+#
+# Clustering is incremental. The state (exemplar signatures, cluster
+# summaries and how far each log has been read) is saved to
+# logs/clusters.npz, and `update` only reads entries newer than the last
+# one assigned for each log. The dashboard's "Similar sessions" panel
+# runs the same update.
+import argparse
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import zlib
+from collections import Counter
+
+import numpy as np
+
+import logindex
+import logmerge
+import logstore
+import rollups
+import transcript
+
+BASE_DIR = os.path.dirname(__file__)
+STATE_NAME = "clusters.npz"
+NUM_PERM = 128
+BANDS, ROWS = 32, 4        # candidates from ~0.4 similarity on; THRESHOLD decides
+THRESHOLD = float(os.environ.get("HONEYPOT_CLUSTER_THRESHOLD", "0.6"))
+SHINGLE = 2                # tokens per shingle
+MAX_SHINGLES = 2000        # per session
+MAX_EXEMPLARS = 8          # signatures kept per cluster for matching
+EXEMPLAR_BELOW = 0.9       # a member this different from the exemplars becomes one
+MAX_CLUSTERS = int(os.environ.get("HONEYPOT_CLUSTER_MAX", "50000"))
+MAX_IPS = 200              # member IPs listed per cluster (all are counted in a HyperLogLog)
+REP_COMMANDS = 50          # inputs kept of the representative session
+BATCH = 4096               # sessions per vectorized signature batch
+CHUNK = 1 << 16            # shingles hashed per NumPy step (CHUNK x NUM_PERM x 8 bytes)
+MEMO_SIZE = 65536
+
+_rng = np.random.default_rng(0x5EED)  # fixed: signatures must be comparable across runs
+_A = _rng.integers(1, 2**63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_B = _rng.integers(0, 2**63, NUM_PERM, dtype=np.uint64)
+_TOKEN = re.compile(r"[a-z0-9_]+|[^\sa-z0-9_]+")
+
+def inputs(entry):
+    """What the client sent, one string per line (the masked password left out)."""
+    return [t for t in (str(x).strip() for x in rollups.received_texts(entry)) if t and t != "<password>"]
+
+def shingles(lines):
+    """Sorted unique uint32 hashes of the token SHINGLE-grams of `lines`."""
+    tokens = []
+    for line in lines:
+        tokens.extend(_TOKEN.findall(line.lower()))
+        tokens.append(";")
+    if not tokens:
+        return []
+    grams = {" ".join(tokens[i:i + SHINGLE]) for i in range(max(1, len(tokens) - SHINGLE + 1))}
+    return sorted(zlib.crc32(g.encode("utf-8", "replace")) for g in grams)[:MAX_SHINGLES]
+
+def signatures(sets):
+    """MinHash signatures (len(sets) x NUM_PERM uint32) of non-empty shingle sets.
+
+    Every shingle goes through NUM_PERM multiply-shift hashes
+    ((a * x + b) mod 2**64) >> 32 in one array operation, and
+    minimum.reduceat takes each session's minimum per hash.
+    """
+    out = np.empty((len(sets), NUM_PERM), dtype=np.uint32)
+    lengths = np.fromiter(map(len, sets), dtype=np.int64, count=len(sets))
+    flat = np.fromiter((h for s in sets for h in s), dtype=np.uint64, count=int(lengths.sum()))
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    row = 0
+    while row < len(sets):
+        # whole sessions per step, at most CHUNK shingles (or one larger session)
+        last = max(row + 1, int(np.searchsorted(ends, starts[row] + CHUNK, side="right")))
+        lo, hi = starts[row], ends[last - 1]
+        with np.errstate(over="ignore"):
+            hashed = (flat[lo:hi, None] * _A + _B) >> np.uint64(32)
+        out[row:last] = np.minimum.reduceat(hashed, starts[row:last] - lo, axis=0)
+        row = last
+    return out
+
+def band_keys(sigs):
+    """One uint64 key per band and signature (len(sigs) x BANDS)."""
+    bands = sigs.reshape(len(sigs), BANDS, ROWS).astype(np.uint64)
+    keys = np.zeros(bands.shape[:2], dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for r in range(ROWS):
+            keys = keys * np.uint64(0x100000001B3) + bands[:, :, r]
+    return keys
+
+class ClusterIndex:
+    """Clusters, their exemplar signatures and the LSH buckets over them."""
+
+    def __init__(self):
+        self.clusters = {}   # id -> summary dict
+        self.exemplars = {}  # id -> [signature]
+        self.buckets = [{} for _ in range(BANDS)]  # band key -> cluster id
+        self.marks = {}      # log source -> sort key of the newest entry assigned
+        self.offsets = {}    # log file name -> [inode, bytes read]
+        self.next_id = 1
+        self.sessions = 0
+        self.empty = 0       # sessions without client input
+        self._hll = {}       # id -> HyperLogLog of member IPs
+        self._memo = {}      # transcript ref / shingle digest -> cluster id
+        self.lock = threading.Lock()  # the dashboard shares one index between sessions
+
+    # --- assignment ---------------------------------------------------------
+    def _index(self, cid, sig, keys):
+        self.exemplars.setdefault(cid, []).append(sig)
+        for band, key in enumerate(keys.tolist()):
+            self.buckets[band].setdefault(key, cid)
+
+    def _match(self, sig, keys):
+        """(cluster id, similarity) of the best candidate, or (None, 0.0)."""
+        candidates = {self.buckets[band].get(key) for band, key in enumerate(keys.tolist())}
+        candidates.discard(None)
+        best, best_sim = None, 0.0
+        for cid in candidates:
+            ex = self.exemplars.get(cid)
+            if not ex:
+                continue
+            sim = float((np.asarray(ex) == sig).mean(axis=1).max())
+            if sim > best_sim:
+                best, best_sim = cid, sim
+        return best, best_sim
+
+    def _new_cluster(self, entry, lines, source):
+        cid = self.next_id
+        self.next_id += 1
+        ts = entry.get("time")
+        self.clusters[cid] = {
+            "id": cid, "size": 0, "first": ts, "last": ts, "ips": {}, "services": {},
+            "rep": {"session_id": entry.get("session_id"), "time": ts, "src_ip": entry.get("src_ip"),
+                    "source": source, "inputs": [line[:200] for line in lines[:REP_COMMANDS]]},
+        }
+        self._hll[cid] = rollups.HyperLogLog()
+        return cid
+
+    def _add_member(self, cid, entry):
+        c = self.clusters[cid]
+        c["size"] += 1
+        ts = entry.get("time")
+        if ts:
+            key = logmerge.sort_key(ts)
+            if not c["first"] or key < logmerge.sort_key(c["first"]):
+                c["first"] = ts
+            if not c["last"] or key > logmerge.sort_key(c["last"]):
+                c["last"] = ts
+        ip = entry.get("src_ip")
+        if ip:
+            self._hll[cid].add(str(ip))
+            if ip in c["ips"] or len(c["ips"]) < MAX_IPS:
+                c["ips"][ip] = c["ips"].get(ip, 0) + 1
+        service = str(entry.get("service", ""))
+        c["services"][service] = c["services"].get(service, 0) + 1
+
+    def add_batch(self, entries, source=""):
+        """Assign a batch of log entries to clusters; returns how many had input."""
+        todo, sets, assigned = [], [], 0
+        for entry in entries:
+            ref = transcript.ref(entry)
+            cid = self._memo.get(ref) if ref else None
+            if cid in self.clusters:
+                self._add_member(cid, entry)
+                self.sessions += 1
+                assigned += 1
+                continue
+            lines = inputs(entry)
+            s = shingles(lines)
+            if not s:
+                self.empty += 1
+                continue
+            todo.append((entry, lines, ref))
+            sets.append(s)
+        if not todo:
+            return assigned
+        sigs = signatures(sets)
+        keys = band_keys(sigs)
+        for i, (entry, lines, ref) in enumerate(todo):
+            digest = zlib.crc32(np.asarray(sets[i], dtype=np.uint32).tobytes())
+            cid = self._memo.get(digest)
+            if cid not in self.clusters:
+                cid, sim = self._match(sigs[i], keys[i])
+                if cid is None or sim < THRESHOLD:
+                    cid = self._new_cluster(entry, lines, source)
+                    self._index(cid, sigs[i], keys[i])
+                elif sim < EXEMPLAR_BELOW and len(self.exemplars[cid]) < MAX_EXEMPLARS:
+                    self._index(cid, sigs[i], keys[i])
+            if len(self._memo) >= MEMO_SIZE:
+                self._memo.clear()
+            self._memo[digest] = cid
+            if ref:
+                self._memo[ref] = cid
+            self._add_member(cid, entry)
+            self.sessions += 1
+        if len(self.clusters) > MAX_CLUSTERS * 1.2:
+            self.prune()
+        return assigned + len(todo)
+
+    def prune(self, keep=MAX_CLUSTERS):
+        """Keep the `keep` largest clusters (most recent first among equals)."""
+        ranked = sorted(self.clusters.values(), key=lambda c: (c["size"], logmerge.sort_key(c["last"])), reverse=True)
+        kept = {c["id"] for c in ranked[:keep]}
+        self.clusters = {cid: c for cid, c in self.clusters.items() if cid in kept}
+        self.exemplars = {cid: ex for cid, ex in self.exemplars.items() if cid in kept}
+        self._hll = {cid: h for cid, h in self._hll.items() if cid in kept}
+        self._memo.clear()
+        self._rebuild_buckets()
+
+    def _rebuild_buckets(self):
+        self.buckets = [{} for _ in range(BANDS)]
+        for cid in sorted(self.exemplars):
+            ex = np.asarray(self.exemplars[cid], dtype=np.uint32)
+            for keys in band_keys(ex):
+                for band, key in enumerate(keys.tolist()):
+                    self.buckets[band].setdefault(key, cid)
+
+    # --- reading logs ---------------------------------------------------------
+    def _lines(self, path):
+        """Lines of `path` not read before (plain files resume at the saved offset)."""
+        name = os.path.basename(path)
+        if path.endswith((".gz", ".zst")):
+            with logstore.open_log(path) as f:
+                for line in f:
+                    yield line.encode("utf-8")
+            return
+        st = os.stat(path)
+        inode, offset = self.offsets.get(name, (None, 0))
+        start = offset if inode == st.st_ino and offset <= st.st_size else 0
+        with open(path, "rb") as f:
+            f.seek(start)
+            pos = start
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # being written: read it next time
+                pos += len(line)
+                yield line
+        self.offsets[name] = [st.st_ino, pos]
+
+    def update(self, paths, log_dir=None):
+        """Assign the entries of `paths` newer than what was assigned; returns sessions added."""
+        manifest = logstore.load_manifest(log_dir) if log_dir else {"segments": []}
+        sources = {seg["file"]: seg.get("source") or seg["file"] for seg in manifest["segments"]}
+        ends = {seg["file"]: seg.get("end") for seg in manifest["segments"]}
+        added = 0
+        for path in map(str, paths):
+            if not os.path.exists(path):
+                continue
+            name = os.path.basename(path)
+            source = sources.get(name, name)
+            mark = self.marks.get(source, "")
+            if ends.get(name) and mark and logmerge.sort_key(ends[name]) <= mark:
+                continue  # a closed segment already assigned
+            batch, newest = [], mark
+            for line in self._lines(path):
+                m = logindex._HEAD.match(line)
+                if m is not None and logmerge.sort_key(m.group(1).decode()) <= mark:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(entry, dict):
+                    continue
+                key = logmerge.sort_key(entry.get("time"))
+                if key and key <= mark:
+                    continue
+                newest = max(newest, key)
+                batch.append(entry)
+                if len(batch) >= BATCH:
+                    added += self.add_batch(batch, name)
+                    batch = []
+            if batch:
+                added += self.add_batch(batch, name)
+            if newest:
+                self.marks[source] = newest
+        return added
+
+    # --- results ----------------------------------------------------------------
+    def summary(self, cid):
+        """A cluster's summary with "distinct_ips" and "span_seconds" filled in."""
+        c = dict(self.clusters[cid])
+        c["distinct_ips"] = self._hll[cid].count() if cid in self._hll else len(c["ips"])
+        first, last = logstore.parse_time(c["first"] or ""), logstore.parse_time(c["last"] or "")
+        c["span_seconds"] = (last - first).total_seconds() if first and last else 0
+        c["exemplars"] = len(self.exemplars.get(cid, ()))
+        return c
+
+    def top(self, n=20, min_size=1):
+        """Summaries of the largest clusters."""
+        ranked = sorted((c for c in self.clusters.values() if c["size"] >= min_size),
+                        key=lambda c: (-c["size"], c["id"]))
+        return [self.summary(c["id"]) for c in ranked[:n]]
+
+    # --- state ----------------------------------------------------------------
+    def save(self, path):
+        """Write the state atomically (one .npz: exemplar signatures plus JSON)."""
+        owners = [cid for cid in sorted(self.exemplars) for _ in self.exemplars[cid]]
+        sigs = [sig for cid in sorted(self.exemplars) for sig in self.exemplars[cid]]
+        meta = {"version": 1, "num_perm": NUM_PERM, "bands": BANDS, "next_id": self.next_id,
+                "sessions": self.sessions, "empty": self.empty, "marks": self.marks, "offsets": self.offsets,
+                "clusters": list(self.clusters.values()),
+                "hll": {str(cid): h.to_str() for cid, h in self._hll.items()}}
+        buf = io.BytesIO()
+        np.savez(buf, sigs=np.asarray(sigs, dtype=np.uint32).reshape(-1, NUM_PERM),
+                 owners=np.asarray(owners, dtype=np.int64),
+                 meta=np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8))
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".clusters-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(buf.getbuffer())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """The saved state, or an empty index if there is none (or it is unusable)."""
+        index = cls()
+        try:
+            with np.load(path) as data:
+                meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+                sigs, owners = data["sigs"], data["owners"]
+        except (OSError, ValueError, KeyError):
+            return index
+        if meta.get("num_perm") != NUM_PERM or meta.get("bands") != BANDS:
+            return index  # signatures from other parameters: start over
+        index.next_id = meta["next_id"]
+        index.sessions, index.empty = meta.get("sessions", 0), meta.get("empty", 0)
+        index.marks, index.offsets = meta.get("marks", {}), meta.get("offsets", {})
+        index.clusters = {c["id"]: c for c in meta["clusters"]}
+        index._hll = {int(cid): rollups.HyperLogLog.from_str(s) for cid, s in meta.get("hll", {}).items()}
+        for cid, sig in zip(owners.tolist(), sigs):
+            index.exemplars.setdefault(cid, []).append(sig)
+        index._rebuild_buckets()
+        return index
+
+def state_path(log_dir):
+    return os.path.join(str(log_dir), STATE_NAME)
+
+def refresh(log_dir, index=None):
+    """Load (or take) the index for `log_dir`, assign new sessions and save; returns (index, added)."""
+    path = state_path(log_dir)
+    index = index if index is not None else ClusterIndex.load(path)
+    with index.lock:
+        added = index.update(logstore.select_segments(log_dir), log_dir)
+        if added or not os.path.exists(path):
+            index.save(path)
+    return index, added
+
+def _short(ts):
+    return (ts or "-")[:19].replace("T", " ")
+
+def main():
+    p = argparse.ArgumentParser(description="Cluster sessions by similar client input (MinHash/LSH).")
+    p.add_argument("--log-dir", default=os.path.join(BASE_DIR, "logs"))
+    sub = p.add_subparsers(dest="cmd", required=True)
+    u = sub.add_parser("update", help="Assign sessions logged since the last update")
+    u.add_argument("--rebuild", action="store_true", help="Discard the saved state and start over")
+    ls = sub.add_parser("list", help="Largest clusters")
+    ls.add_argument("-n", type=int, default=20)
+    ls.add_argument("--min-size", type=int, default=2)
+    show = sub.add_parser("show", help="One cluster: representative input and member IPs")
+    show.add_argument("id", type=int)
+    args = p.parse_args()
+    if args.cmd == "update":
+        index = ClusterIndex() if args.rebuild else None
+        index, added = refresh(args.log_dir, index)
+        print(f"{added} sessions assigned; {len(index.clusters)} clusters over {index.sessions} sessions "
+              f"({index.empty} without input)")
+        return
+    index = ClusterIndex.load(state_path(args.log_dir))
+    if not index.clusters:
+        raise SystemExit("No clusters yet: run `python3 clusters.py update` first")
+    if args.cmd == "list":
+        print(f"{'id':>6s} {'sessions':>9s} {'IPs':>6s} {'first seen':19s} {'last seen':19s}  input")
+        for c in index.top(args.n, args.min_size):
+            print(f"{c['id']:6d} {c['size']:9d} {c['distinct_ips']:6d} {_short(c['first']):19s} "
+                  f"{_short(c['last']):19s}  {' ; '.join(c['rep']['inputs'])[:80]}")
+        return
+    if args.id not in index.clusters:
+        raise SystemExit(f"No cluster {args.id}")
+    c = index.summary(args.id)
+    rep = c["rep"]
+    print(f"cluster {c['id']}: {c['size']} sessions, ~{c['distinct_ips']} IPs, "
+          f"{_short(c['first'])} .. {_short(c['last'])} ({c['span_seconds'] / 3600:.1f} h)")
+    print(f"services: {', '.join(f'{s} ({n})' for s, n in Counter(c['services']).most_common())}")
+    print(f"representative: {rep['session_id']} from {rep['src_ip']} at {_short(rep['time'])} ({rep['source']})")
+    for line in rep["inputs"]:
+        print(f"  > {line}")
+    print("member IPs:", ", ".join(f"{ip} ({n})" for ip, n in Counter(c["ips"]).most_common(50)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+# columnar.py - compact closed JSONL segments into columnar sessions/events tables
+#
+#   python3 columnar.py compact            # every closed segment in logs/manifest.json
+#   python3 columnar.py compact logs/x.jsonl.gz
+#
+# Each segment becomes two tables under logs/columnar/:
+#
+#   <segment>.sessions   time, src_ip, service, path, method, username,
+#                        session_id, commands, ref (transcript store hash;
+#                        one row per log line)
+#   <segment>.events     session_id, offset (ms since session start), dir, text
+#                        (one row per transcript/events item)
+#
+# Tables are Parquet when pyarrow is installed; otherwise a directory with one
+# .npy file per column (mmap-able) and a meta.json. Either way strings are
+# dictionary-encoded, readers load only the columns they ask for, and filters
+# are pushed down: row groups whose time range misses the filter are skipped.
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import logstore
+import transcript
+
+try:
+    import pyarrow  # noqa: F401
+except ImportError:  # optional: fall back to the .npy layout
+    pyarrow = None
+
+COLUMNAR_DIR_NAME = "columnar"
+INDEX_NAME = "index.json"
+# "auto" (parquet if pyarrow is installed, else npy), "parquet" or "npy"
+FORMAT = os.environ.get("HONEYPOT_COLUMNAR_FORMAT", "auto")
+ROW_GROUP = 65536
+
+SESSION_COLUMNS = ("time", "src_ip", "service", "path", "method", "username", "session_id", "commands", "ref")
+EVENT_COLUMNS = ("session_id", "offset", "dir", "text")
+STRING_COLUMNS = ("src_ip", "service", "path", "method", "username", "session_id", "dir", "text", "ref")
+
+def pick_format(fmt=FORMAT):
+    if fmt == "auto" or (fmt == "parquet" and pyarrow is None):
+        return "parquet" if pyarrow is not None else "npy"
+    return fmt
+
+def columnar_dir(log_dir):
+    return os.path.join(str(log_dir), COLUMNAR_DIR_NAME)
+
+# --- Flattening --------------------------------------------------------
+NAT = np.iinfo(np.int64).min
+
+def _to_us(values):
+    t = pd.to_datetime(pd.Series(values, dtype="object"), errors="coerce", utc=True, format="ISO8601")
+    return t.dt.tz_localize(None).to_numpy("datetime64[us]").astype(np.int64)
+
+def flatten(lines, source=""):
+    """Column lists for the sessions and events tables from raw JSONL lines."""
+    sess = {c: [] for c in SESSION_COLUMNS}
+    ev = {c: [] for c in EVENT_COLUMNS}
+    # event times and their session's start are converted in one go at the end
+    starts, ev_ts, ev_start = [], [], []
+    for n, ln in enumerate(lines):
+        ln = ln.strip()
+        if not ln:
+            continue
+        try:
+            entry = json.loads(ln)
+        except ValueError:
+            continue
+        if not isinstance(entry, dict):
+            continue
+        data = entry.get("data") if isinstance(entry.get("data"), dict) else {}
+        sid = entry.get("session_id") or f"{source}#{n}"
+        stored = transcript.raw(entry)
+        if isinstance(stored, dict):
+            # version 2 already stores offsets; old formats are converted below
+            starts.append(stored.get("t0") or entry.get("time"))
+            events = transcript.events(entry)
+        else:
+            starts.append(data.get("session_start") or entry.get("time"))
+            events = _timed_items(entry, stored)
+        commands = 0
+        for when, direction, text in events:
+            if direction in ("in", "recv"):
+                commands += 1
+            ev["session_id"].append(sid)
+            ev_ts.append(when)
+            ev_start.append(len(starts) - 1)
+            ev["dir"].append(direction)
+            ev["text"].append(str(text))
+        sess["time"].append(entry.get("time"))
+        sess["src_ip"].append(str(entry.get("src_ip", "")))
+        sess["service"].append(str(entry.get("service", "")))
+        sess["path"].append(str(entry.get("path", "")))
+        sess["method"].append(str(entry.get("method", "")))
+        sess["username"].append(str(data.get("username", "")))
+        sess["session_id"].append(sid)
+        sess["commands"].append(commands)
+        sess["ref"].append(transcript.ref(entry) or "")
+    if ev_ts:
+        known = np.array([isinstance(w, int) for w in ev_ts])
+        stamps = [None if k else w for k, w in zip(known, ev_ts)]
+        t, base = _to_us(stamps), _to_us(starts)[np.asarray(ev_start)]
+        bad = (t == NAT) | (base == NAT)
+        offset = np.where(bad, -1, (t - base) // 1000)
+        if known.any():
+            offset[known] = [w for w in ev_ts if isinstance(w, int)]
+        ev["offset"] = offset
+    return sess, ev
+
+def _timed_items(entry, stored):
+    """(timestamp string, dir, text) for old-style transcript lists and events."""
+    if isinstance(stored, list):
+        items, key = stored, "text"
+    else:
+        items, key = entry.get("events"), "data"
+    return [(item.get("ts") or item.get("time"), str(item.get("dir", "")), item.get(key) or "")
+            for item in (items if isinstance(items, list) else ()) if isinstance(item, dict)]
+
+def to_frame(cols):
+    df = pd.DataFrame(cols)
+    for c in df.columns:
+        if c in STRING_COLUMNS:
+            df[c] = df[c].astype("category")
+        elif c == "time":
+            df[c] = _to_us(df[c]).view("datetime64[us]")
+        else:
+            df[c] = df[c].astype("int32")
+    return df
+
+# --- Table I/O ---------------------------------------------------------
+def write_table(df, path, fmt=None):
+    """Write a frame as <path>.parquet or <path>/ (npy); returns the path written."""
+    fmt = pick_format(fmt or FORMAT)
+    if fmt == "parquet":
+        out = path + ".parquet"
+        tmp = out + ".tmp"
+        df.to_parquet(tmp, index=False, row_group_size=ROW_GROUP)
+        os.replace(tmp, out)
+        return out
+    tmp = path + ".tmp"
+    os.makedirs(tmp, exist_ok=True)
+    meta = {"rows": len(df), "columns": {}, "row_groups": []}
+    for c in df.columns:
+        col = df[c]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(tmp, f"{c}.npy"), col.cat.codes.to_numpy(np.int32))
+            with open(os.path.join(tmp, f"{c}.dict.json"), "w", encoding="utf-8") as f:
+                json.dump([str(v) for v in col.cat.categories], f)
+            meta["columns"][c] = "dict"
+        elif c == "time":
+            np.save(os.path.join(tmp, f"{c}.npy"), col.to_numpy("datetime64[us]").astype(np.int64))
+            meta["columns"][c] = "time"
+        else:
+            np.save(os.path.join(tmp, f"{c}.npy"), col.to_numpy())
+            meta["columns"][c] = "plain"
+    if "time" in df.columns:
+        t = df["time"].to_numpy("datetime64[us]").astype(np.int64)
+        for start in range(0, len(df), ROW_GROUP):
+            chunk = t[start:start + ROW_GROUP]
+            valid = chunk[chunk != NAT]
+            meta["row_groups"].append({"start": start, "stop": start + len(chunk),
+                                       "min": int(valid.min()) if len(valid) else None,
+                                       "max": int(valid.max()) if len(valid) else None})
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    if os.path.isdir(path):
+        import shutil
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+    return path
+
+def _time_value(v):
+    return np.datetime64(logstore.parse_time(v), "us").astype(np.int64)
+
+_OPS = {
+    "==": np.equal, "!=": np.not_equal, ">": np.greater, ">=": np.greater_equal,
+    "<": np.less, "<=": np.less_equal,
+}
+
+def _read_npy(path, columns, filters):
+    with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    kinds = meta["columns"]
+    columns = [c for c in (columns or kinds) if c in kinds]
+    dicts = {}
+
+    def load(c):
+        return np.load(os.path.join(path, f"{c}.npy"), mmap_mode="r")
+
+    def dictionary(c):
+        if c not in dicts:
+            with open(os.path.join(path, f"{c}.dict.json"), "r", encoding="utf-8") as f:
+                dicts[c] = json.load(f)
+        return dicts[c]
+
+    # row-group pruning on time, then an exact mask on what is left
+    groups = meta["row_groups"] or [{"start": 0, "stop": meta["rows"], "min": None, "max": None}]
+    for c, op, v in filters or ():
+        if c != "time" or op not in (">", ">=", "<", "<=", "=="):
+            continue
+        v = _time_value(v)
+        keep = []
+        for g in groups:
+            lo, hi = g["min"], g["max"]
+            if lo is None:
+                continue
+            if op in (">", ">=") and hi < v or op in ("<", "<=") and lo > v or op == "==" and not lo <= v <= hi:
+                continue
+            keep.append(g)
+        groups = keep
+    rows = np.concatenate([np.arange(g["start"], g["stop"]) for g in groups]) if groups else np.empty(0, np.int64)
+    for c, op, v in filters or ():
+        if c not in kinds or not len(rows):
+            continue
+        values = np.asarray(load(c)[rows])
+        if kinds[c] == "dict":
+            # compare codes: the strings are looked up once, not per row
+            d = dictionary(c)
+            lookup = {s: i for i, s in enumerate(d)}
+            if op == "in":
+                codes = [lookup[s] for s in v if s in lookup]
+                mask = np.isin(values, codes)
+            else:
+                mask = _OPS[op](values, lookup.get(v, -2))
+        else:
+            target = _time_value(v) if kinds[c] == "time" else v
+            mask = np.isin(values, list(target)) if op == "in" else _OPS[op](values, target)
+        rows = rows[mask]
+    out = {}
+    for c in columns:
+        values = np.asarray(load(c)[rows])
+        if kinds[c] == "dict":
+            out[c] = pd.Categorical.from_codes(values, categories=dictionary(c))
+        elif kinds[c] == "time":
+            out[c] = values.astype("datetime64[us]")
+        else:
+            out[c] = values
+    return pd.DataFrame(out, columns=columns)
+
+def read_table(path, columns=None, filters=None):
+    """Read a table written by write_table, loading only the `columns` it has
+    (tables written before a column was added lack it).
+
+    filters: [(column, op, value)] with op in == != > >= < <= in, ANDed
+    (the pyarrow/pandas convention; time values may be ISO strings).
+    """
+    if path.endswith(".parquet"):
+        pq_filters = [(c, "=" if op == "==" else op, pd.Timestamp(logstore.parse_time(v)) if c == "time" else v)
+                      for c, op, v in filters or ()] or None
+        if columns:
+            import pyarrow.parquet as pq
+            names = set(pq.read_schema(path).names)
+            columns = [c for c in columns if c in names]
+        return pd.read_parquet(path, columns=list(columns) if columns is not None else None, filters=pq_filters)
+    return _read_npy(path, columns, filters)
+
+# --- Compaction index --------------------------------------------------
+def load_index(log_dir):
+    try:
+        with open(os.path.join(columnar_dir(log_dir), INDEX_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {"version": 1, "segments": {}}
+
+def save_index(log_dir, index):
+    path = os.path.join(columnar_dir(log_dir), INDEX_NAME)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp, path)
+
+def tables_for(log_dir, segment, index=None):
+    """(sessions, events) table paths for a compacted segment, else None."""
+    index = index if index is not None else load_index(log_dir)
+    info = index["segments"].get(os.path.basename(str(segment)))
+    if info is None:
+        return None
+    base = columnar_dir(log_dir)
+    sessions, events = os.path.join(base, info["sessions"]), os.path.join(base, info["events"])
+    if not (os.path.exists(sessions) and os.path.exists(events)):
+        return None
+    return sessions, events
+
+def compact_segment(path, log_dir, fmt=None):
+    name = os.path.basename(str(path))
+    with logstore.open_log(path) as f:
+        sess, ev = flatten(f, source=name)
+    out = columnar_dir(log_dir)
+    os.makedirs(out, exist_ok=True)
+    sessions = write_table(to_frame(sess), os.path.join(out, name + ".sessions"), fmt)
+    events = write_table(to_frame(ev), os.path.join(out, name + ".events"), fmt)
+    return {"sessions": os.path.basename(sessions), "events": os.path.basename(events),
+            "rows": len(sess["time"]), "events_rows": len(ev["text"]), "compacted": time.time()}
+
+def compact(log_dir, paths=None, fmt=None, force=False):
+    """Compact the given files, or every closed segment in the manifest."""
+    log_dir = str(log_dir)
+    if paths is None:
+        paths = [os.path.join(log_dir, seg["file"]) for seg in logstore.load_manifest(log_dir)["segments"]]
+    index = load_index(log_dir)
+    done = []
+    for path in paths:
+        name = os.path.basename(str(path))
+        if not os.path.exists(path) or (not force and tables_for(log_dir, name, index)):
+            continue
+        t0 = time.perf_counter()
+        index["segments"][name] = compact_segment(path, log_dir, fmt)
+        save_index(log_dir, index)
+        done.append((name, index["segments"][name]["rows"], time.perf_counter() - t0))
+    return done
+
+# --- Queries used by the dashboard ---------------------------------------
+def session_frame(sessions_table, since=None, until=None, columns=SESSION_COLUMNS):
+    filters = []
+    if since is not None:
+        filters.append(("time", ">=", since))
+    if until is not None:
+        filters.append(("time", "<=", until))
+    return read_table(sessions_table, columns=columns, filters=filters)
+
+def received_tokens(events_table, session_ids=None):
+    """First token of each received text -> count, from the events table."""
+    from collections import Counter
+    filters = [("dir", "in", ["in", "recv"])]
+    if session_ids is not None:
+        filters.append(("session_id", "in", list(session_ids)))
+    ev = read_table(events_table, columns=["text"], filters=filters)
+    tokens = Counter()
+    # count distinct texts once, then split each only once
+    for text, n in ev["text"].astype(str).value_counts().items():
+        txt = text.strip()
+        if txt:
+            tokens[txt.split()[0]] += int(n)
+    return tokens
+
+def connection_minutes(frame):
+    """Sessions per minute ({UTC Timestamp: n}), from a sessions frame."""
+    from collections import Counter
+    times = pd.Series(frame["time"]).dropna()
+    if times.empty:
+        return Counter()
+    return Counter(times.dt.floor("min").dt.tz_localize("UTC").value_counts().to_dict())
+
+def session_stubs(frame, events_table):
+    """Log-entry shaped dicts without transcripts; load_session() fills one in."""
+    times = pd.Series(frame["time"]).dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ").tolist()
+    cols = [frame[c].astype(str).tolist() for c in ("session_id", "src_ip", "service", "path", "method", "username")]
+    return [
+        {"time": t, "session_id": sid, "src_ip": ip, "service": svc, "path": path, "method": method,
+         "data": {"username": user}, "_events": events_table}
+        for t, sid, ip, svc, path, method, user in zip(times, *cols)
+    ]
+
+def load_session(stub):
+    """The stub with its transcript (a version 2 record) read from the events table."""
+    ev = read_table(stub["_events"], columns=["offset", "dir", "text"],
+                    filters=[("session_id", "==", stub["session_id"])])
+    session = {k: v for k, v in stub.items() if k != "_events"}
+    # the tables keep offsets, not the session start, so t0 is unknown here
+    session["data"] = dict(stub["data"], transcript=transcript.make_record(
+        None, zip(ev["offset"].tolist(), map(str, ev["dir"]), map(str, ev["text"]))))
+    return session
+
+def main():
+    p = argparse.ArgumentParser(description="Compact closed JSONL log segments into columnar tables.")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("compact", help="Compact closed segments (default: all in the manifest)")
+    c.add_argument("files", nargs="*")
+    c.add_argument("--log-dir", default="logs")
+    c.add_argument("--format", choices=("auto", "parquet", "npy"), default=FORMAT)
+    c.add_argument("--force", action="store_true", help="Rebuild tables that already exist")
+    c.add_argument("--every", type=float, default=0, help="Keep running, compacting every N seconds")
+    args = p.parse_args()
+    while True:
+        for name, rows, secs in compact(args.log_dir, args.files or None, args.format, args.force):
+            print(f"{name}: {rows} sessions in {secs:.1f}s")
+        if not args.every:
+            break
+        time.sleep(args.every)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+# conftest.py - pytest setup shared by the test_*.py files
+#
+# test_requests.py is a standalone network check (run it with python), not a
+# test module.
+collect_ignore = ["test_requests.py"]
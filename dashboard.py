@@ -7,10 +7,18 @@ Run: streamlit run dashboard.py
 """
 import streamlit as st
 from pathlib import Path
-import json
+from collections import Counter
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, time as dtime
 import subprocess
+import clusters
+import ipenrich
+import livefeed
+import logstore
+import rollups
+import sessionbrowser
+import transcript
+import transcriptstore
 
 # Page config
 st.set_page_config(page_title="Virtual IoT Honeypot", layout="wide", initial_sidebar_state="expanded")
@@ -21,67 +29,32 @@ LOG_DIR.mkdir(exist_ok=True)
 
 SERVICE_FIELD = "service"
 DEFAULT_SERVICE_NAME = "virtual-iot-honeypot"
+ALL_SEGMENTS = "All files (time range)"
+LIVE_REFRESH = 2  # seconds between live view updates (Streamlit versions with st.fragment)
 
 # --- Utilities ---------------------------------------------------------
 def list_log_files(log_dir: Path):
     if not log_dir.exists():
         return []
-    files = [p for p in log_dir.iterdir() if p.suffix in (".jsonl", ".json")]
+    # plain and compressed (rotated) segments, but not the manifest itself
+    files = [p for p in log_dir.iterdir() if logstore.is_log_file(p.name)]
     return sorted(files, key=lambda x: x.stat().st_mtime, reverse=True)
 
-def load_jsonl(path: Path):
-    sessions = []
-    try:
-        with path.open("r", encoding="utf-8", errors="replace") as f:
-            for ln in f:
-                ln = ln.strip()
-                if not ln:
-                    continue
-                try:
-                    sessions.append(json.loads(ln))
-                except Exception:
-                    # skip malformed lines
-                    st.session_state.setdefault("_warnings", []).append(f"Skipped invalid JSON in {path.name}")
-    except FileNotFoundError:
-        st.error(f"File not found: {path}")
-    return sessions
-
-def extract_transcript(session):
-    if not isinstance(session, dict):
-        return ""
-    # direct 'transcript'
-    if "transcript" in session and session["transcript"]:
-        return session["transcript"] if isinstance(session["transcript"], str) else json.dumps(session["transcript"], indent=2)
-    # events array
-    if "events" in session and isinstance(session["events"], list):
-        lines = []
-        for e in session["events"]:
-            if isinstance(e, dict):
-                t = e.get("time", "")
-                d = e.get("dir", "")
-                msg = e.get("data") or e.get("payload") or e.get("message") or ""
-                # simple color hints: recv (client) vs send (server) with emojis
-                prefix = "👤" if d == "recv" else "💻" if d == "send" else ""
-                time_str = f"[{t}] " if t else ""
-                lines.append(f"{time_str}{prefix} {msg.strip()}")
-            else:
-                lines.append(str(e))
-        return "\n".join(lines).strip()
-    # http-style: request.body
-    if "request" in session and isinstance(session["request"], dict):
-        req = session["request"]
-        first = f"{req.get('method','')} {req.get('path','')}".strip()
-        body = req.get("body")
-        if body:
-            return f"{first}\n\n{json.dumps(body, indent=2) if isinstance(body, (dict, list)) else str(body)}"
-        return first
-    # fallback: stringify known keys
-    for key in ("payload", "body", "data"):
-        if key in session and session[key]:
-            val = session[key]
-            return json.dumps(val, indent=2) if isinstance(val, (dict, list)) else str(val)
-    # nothing found
-    return ""
+@st.cache_resource
+def get_session_browser(log_dir):
+    # per-file row tables for the session list and the panels, grown as the
+    # logs grow; one set shared by every rerun (and browser tab) of this server
+    return sessionbrowser.SessionBrowser(log_dir)
+
+@st.cache_resource
+def get_cluster_index(log_dir):
+    # shared by reruns and sessions; refreshed in place with what was logged since
+    return clusters.ClusterIndex.load(clusters.state_path(log_dir))
+
+@st.cache_resource
+def get_live_feed(path):
+    # one subscriber per socket path, shared by every rerun and browser tab
+    return livefeed.Subscriber(path)
 
 def readable_time(ts):
     try:
@@ -89,64 +62,159 @@ def readable_time(ts):
     except Exception:
         return ts or "N/A"
 
+def show_live(feed):
+    feed.start()  # picks up publishers (workers) started since the last update
+    snap = feed.snapshot()
+    cols = st.columns(3)
+    cols[0].metric("Open sessions", len(snap["live"]))
+    cols[1].metric("Events received", snap["received"])
+    cols[2].metric("Publishers", snap["connected"])
+    if snap["live"]:
+        st.dataframe(pd.DataFrame(snap["live"]), use_container_width=True)
+    if snap["ended"]:
+        st.markdown("**Recently ended**")
+        st.dataframe(pd.DataFrame(snap["ended"]).head(20), use_container_width=True)
+    if snap["events"]:
+        st.markdown("**Latest events**")
+        st.dataframe(pd.DataFrame(snap["events"]), use_container_width=True)
+    elif not snap["connected"]:
+        st.caption(f"Waiting for a honeypot publishing on {feed.path}")
+
+# redrawn on its own every LIVE_REFRESH seconds where supported; the rest of
+# the page (and the log files) is not touched by these updates
+if hasattr(st, "fragment"):
+    show_live = st.fragment(run_every=LIVE_REFRESH)(show_live)
+
 # --- Sidebar -----------------------------------------------------------
 st.sidebar.title("📊 Virtual IoT Honeypot")
+live_path = st.sidebar.text_input("Live events socket", value=livefeed.SOCKET_PATH,
+                                  help="--live-socket of the running honeypot (HONEYPOT_LIVE_SOCKET)").strip()
+if live_path:
+    with st.expander("🟢 Live sessions", expanded=True):
+        show_live(get_live_feed(live_path))
+
 files = list_log_files(LOG_DIR)
 if not files:
     st.sidebar.warning("No log files found in /logs/. Create logs/ and run the honeypot to generate sessions.")
     st.stop()
 
-selected_file = st.sidebar.selectbox("Select log file", [f.name for f in files])
-log_path = LOG_DIR / selected_file
+selected_file = st.sidebar.selectbox("Select log file", [f.name for f in files] + [ALL_SEGMENTS])
+if selected_file == ALL_SEGMENTS:
+    # the manifest lets us skip rotated segments outside the range unopened
+    today = datetime.utcnow().date()
+    picked = st.sidebar.date_input("Time range (UTC)", value=(today, today))
+    start_day, end_day = (picked if isinstance(picked, (list, tuple)) and len(picked) == 2 else (picked, picked))
+    since = datetime.combine(start_day, dtime.min)
+    until = datetime.combine(end_day, dtime.max)
+    seg_paths = [Path(p) for p in logstore.select_segments(LOG_DIR, since, until)]
+    st.sidebar.caption(f"Reading {len(seg_paths)} of {len(files)} log files")
+    log_path = seg_paths[0] if seg_paths else files[0]
+else:
+    log_path = LOG_DIR / selected_file
+    seg_paths, since, until = [log_path], None, None
+
+# narrow the browser (and the panels) to one address or session
+with st.sidebar.expander("Find sessions"):
+    find_ip = st.text_input("Source IP").strip() or None
+    find_sid = st.text_input("Session ID").strip() or None
+
+# the session list and every panel are counted from the browser's row tables:
+# only bytes appended since the last rerun are parsed, compacted segments are
+# read from their columnar tables, and only entries in the time range become
+# rows; a find reads just the matching entries through the sidecar indexes
+browser = get_session_browser(str(LOG_DIR))
+browse_paths = [str(p) for p in seg_paths]
+if find_ip or find_sid:
+    browse_tables = browser.find(browse_paths, ip=find_ip, session_id=find_sid, since=since, until=until)
+else:
+    browse_tables = browser.tables(browse_paths, since, until)
+st.sidebar.caption(
+    f"Row tables: {browser.last_ms:.1f} ms for {len(browse_tables)} files · "
+    f"cache hits {browser.hits}, tail reads {browser.tails}, loads {browser.loads}"
+)
 
-sessions = load_jsonl(log_path)
-st.sidebar.metric("Sessions (lines)", len(sessions))
+# the logger keeps rollups for the files it writes: the panels then cost the
+# same however large the log (and its rotated segments) has grown
+rollup = rollups.load(LOG_DIR, selected_file) if selected_file != ALL_SEGMENTS and not (find_ip or find_sid) else None
+use_rollup = rollup is not None and st.sidebar.checkbox("Panels from rollups (whole log history)", value=True)
+if use_rollup:
+    st.sidebar.caption(f"Rollups: {rollup.total} sessions since {readable_time(rollup.first or '')}")
 
 # show first-line diagnostic to help debug formats
 with st.sidebar.expander("File diagnostic"):
     try:
-        first_line = log_path.read_text(encoding="utf-8", errors="replace").splitlines()[0]
+        with logstore.open_log(log_path) as f:
+            first_line = f.readline().rstrip("\n")
     except Exception as e:
         first_line = f"Could not read file: {e}"
     st.code(first_line[:1000] + ("..." if len(first_line) > 1000 else ""))
 
-# quick df for charts
-df = None
-if sessions:
-    try:
-        df = pd.json_normalize(sessions)
-    except Exception:
-        df = None
-
-if df is not None:
-    if "src_ip" in df.columns:
-        st.sidebar.subheader("🌍 Top Source IPs")
-        st.sidebar.bar_chart(df["src_ip"].value_counts().head(8))
-    if "service" in df.columns:
-        st.sidebar.subheader("🔎 Services")
-        st.sidebar.bar_chart(df["service"].value_counts().head(8))
-
-st.sidebar.markdown("---")
-if st.sidebar.button("Refresh view"):
-    st.experimental_rerun()
-st.sidebar.caption("Click Refresh after new sessions are written to disk.")
-
 # --- Main layout -------------------------------------------------------
 st.markdown("<h1 style='text-align:left'>Virtual IoT Honeypot Dashboard</h1>", unsafe_allow_html=True)
 st.markdown("**A lightweight interactive dashboard for analyzing honeypot sessions.**")
 
-if not sessions:
+if not any(len(t) for t in browse_tables):
     st.info("This file contains no valid JSON session lines.")
     st.stop()
 
-# session selector
-session_options = [
-    f"{i+1}. {s.get('src_ip','?')} | {s.get('service',DEFAULT_SERVICE_NAME)} | {s.get('time','')}"
-    for i, s in enumerate(sessions)
-]
-sel_index = st.selectbox("Select session to view", range(len(sessions)), format_func=lambda i: session_options[i])
+# session browser: filtered, sorted and paged on the server; only the shown
+# page becomes rows, and the selected session is read back from its file
+with st.expander("🔎 Browse sessions", expanded=True):
+    fcols = st.columns([2, 2, 2, 2])
+    f_ip = fcols[0].text_input("Source IP or CIDR", value=find_ip or "")
+    f_service = fcols[1].multiselect("Service", browser.services(browse_tables))
+    f_user = fcols[2].text_input("Username contains")
+    f_cmd = fcols[3].text_input("Command contains")
+    fcols = st.columns([2, 2, 2, 2])
+    f_since = fcols[0].text_input("From (UTC, ISO)", placeholder="2026-10-01T00:00")
+    f_until = fcols[1].text_input("To (UTC, ISO)")
+    f_sort = fcols[2].selectbox("Sort by", sessionbrowser.SORTS)
+    # the sidebar's time range and the browser's own, whichever is narrower
+    b_since = max(filter(None, (since, logstore.parse_time(f_since) if f_since else None)), default=None)
+    b_until = min(filter(None, (until, logstore.parse_time(f_until) if f_until else None)), default=None)
+    matches = browser.query(browse_tables, ip=f_ip or None, service=f_service, username=f_user or None,
+                            since=b_since, until=b_until, command=f_cmd or None, session_id=find_sid, sort=f_sort)
+    page_no = fcols[3].number_input(f"Page (of {matches.pages})", min_value=1, max_value=matches.pages, value=1) - 1
+    page_rows = matches.page(page_no)
+    st.caption(f"{matches.total} matching sessions · {sessionbrowser.PAGE_SIZE} per page")
+    if page_rows:
+        st.dataframe(pd.DataFrame([{k: v for k, v in r.items() if not k.startswith("_")} for r in page_rows]),
+                     use_container_width=True)
+
+# sidebar panels: the sessions matching the browser's filters, or the rollups
+if use_rollup:
+    ip_counts = pd.Series(dict(rollup.ips.top(8)), dtype="int64")
+    service_counts = pd.Series(dict(rollup.services.most_common(8)), dtype="int64")
+    token_counts = Counter(dict(rollup.tokens.top(6)))
+    minute_counts = {pd.Timestamp(m, tz="UTC"): n for m, n in rollup.minutes.items()}
+    distinct_hours = pd.Series({pd.Timestamp(h + ":00", tz="UTC"): n for h, n in rollup.distinct_ips().items()}, dtype="int64")
+else:
+    ip_counts = pd.Series(dict(matches.counts("src_ip").most_common(8)), dtype="int64")
+    service_counts = pd.Series(dict(matches.counts("service").most_common(8)), dtype="int64")
+    token_counts, minute_counts, distinct_hours = matches.tokens(), matches.minutes(), None
+st.sidebar.metric("Sessions (matching)", matches.total)
+if not ip_counts.empty:
+    st.sidebar.subheader("🌍 Top Source IPs")
+    st.sidebar.bar_chart(ip_counts)
+if not service_counts.empty:
+    st.sidebar.subheader("🔎 Services")
+    st.sidebar.bar_chart(service_counts)
+if distinct_hours is not None and not distinct_hours.empty:
+    st.sidebar.subheader("🧮 Distinct IPs per hour")
+    st.sidebar.line_chart(distinct_hours.sort_index())
+
+st.sidebar.markdown("---")
+if st.sidebar.button("Refresh view"):
+    st.experimental_rerun()
+st.sidebar.caption("Click Refresh after new sessions are written to disk.")
 
-session = sessions[sel_index]
+if not page_rows:
+    st.info("No sessions match these filters.")
+    st.stop()
+start_no = page_no * sessionbrowser.PAGE_SIZE
+sel_index = st.selectbox("Select session to view", range(len(page_rows)), format_func=lambda i: (
+    f"{start_no + i + 1}. {page_rows[i]['src_ip']} | {page_rows[i]['service'] or DEFAULT_SERVICE_NAME} | {page_rows[i]['time']}"))
+session = browser.load(page_rows[sel_index])
 
 # top metadata row
 st.subheader("Session Overview")
@@ -166,10 +234,10 @@ with left:
 
 with right:
     st.markdown("#### 💬 Transcript")
-    transcript = extract_transcript(session)
-    if transcript:
+    transcript_text = transcript.to_text(session)
+    if transcript_text:
         # nice monospaced transcript box
-        st.code(transcript, language=None)
+        st.code(transcript_text, language=None)
     else:
         st.info("No readable transcript found. Inspect raw JSON to locate payloads or HTTP body.")
 
@@ -178,16 +246,8 @@ st.markdown("---")
 st.subheader("Quick Insights")
 ins_cols = st.columns(3)
 try:
-    # top commands/triggers (naive)
-    commands = []
-    for s in sessions:
-        if isinstance(s, dict) and "events" in s:
-            for ev in s["events"]:
-                if isinstance(ev, dict) and ev.get("dir") == "recv":
-                    txt = ev.get("data","").strip()
-                    if txt:
-                        commands.append(txt.split()[0] if len(txt.split())>0 else txt)
-    top_cmds = pd.Series(commands).value_counts().head(6) if commands else None
+    # top commands/triggers (naive), counted over the browser's matching rows
+    top_cmds = pd.Series(dict(token_counts.most_common(6))) if token_counts else None
     if top_cmds is not None and not top_cmds.empty:
         ins_cols[0].markdown("**Top received tokens**")
         ins_cols[0].bar_chart(top_cmds)
@@ -198,18 +258,10 @@ except Exception:
 
 # connections timeline preview
 try:
-    times = []
-    for s in sessions:
-        t = s.get("time")
-        if t:
-            try:
-                times.append(pd.to_datetime(t))
-            except Exception:
-                pass
-    if times:
-        ts = pd.Series(1, index=pd.DatetimeIndex(times))
+    if minute_counts:
+        ts = pd.Series(minute_counts).sort_index()
         ins_cols[1].markdown("**Connections over time**")
-        ins_cols[1].line_chart(ts.resample("1T").sum().fillna(0))
+        ins_cols[1].line_chart(ts.resample("1min").sum().fillna(0))
     else:
         ins_cols[1].markdown("**Connections over time**\n_No data_")
 except Exception:
@@ -219,6 +271,96 @@ ins_cols[2].markdown("**Session Details**")
 ins_cols[2].write(f"Session ID: `{session.get('session_id','-')}`")
 ins_cols[2].write(f"Src port: {session.get('src_port','-')}")
 
+# campaigns: sessions that replayed the same transcript share its store hash
+st.markdown("---")
+st.subheader("🧬 Campaigns")
+if rollup is not None and rollup.campaigns.counts:
+    campaigns = rollup.campaigns.top(20)
+    campaign_total = rollup.total
+else:
+    campaigns = matches.counts("ref").most_common(20)
+    campaign_total = matches.total
+if campaigns:
+    rows = []
+    for h, n in campaigns:
+        pairs = transcriptstore.get(h) or ()
+        sent = " ; ".join(t for d, t in pairs if d == "i" and t != "<password>")
+        rows.append({"campaign": h[:12], "sessions": n, "share %": round(100.0 * n / max(campaign_total, 1), 1),
+                     "events": len(pairs), "client input": sent[:160]})
+    st.dataframe(pd.DataFrame(rows), use_container_width=True)
+    picked = st.selectbox("Show campaign transcript", [h for h, _ in campaigns], format_func=lambda h: h[:12])
+    with st.expander("Stored transcript", expanded=False):
+        st.code("\n".join(f"{'IN ' if d == 'i' else 'OUT' if d == 'o' else '---'} {t}"
+                          for d, t in transcriptstore.get(picked) or ()), language=None)
+else:
+    st.caption("No deduplicated transcripts in this view yet.")
+
+# approximate campaigns: sessions with similar input, over every log in logs/ (see clusters.py)
+st.markdown("---")
+st.subheader("🕸️ Similar sessions")
+with st.spinner("Clustering new sessions..."):
+    cluster_index, _ = clusters.refresh(LOG_DIR, get_cluster_index(str(LOG_DIR)))
+top_clusters = cluster_index.top(30, min_size=2)
+if top_clusters:
+    st.caption(f"{len(cluster_index.clusters)} clusters over {cluster_index.sessions} sessions in all logs "
+               f"({cluster_index.empty} sessions without input)")
+    st.dataframe(pd.DataFrame([{
+        "cluster": c["id"], "sessions": c["size"], "IPs": c["distinct_ips"],
+        "first seen": readable_time(c["first"] or ""), "last seen": readable_time(c["last"] or ""),
+        "span h": round(c["span_seconds"] / 3600, 1), "services": ", ".join(sorted(c["services"])),
+        "client input": " ; ".join(c["rep"]["inputs"])[:160]} for c in top_clusters]), use_container_width=True)
+    picked_cluster = st.selectbox("Show cluster", [c["id"] for c in top_clusters])
+    shown = cluster_index.summary(picked_cluster)
+    with st.expander("Representative session and member IPs", expanded=False):
+        rep = shown["rep"]
+        st.write(f"Session `{rep['session_id']}` from {rep['src_ip']} at {readable_time(rep['time'] or '')} ({rep['source']})")
+        st.code("\n".join(f"IN  {line}" for line in rep["inputs"]), language=None)
+        st.dataframe(pd.DataFrame(Counter(shown["ips"]).most_common(), columns=["src_ip", "sessions"]),
+                     use_container_width=True)
+else:
+    st.caption("No clusters with more than one session yet.")
+
+# indicators extracted inline as sessions were recorded (see ioc.py)
+st.markdown("---")
+st.subheader("🧪 Indicators")
+if rollup is not None and rollup.iocs.rows:
+    ioc_table = rollup.iocs
+else:
+    ioc_table = matches.iocs()
+if ioc_table.rows:
+    kinds = sorted({k.split(":", 1)[0] for k in ioc_table.rows})
+    ioc_kind = st.selectbox("Kind", ["all"] + kinds)
+    top_iocs = ioc_table.top(200, None if ioc_kind == "all" else ioc_kind)
+    st.dataframe(pd.DataFrame(top_iocs, columns=["kind", "value", "first seen", "last seen", "hits"]),
+                 use_container_width=True)
+else:
+    st.caption("No indicators extracted in this view yet.")
+
+# where sessions come from: ASN and country from the offline enrichment database (see ipenrich.py)
+st.markdown("---")
+st.subheader("🏢 Origin networks")
+if rollup is not None and (rollup.asns.counts or rollup.countries):
+    asn_counts, country_counts = Counter(dict(rollup.asns.top(15))), rollup.countries
+    origin_total = rollup.total
+else:
+    # one enrichment lookup per distinct address of the matching rows
+    asn_counts, country_counts = Counter(), Counter()
+    for ip, n in matches.counts("src_ip").items():
+        info = ipenrich.lookup(ip)
+        asn_counts[ipenrich.asn_label(info) or "unknown"] += n
+        country_counts[str(info.get("country") or "unknown")] += n
+    origin_total = matches.total
+if any(k != "unknown" for k in list(asn_counts) + list(country_counts)):
+    origin_cols = st.columns(2)
+    origin_cols[0].markdown("**Sessions per ASN**")
+    origin_cols[0].dataframe(pd.DataFrame(
+        [{"asn": k, "sessions": n, "share %": round(100.0 * n / max(origin_total, 1), 1)}
+         for k, n in asn_counts.most_common(15)]), use_container_width=True)
+    origin_cols[1].markdown("**Sessions per country**")
+    origin_cols[1].bar_chart(pd.Series(dict(country_counts.most_common(15)), dtype="int64"))
+else:
+    st.caption("No enrichment data: put CIDR files in enrich/ (see the readme) and run `python3 ipenrich.py build`.")
+
 # Replay command area
 st.markdown("---")
 st.subheader("▶️ Replay / Shell Command")
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# honeypot.py - run every listener (telnet, HTTP, banner decoys) on one event loop
+#
+#   python3 honeypot.py                      # listeners.json
+#   python3 honeypot.py --config my.json --loop uvloop
+#
+# The config lists listeners:
+#
+#   {"listeners": [
+#     {"name": "telnet", "protocol": "telnet", "port": 2323, "persona": "routeros"},
+#     {"name": "http", "protocol": "http", "port": 8080},
+#     {"name": "ssh", "protocol": "banner", "port": 2222, "banner": "SSH-2.0-dropbear\r\n"},
+#     {"name": "misc", "protocol": "banner", "ports": [5555, 7547], "banner": ""}]}
+#
+# "telnet" runs telenet_server.handle_client with the given persona, "http"
+# serves server.app through an aiohttp AppRunner, and "banner" sends a fixed
+# banner, keeps whatever the client sends first and logs it. All listeners
+# share one logger writer, so this is one process instead of one per port.
+import argparse
+import asyncio
+import json
+import os
+import signal
+from collections import Counter
+
+import ioc
+import livefeed
+import logger
+import metrics
+import shell
+import tarpit
+import telenet_server
+from logger import log_request_async
+
+try:
+    import uvloop
+except ImportError:  # optional: the default asyncio loop works the same
+    uvloop = None
+
+CONFIG_FILE = os.environ.get("HONEYPOT_LISTENERS", "listeners.json")
+PROTOCOLS = ("telnet", "http", "banner")
+HOST = "0.0.0.0"
+# banner decoys: how long and how much of the client's first bytes to keep
+DECOY_READ_TIMEOUT = float(os.environ.get("HONEYPOT_DECOY_READ_TIMEOUT", "10"))
+DECOY_MAX_BYTES = int(os.environ.get("HONEYPOT_DECOY_MAX_BYTES", "1024"))
+DECOY_SERVICE = "virtual-iot-decoy"
+REPORT_INTERVAL = float(os.environ.get("HONEYPOT_LISTENER_REPORT_INTERVAL", "300"))
+
+LISTENER_CONNECTIONS = metrics.Counter("honeypot_listener_connections_total",
+                                       "Connections (HTTP: requests) accepted per listener", labels=("listener",))
+
+class Listener:
+    """One configured port and what answers on it."""
+
+    def __init__(self, name, protocol, port, host=HOST, persona=None, banner="", service=None):
+        self.name = name
+        self.protocol = protocol
+        self.port = port
+        self.host = host
+        self.persona = persona
+        self.banner = banner
+        self.service = service
+        self.connections = 0
+        self.counter = LISTENER_CONNECTIONS.labels(name)
+
+    def count(self):
+        self.connections += 1
+        self.counter.inc()
+
+def persona_path(name):
+    """A persona file path, or the name of one in personas/ ("routeros")."""
+    if os.sep in name or name.endswith(".json"):
+        return name
+    return os.path.join(shell.PERSONA_DIR, f"{name}.json")
+
+def load_config(path):
+    """Listener objects from a JSON config; "ports" expands to one listener per port."""
+    with open(path, "r", encoding="utf-8") as f:
+        cfg = json.load(f)
+    listeners, names = [], set()
+    for item in cfg.get("listeners", []):
+        protocol = item.get("protocol")
+        if protocol not in PROTOCOLS:
+            raise ValueError(f"listener {item.get('name')!r}: protocol must be one of {', '.join(PROTOCOLS)}")
+        ports = item.get("ports") or [item.get("port")]
+        for port in ports:
+            if not isinstance(port, int):
+                raise ValueError(f"listener {item.get('name')!r}: missing or invalid port")
+            name = item.get("name", protocol)
+            if len(ports) > 1:
+                name = f"{name}:{port}"
+            if name in names:
+                raise ValueError(f"duplicate listener name {name!r}")
+            names.add(name)
+            listeners.append(Listener(name, protocol, port, item.get("host", HOST), item.get("persona"),
+                                      item.get("banner", ""), item.get("service")))
+    if not listeners:
+        raise ValueError(f"{path}: no listeners configured")
+    return listeners
+
+# --- Handlers ----------------------------------------------------------------
+def telnet_handler(listener, persona):
+    async def handle(reader, writer):
+        listener.count()
+        await telenet_server.handle_client(reader, writer, persona)
+    return handle
+
+def banner_handler(listener):
+    banner = listener.banner.encode("latin-1", errors="replace")
+    service = listener.service or DECOY_SERVICE
+
+    async def handle(reader, writer):
+        listener.count()
+        peer = writer.get_extra_info("peername")
+        src_ip = peer[0] if peer else "unknown"
+        session_id = logger.new_session_id()
+        livefeed.publish("start", session_id, src_ip, service, listener=listener.name)
+        received = b""
+        try:
+            if banner:
+                writer.write(banner)
+                await asyncio.wait_for(writer.drain(), DECOY_READ_TIMEOUT)
+            # scanners usually send their probe right away; keep the first read
+            received = await asyncio.wait_for(reader.read(DECOY_MAX_BYTES), DECOY_READ_TIMEOUT)
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.transport.abort()
+        text = received.decode("latin-1")
+        data = {"listener": listener.name, "banner": listener.banner, "received": text}
+        if text and ioc.EXTRACTOR is not None:
+            iocs = ioc.to_record(ioc.EXTRACTOR.scan(text))
+            if iocs:
+                data["iocs"] = iocs
+        await log_request_async(src_ip, service, f"/port/{listener.port}", "CONNECT", data, session_id)
+        livefeed.publish("end", session_id, src_ip, service, received=len(received))
+    return handle
+
+def http_counter(listeners):
+    """on_response_prepare hook counting requests per HTTP listener port."""
+    by_port = {l.port: l for l in listeners}
+
+    async def count(request, response):
+        sock = request.transport.get_extra_info("sockname") if request.transport else None
+        listener = by_port.get(sock[1]) if sock else None
+        if listener is not None:
+            listener.count()
+    return count
+
+# --- Host ----------------------------------------------------------------------
+def print_counts(listeners):
+    counts = Counter()
+    for l in listeners:
+        counts[l.protocol] += l.connections
+    parts = ", ".join(f"{l.name}={l.connections}" for l in listeners if l.connections)
+    print(f"Connections: {dict(counts)} ({parts or 'none yet'})")
+
+async def report_listeners(listeners, interval=REPORT_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        print_counts(listeners)
+
+async def main(listeners, metrics_port=None, metrics_host="127.0.0.1", live_socket=None):
+    await logger.start_writer()
+    await livefeed.start(live_socket)
+    loop = asyncio.get_running_loop()
+    servers, runner, background = [], None, []
+    personas = {}
+    if metrics_port:
+        # before any listener starts, so their counters are live
+        metrics.enable()
+    try:
+        for l in listeners:
+            if l.protocol == "telnet":
+                path = persona_path(l.persona) if l.persona else telenet_server.PERSONA_FILE
+                if path not in personas:
+                    personas[path] = shell.load_persona(path)
+                server = await asyncio.start_server(telnet_handler(l, personas[path]), l.host, l.port,
+                                                    limit=telenet_server.MAX_LINE)
+                servers.append(server)
+            elif l.protocol == "banner":
+                servers.append(await asyncio.start_server(banner_handler(l), l.host, l.port, limit=DECOY_MAX_BYTES))
+        http = [l for l in listeners if l.protocol == "http"]
+        if http:
+            from aiohttp import web
+            import server as http_server
+            http_server.app.on_response_prepare.append(http_counter(http))
+            runner = web.AppRunner(http_server.app)
+            await runner.setup()
+            for l in http:
+                await web.TCPSite(runner, l.host, l.port).start()
+        if any(l.protocol == "telnet" for l in listeners):
+            background.append(loop.create_task(telenet_server.report_rejections()))
+        if metrics_port:
+            servers.append(await metrics.start_listener(metrics_host, metrics_port))
+        if metrics.ENABLED:
+            background.append(loop.create_task(metrics.monitor_loop_lag()))
+        if REPORT_INTERVAL > 0:
+            background.append(loop.create_task(report_listeners(listeners)))
+
+        loop_name = type(loop).__module__.split(".")[0]
+        print(f"Honeypot host (PID {os.getpid()}, {loop_name} loop): {len(listeners)} listeners")
+        for l in listeners:
+            print(f"  {l.name:12s} {l.protocol:7s} {l.host}:{l.port}")
+        if livefeed.PUBLISHER is not None:
+            print(f"Live events on {livefeed.PUBLISHER.path}")
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+    finally:
+        for server in servers:
+            server.close()
+        for task in background:
+            task.cancel()
+        if runner is not None:
+            await runner.cleanup()
+        rejected = telenet_server.ADMISSION.take_report()
+        if rejected:
+            await log_request_async("-", telenet_server.SERVICE, "/telnet", "REJECTED", rejected)
+        await tarpit.shutdown()
+        livefeed.stop()
+        # flush queued sessions from every listener before exiting
+        await logger.stop_writer()
+        print_counts(listeners)
+
+def cli():
+    ap = argparse.ArgumentParser(description="Run all honeypot listeners in one process.")
+    ap.add_argument("--config", default=CONFIG_FILE, help=f"Listener config (default {CONFIG_FILE})")
+    ap.add_argument("--loop", choices=("auto", "asyncio", "uvloop"), default="auto",
+                    help="Event loop: uvloop when installed (auto), or force one")
+    ap.add_argument("--metrics-port", type=int, help="Serve Prometheus /metrics on this local port")
+    ap.add_argument("--metrics-host", default="127.0.0.1")
+    ap.add_argument("--tarpit", action="store_true", help="Hold matching sessions in the tarpit (also HONEYPOT_TARPIT=1)")
+    ap.add_argument("--live-socket", help="Publish live session events on this Unix socket (also HONEYPOT_LIVE_SOCKET)")
+    args = ap.parse_args()
+    if args.tarpit:
+        tarpit.enable()
+    try:
+        listeners = load_config(args.config)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"Bad listener config: {e}")
+    if args.loop == "uvloop" and uvloop is None:
+        raise SystemExit("--loop uvloop: uvloop is not installed (pip install uvloop)")
+    if uvloop is not None and args.loop != "asyncio":
+        uvloop.install()
+    asyncio.run(main(listeners, args.metrics_port, args.metrics_host,
+                     args.live_socket or livefeed.SOCKET_PATH or None))
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,189 @@
+# ioc.py - inline indicator-of-compromise extraction from inbound commands
+#
+# Every line a client sends is scanned once as it arrives:
+#
+# - an Aho-Corasick automaton built from signatures.json finds every known
+#   string (malware family tokens such as "/bin/busybox ECCHI", dropper
+#   techniques) in a single pass; the cost per character does not grow with
+#   the number of signatures;
+# - one combined regex pulls out URLs, IPv4 addresses, file hashes, dropped
+#   file names and encoded blobs.
+#
+# The session keeps what was found and logs it as "iocs":
+#
+#   {"signatures": ["mirai-ecchi"], "families": ["Mirai"],
+#    "urls": ["http://198.51.100.7/bins/mips"], "ips": ["198.51.100.7"], "files": [".m"]}
+#
+# and rollups keep the deduplicated IOC table (first/last seen, hits).
+import json
+import os
+import re
+from collections import deque
+
+BASE_DIR = os.path.dirname(__file__)
+SIGNATURE_FILE = os.environ.get("HONEYPOT_SIGNATURES", os.path.join(BASE_DIR, "signatures.json"))
+ENABLED = os.environ.get("HONEYPOT_IOC", "1") not in ("", "0", "false", "no")
+MAX_PER_KIND = 32     # values kept per kind and session
+BLOB_PREFIX = 48      # encoded blobs are logged as their first characters and length
+MEMO_SIZE = 4096
+MEMO_MAX_LINE = 1024  # longer lines are scanned but not memoized
+KINDS = ("signatures", "families", "urls", "ips", "hashes", "files", "blobs")
+
+class AhoCorasick:
+    """Multi-pattern matcher: goto tries with failure links, case-insensitive.
+
+    States are list indexes; each has a dict of transitions, a failure link
+    and the (pattern ids) that end there, including those inherited through
+    the failure chain, so a search is one loop over the text.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        goto, fail, out = [{}], [0], [[]]
+        for pid, pattern in enumerate(self.patterns):
+            state = 0
+            for ch in pattern.lower():
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    fail.append(0)
+                    out.append([])
+                state = nxt
+            out[state].append(pid)
+        # breadth-first: a state's failure link is final before its children's
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt].extend(out[fail[nxt]])
+        self.goto = goto
+        self.fail = fail
+        self.out = [tuple(o) for o in out]
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def search(self, text):
+        """Ids of the patterns found in `text` (each once), in order of first match."""
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        found = {}
+        for ch in text.lower():
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                for pid in out[state]:
+                    found.setdefault(pid, None)
+        return list(found)
+
+_IPV4 = r"(?:25[0-5]|2[0-4]\d|1?\d?\d)(?:\.(?:25[0-5]|2[0-4]\d|1?\d?\d)){3}"
+# one pass for every regex extractor; the group name says which matched
+_EXTRACT = re.compile(r"""
+    (?P<url>\b(?:https?|ftp|tftp)://[^\s'"`<>;|&()]+)
+  | (?P<ip>\b""" + _IPV4 + r"""\b)
+  | (?P<hash>\b(?:[0-9a-fA-F]{64}|[0-9a-fA-F]{40}|[0-9a-fA-F]{32})\b)
+  | (?P<file>(?:\s-O\s*|>>?\s*|\bchmod\s+[0-7+a-z]+\s+|\./|\btftp\b[^;|&]*?\s-r\s+)
+             (?P<name>[^\s;|&<>'"`-][^\s;|&<>'"`]*))
+  | (?P<blob>(?:\\x[0-9a-fA-F]{2}){8,}|\b[A-Za-z0-9+/]{40,}={0,2})
+""", re.VERBOSE)
+_URL_IP = re.compile(r"^[a-z]+://(?:[^@/]*@)?(" + _IPV4 + r")(?![\w.])", re.IGNORECASE)
+_KIND = {"url": "urls", "ip": "ips", "hash": "hashes", "file": "files", "blob": "blobs"}
+
+def load_signatures(path=SIGNATURE_FILE):
+    """[{"name", "pattern", "family"}] from a signature file."""
+    with open(path, "r", encoding="utf-8") as f:
+        sigs = json.load(f).get("signatures", [])
+    for s in sigs:
+        if not s.get("pattern") or not s.get("name"):
+            raise ValueError(f"{path}: signature without name or pattern: {s!r}")
+    return sigs
+
+def _add(found, kind, value):
+    bucket = found.setdefault(kind, {})
+    if len(bucket) < MAX_PER_KIND:
+        bucket[value] = None
+
+class Extractor:
+    """Signature automaton plus regex extractors; scan() one inbound line at a time."""
+
+    def __init__(self, signatures=None):
+        if signatures is None:
+            signatures = load_signatures() if os.path.exists(SIGNATURE_FILE) else []
+        self.signatures = signatures
+        self.automaton = AhoCorasick(s["pattern"] for s in signatures)
+        # bots send the same lines over and over: results are memoized like
+        # shell dispatch (cleared when MEMO_SIZE is reached)
+        self._memo = {}
+
+    def extract(self, text):
+        """[(kind, value)] found in one line."""
+        out = []
+        for pid in self.automaton.search(text):
+            sig = self.signatures[pid]
+            out.append(("signatures", sig["name"]))
+            if sig.get("family"):
+                out.append(("families", sig["family"]))
+        for m in _EXTRACT.finditer(text):
+            group = m.lastgroup
+            if group == "file":
+                value = m.group("name")
+                if value.startswith("/dev/"):
+                    continue  # 2>/dev/null and friends
+            elif group == "url":
+                value = m.group("url").rstrip(".,")
+                host = _URL_IP.match(value)
+                if host:
+                    out.append(("ips", host.group(1)))
+                name = value.split("?", 1)[0].rsplit("/", 1)[-1] if value.count("/") > 2 else ""
+                if name:
+                    out.append(("files", name))
+            elif group == "blob":
+                value = m.group("blob")
+                if len(value) > BLOB_PREFIX:
+                    value = f"{value[:BLOB_PREFIX]}...({len(value)})"
+            else:
+                value = m.group(group)
+            out.append((_KIND[group], value))
+        return out
+
+    def scan(self, text, found=None):
+        """Add the IOCs in `text` to `found` ({kind: {value: None}}, insertion-ordered)."""
+        if found is None:
+            found = {}
+        items = self._memo.get(text)
+        if items is None:
+            items = self.extract(text)
+            if len(text) <= MEMO_MAX_LINE:
+                if len(self._memo) >= MEMO_SIZE:
+                    self._memo.clear()
+                self._memo[text] = items
+        for kind, value in items:
+            _add(found, kind, value)
+        return found
+
+def to_record(found):
+    """The "iocs" value logged with a session (None when nothing was found)."""
+    if not found:
+        return None
+    return {kind: list(found[kind]) for kind in KINDS if found.get(kind)}
+
+def items(entry):
+    """(kind, value) pairs of a log entry's "iocs"."""
+    data = entry.get("data") if isinstance(entry, dict) else None
+    iocs = data.get("iocs") if isinstance(data, dict) else None
+    if not isinstance(iocs, dict):
+        return
+    for kind, values in iocs.items():
+        if isinstance(values, list):
+            for value in values:
+                yield kind, str(value)
+
+EXTRACTOR = Extractor() if ENABLED else None
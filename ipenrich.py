@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# ipenrich.py - offline source IP enrichment (ASN, country, cloud ranges, block lists)
+#
+#   python3 ipenrich.py build                    # enrich/* -> enrich/ipdb.bin
+#   python3 ipenrich.py lookup 198.51.100.7 8.8.8.8
+#
+# Sources are local files in enrich/ (HONEYPOT_ENRICH_DIR), no network:
+#
+#   *.csv                  header row; the "cidr" (or "network") column plus attribute
+#                          columns, e.g. cidr,asn,as_name or cidr,country or cidr,cloud
+#                          ("tags" is a space-separated list)
+#   *.txt, *.list, *.netset  one CIDR or address per line ("#"/";" comments); a match
+#                          adds the file name to "tags" (block lists, scanners, ...)
+#
+# Each source's prefixes form a prefix tree; the build flattens it into the
+# sorted boundaries of the address ranges where the longest matching prefix
+# is the same, so a lookup is one binary search per source. The compiled
+# file holds those as raw uint32/int32 arrays after a JSON header (attribute
+# values), and is mmap'ed: loading a million prefixes takes milliseconds and
+# the arrays stay in the page cache, shared between processes. The logger
+# adds the merged attributes to each entry as "src_info".
+import argparse
+import bisect
+import csv
+import ipaddress
+import json
+import mmap
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+BASE_DIR = os.path.dirname(__file__)
+ENRICH_DIR = os.environ.get("HONEYPOT_ENRICH_DIR", os.path.join(BASE_DIR, "enrich"))
+DB_NAME = "ipdb.bin"
+ENABLED = os.environ.get("HONEYPOT_ENRICH", "1") not in ("", "0", "false", "no")
+CACHE_SIZE = int(os.environ.get("HONEYPOT_ENRICH_CACHE", "65536"))
+MAGIC = b"HPIPDB1\0"
+HEADER = struct.Struct("<8sII")  # magic, header JSON length, reserved
+CSV_SUFFIXES = (".csv",)
+LIST_SUFFIXES = (".txt", ".list", ".netset")
+# column names of common CSV exports, mapped to the attribute names used here
+ALIASES = {"network": "cidr", "autonomous_system_number": "asn", "autonomous_system_organization": "as_name",
+           "country_iso_code": "country", "country_code": "country"}
+MAX_IP = (1 << 32) - 1
+
+def source_files(src_dir=ENRICH_DIR):
+    if not os.path.isdir(src_dir):
+        return []
+    return sorted(os.path.join(src_dir, n) for n in os.listdir(src_dir)
+                  if n.endswith(CSV_SUFFIXES + LIST_SUFFIXES))
+
+_ADDR = struct.Struct("!I")
+
+def ipv4_range(text):
+    """(first address, last address) of an IPv4 CIDR or address, else None."""
+    addr, _, plen = text.strip().partition("/")
+    try:
+        # inet_pton and int() cover the data files; ipaddress is ~10x slower
+        ip = _ADDR.unpack(socket.inet_pton(socket.AF_INET, addr))[0]
+        plen = int(plen) if plen else 32
+    except (OSError, ValueError):
+        return None  # IPv6 is not indexed (v4-mapped addresses are looked up as v4)
+    if not 0 <= plen <= 32:
+        return None
+    size = 1 << (32 - plen)
+    first = ip & ~(size - 1)
+    return first, first + size - 1
+
+def _attr_value(v):
+    v = v.strip()
+    return int(v) if v.isdigit() else v
+
+def read_source(path):
+    """[(first, last, attributes)] of one source file."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    out = []
+    with open(path, "r", encoding="utf-8", errors="replace", newline="") as f:
+        if path.endswith(CSV_SUFFIXES):
+            rows = csv.reader(f)
+            header = [ALIASES.get(h.strip().lower(), h.strip().lower()) for h in next(rows, [])]
+            if "cidr" not in header:
+                raise ValueError(f"{path}: no cidr/network column")
+            col = header.index("cidr")
+            for row in rows:
+                if len(row) <= col:
+                    continue
+                rng = ipv4_range(row[col])
+                if rng is None:
+                    continue
+                attrs = {k: _attr_value(v) for k, v in zip(header, row) if k != "cidr" and v.strip()}
+                if "tags" in attrs:
+                    attrs["tags"] = str(attrs["tags"]).split()
+                out.append((rng[0], rng[1], attrs))
+        else:
+            for line in f:
+                line = line.split("#", 1)[0].split(";", 1)[0].strip()
+                rng = ipv4_range(line) if line else None
+                if rng is not None:
+                    out.append((rng[0], rng[1], {"tags": [name]}))
+    return out
+
+def flatten(prefixes):
+    """Range boundaries and value ids for longest-prefix match over `prefixes`.
+
+    `prefixes` is [(first, last, value id)]. Sorted by first address and
+    then by size (largest first), every prefix comes right after the ones
+    enclosing it, so a stack of open prefixes walks the tree depth first.
+    Returns (starts, values): address `ip` maps to values[bisect_right(starts, ip) - 1]
+    (-1 when no prefix covers it).
+    """
+    starts, values = array("I", [0]), array("i", [-1])
+
+    def emit(pos, value):
+        if pos > MAX_IP:
+            return
+        if starts[-1] == pos:
+            values[-1] = value
+            if len(values) > 1 and values[-2] == value:
+                starts.pop()
+                values.pop()
+        elif values[-1] != value:
+            starts.append(pos)
+            values.append(value)
+
+    stack = []  # (last, value) of enclosing prefixes
+    seen = set()
+    for first, last, value in sorted(prefixes, key=lambda p: (p[0], p[0] - p[1])):
+        if (first, last) in seen:
+            continue  # first definition of a prefix wins
+        seen.add((first, last))
+        while stack and stack[-1][0] < first:
+            end, _ = stack.pop()
+            emit(end + 1, stack[-1][1] if stack else -1)
+        emit(first, value)
+        stack.append((last, value))
+    while stack:
+        end, _ = stack.pop()
+        emit(end + 1, stack[-1][1] if stack else -1)
+    return starts, values
+
+def build(paths=None, out=None):
+    """Compile source files into the mmap-able database; returns (prefixes, bytes)."""
+    paths = source_files() if paths is None else paths
+    out = out or os.path.join(ENRICH_DIR, DB_NAME)
+    sources, blobs, total = [], [], 0
+    offset = 0
+    for path in paths:
+        prefixes = read_source(path)
+        table, ids = [], {}
+        keyed = []
+        for first, last, attrs in prefixes:
+            key = tuple((k, tuple(v) if isinstance(v, list) else v) for k, v in attrs.items())
+            if key not in ids:
+                ids[key] = len(table)
+                table.append(attrs)
+            keyed.append((first, last, ids[key]))
+        starts, values = flatten(keyed)
+        sources.append({"name": os.path.basename(path), "prefixes": len(prefixes), "ranges": len(starts),
+                        "starts": offset, "values_offset": offset + 4 * len(starts), "values": table})
+        blob = starts.tobytes() + values.tobytes()
+        blobs.append(blob)
+        offset += len(blob)
+        total += len(prefixes)
+    header = json.dumps({"version": 1, "built": time.time(), "sources": sources}).encode()
+    pad = (-(HEADER.size + len(header))) % 8
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(out)), prefix=".ipdb-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(header) + pad, 0))
+        f.write(header + b" " * pad)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp, out)
+    return total, os.path.getsize(out)
+
+class Enricher:
+    """Lookups against a compiled database, with an LRU cache of recent IPs."""
+
+    def __init__(self, path, cache_size=CACHE_SIZE):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, hlen, _ = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not an IP enrichment database")
+        meta = json.loads(bytes(self._mm[HEADER.size:HEADER.size + hlen]))
+        base = HEADER.size + hlen
+        view = memoryview(self._mm)
+        self.sources = []
+        for s in meta["sources"]:
+            n = s["ranges"]
+            starts = view[base + s["starts"]: base + s["starts"] + 4 * n].cast("I")
+            values = view[base + s["values_offset"]: base + s["values_offset"] + 4 * n].cast("i")
+            self.sources.append((s["name"], starts, values, s["values"]))
+        self.prefixes = sum(s["prefixes"] for s in meta["sources"])
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def lookup_int(self, ip):
+        """Merged attributes for an IPv4 address as an int ({} if nothing matches)."""
+        info = {}
+        for _, starts, values, table in self.sources:
+            v = values[bisect.bisect_right(starts, ip) - 1]
+            if v < 0:
+                continue
+            for key, value in table[v].items():
+                if key == "tags":
+                    info["tags"] = info.get("tags", []) + [t for t in value if t not in info.get("tags", ())]
+                else:
+                    info.setdefault(key, value)  # earlier sources win
+        return info
+
+    def lookup(self, ip):
+        """Attributes for an address string; cached, and shared: do not modify the result."""
+        with self._lock:
+            info = self._cache.get(ip)
+            if info is not None:
+                self._cache.move_to_end(ip)
+                self.hits += 1
+                return info
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            info = {}
+        else:
+            if addr.version == 6 and addr.ipv4_mapped is not None:
+                addr = addr.ipv4_mapped
+            info = self.lookup_int(int(addr)) if addr.version == 4 else {}
+        with self._lock:
+            self.misses += 1
+            self._cache[ip] = info
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return info
+
+    def close(self):
+        self.sources = []
+        self._mm.close()
+
+def _stale(db, sources):
+    if not os.path.exists(db):
+        return True
+    built = os.path.getmtime(db)
+    return any(os.path.getmtime(p) > built for p in sources)
+
+_enricher = None
+_loaded = False
+
+def get_enricher(src_dir=None):
+    """The shared Enricher (compiled from enrich/ first if the sources changed), or None."""
+    global _enricher, _loaded
+    if _loaded or not ENABLED:
+        return _enricher
+    _loaded = True
+    src_dir = src_dir or ENRICH_DIR
+    db = os.path.join(src_dir, DB_NAME)
+    sources = source_files(src_dir)
+    try:
+        if sources and _stale(db, sources):
+            build(sources, db)
+        if os.path.exists(db):
+            _enricher = Enricher(db)
+    except (OSError, ValueError) as e:
+        print(f"[ipenrich] enrichment disabled: {e}")
+        _enricher = None
+    return _enricher
+
+def lookup(ip):
+    """Attributes of `ip` from the shared database ({} without one)."""
+    enricher = get_enricher()
+    return enricher.lookup(ip) if enricher is not None else {}
+
+def entry_info(entry):
+    """The "src_info" logged with an entry, else a lookup of its src_ip (older logs, columnar stubs)."""
+    info = entry.get("src_info") if isinstance(entry, dict) else None
+    if isinstance(info, dict):
+        return info
+    ip = entry.get("src_ip") if isinstance(entry, dict) else None
+    return lookup(str(ip)) if ip else {}
+
+def asn_label(info):
+    """"AS13335 CLOUDFLARENET" style label of an info dict (None without an ASN)."""
+    asn = info.get("asn")
+    if asn in (None, ""):
+        return None
+    name = info.get("as_name")
+    return f"AS{asn} {name}" if name else f"AS{asn}"
+
+def main():
+    p = argparse.ArgumentParser(description="Offline IP enrichment database.")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="Compile source files (default: enrich/*) into the database")
+    b.add_argument("files", nargs="*")
+    b.add_argument("-o", "--output", default=os.path.join(ENRICH_DIR, DB_NAME))
+    q = sub.add_parser("lookup", help="Print the attributes of addresses")
+    q.add_argument("ips", nargs="+")
+    q.add_argument("--db", default=os.path.join(ENRICH_DIR, DB_NAME))
+    args = p.parse_args()
+    if args.cmd == "build":
+        t0 = time.perf_counter()
+        n, size = build(args.files or None, args.output)
+        print(f"{args.output}: {n} prefixes, {size} bytes in {time.perf_counter() - t0:.2f}s")
+        return
+    if not os.path.exists(args.db):
+        sys.exit(f"{args.db} not found; run `python3 ipenrich.py build` first")
+    enricher = Enricher(args.db)
+    for ip in args.ips:
+        print(ip, json.dumps(enricher.lookup(ip)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+# livefeed.py - push session events from the honeypot to live viewers
+#
+# The servers publish small events as sessions happen (not only when they
+# are logged at the end):
+#
+#   {"seq": 41, "type": "start",   "time": ..., "session_id": ..., "src_ip": ..., "service": ...}
+#   {"seq": 42, "type": "login",   ..., "username": "admin"}
+#   {"seq": 43, "type": "command", ..., "cmd": "cat /proc/cpuinfo"}
+#   {"seq": 44, "type": "end",     ..., "commands": 3, "tarpit": "command"}
+#   {"seq": 45, "type": "request", ..., "method": "POST", "path": "/login"}   (HTTP, one per request)
+#
+# The publisher serves them as JSON lines on a Unix socket. It keeps the last
+# RING_SIZE events, so a subscriber that connects late (or reconnects) is
+# sent what it missed first: it writes one line {"run": ..., "since": seq}
+# and gets every buffered event after `since` (all of them if the publisher
+# was restarted since, i.e. `run` differs), then the live stream. Publishing
+# never waits: a subscriber that stops reading is dropped and can resume
+# from the ring.
+#
+# Subscriber (used by the dashboard) runs in a thread, keeps a bounded window
+# of recent events and a table of the sessions that are still open.
+import asyncio
+import collections
+import datetime
+import glob
+import json
+import os
+import socket
+import threading
+import time
+
+import metrics
+
+# Unix socket to publish on ("" = off; HONEYPOT_LIVE_SOCKET or --live-socket)
+SOCKET_PATH = os.environ.get("HONEYPOT_LIVE_SOCKET", "")
+RING_SIZE = int(os.environ.get("HONEYPOT_LIVE_RING", "2000"))
+MAX_SUBSCRIBERS = 32
+MAX_BUFFERED = 1 << 20    # bytes a subscriber may leave unread before it is dropped
+HELLO_TIMEOUT = 2.0
+# subscriber side
+WINDOW = 2000             # recent events kept in memory
+MAX_LIVE = 5000           # open sessions tracked (oldest dropped past this)
+RECONNECT_DELAY = 2.0
+
+PUBLISHED = metrics.Counter("honeypot_live_events_total", "Events published to live subscribers")
+DROPPED_SUBSCRIBERS = metrics.Counter("honeypot_live_dropped_subscribers_total",
+                                      "Live subscribers dropped for not keeping up")
+
+def _now():
+    return datetime.datetime.utcnow().isoformat() + "Z"
+
+class Publisher:
+    """Ring buffer of encoded events plus the subscribers' transports."""
+
+    def __init__(self, path, ring_size=RING_SIZE):
+        self.path = path
+        self.run = f"{os.getpid()}-{int(time.time() * 1000)}"
+        self.ring = collections.deque(maxlen=ring_size)  # (seq, line)
+        self.seq = 0
+        self.subscribers = set()
+        self.server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.server = await asyncio.start_unix_server(self._serve, self.path, limit=4096)
+        return self
+
+    def publish(self, event):
+        self.seq += 1
+        event["seq"] = self.seq
+        line = (json.dumps(event) + "\n").encode()
+        self.ring.append((self.seq, line))
+        PUBLISHED.inc()
+        for transport in list(self.subscribers):
+            if transport.is_closing():
+                self.subscribers.discard(transport)
+            elif transport.get_write_buffer_size() > MAX_BUFFERED:
+                self.subscribers.discard(transport)
+                transport.abort()
+                DROPPED_SUBSCRIBERS.inc()
+            else:
+                transport.write(line)
+
+    async def _serve(self, reader, writer):
+        if len(self.subscribers) >= MAX_SUBSCRIBERS:
+            writer.transport.abort()
+            return
+        since = 0
+        try:
+            hello = json.loads(await asyncio.wait_for(reader.readline(), HELLO_TIMEOUT) or b"{}")
+            if hello.get("run") == self.run:
+                since = int(hello.get("since") or 0)
+        except (asyncio.TimeoutError, ValueError, AttributeError, ConnectionError):
+            pass
+        # replay and join in one step (no await in between), so nothing is missed or sent twice
+        writer.write(b"".join(line for seq, line in self.ring if seq > since))
+        writer.write((json.dumps({"type": "hello", "run": self.run, "seq": self.seq}) + "\n").encode())
+        self.subscribers.add(writer.transport)
+        try:
+            # nothing else is expected from the subscriber; wait for it to go away
+            while await reader.read(4096):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            self.subscribers.discard(writer.transport)
+            writer.transport.abort()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        for transport in self.subscribers:
+            transport.abort()
+        self.subscribers.clear()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+PUBLISHER = None
+
+async def start(path):
+    """Start publishing on `path`; no-op without one (callers resolve SOCKET_PATH)."""
+    global PUBLISHER
+    if path and PUBLISHER is None:
+        PUBLISHER = await Publisher(path).start()
+    return PUBLISHER
+
+def stop():
+    global PUBLISHER
+    if PUBLISHER is not None:
+        PUBLISHER.close()
+        PUBLISHER = None
+
+def publish(kind, session_id, src_ip, service, **fields):
+    """Publish one event; costs a global check when no publisher is running."""
+    if PUBLISHER is None:
+        return
+    event = {"type": kind, "time": _now(), "session_id": session_id, "src_ip": src_ip, "service": service}
+    event.update(fields)
+    PUBLISHER.publish(event)
+
+# --- Subscriber ----------------------------------------------------------------
+def socket_paths(path):
+    """The socket itself and, with --workers, one per worker (path.N)."""
+    return sorted(glob.glob(glob.escape(path)) + glob.glob(glob.escape(path) + ".*"))
+
+class Subscriber:
+    """Follows one or more publishers from background threads.
+
+    Keeps the last `window` events and, per open session, a small summary
+    that start/login/command/end events update in place; nothing is read
+    from the log files.
+    """
+
+    def __init__(self, path=None, window=WINDOW, max_live=MAX_LIVE):
+        self.path = path or SOCKET_PATH
+        self.events = collections.deque(maxlen=window)
+        self.live = collections.OrderedDict()   # session_id -> summary
+        self.ended = collections.deque(maxlen=200)
+        self.max_live = max_live
+        self.received = 0
+        self.connected = set()
+        self.lock = threading.Lock()
+        self._threads = {}
+
+    def start(self):
+        """(Re)start a follower thread for every socket found; safe to call often."""
+        for p in socket_paths(self.path) if self.path else []:
+            t = self._threads.get(p)
+            if t is None or not t.is_alive():
+                t = threading.Thread(target=self._follow, args=(p,), name=f"livefeed {p}", daemon=True)
+                self._threads[p] = t
+                t.start()
+        return self
+
+    def _follow(self, path):
+        run, since = None, 0
+        while True:
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.connect(path)
+                    sock.sendall((json.dumps({"run": run, "since": since}) + "\n").encode())
+                    with self.lock:
+                        self.connected.add(path)
+                    for line in sock.makefile("rb"):
+                        event = json.loads(line)
+                        if event.get("type") == "hello":
+                            run = event["run"]
+                            continue
+                        since = event.get("seq", since)
+                        self.apply(event)
+            except (OSError, ValueError):
+                pass
+            with self.lock:
+                self.connected.discard(path)
+            if not os.path.exists(path):
+                return  # publisher gone for good; start() picks up a new one
+            time.sleep(RECONNECT_DELAY)
+
+    def apply(self, event):
+        sid = event.get("session_id")
+        kind = event.get("type")
+        with self.lock:
+            self.received += 1
+            self.events.append(event)
+            if kind == "start":
+                self.live[sid] = {"session_id": sid, "src_ip": event.get("src_ip"),
+                                  "service": event.get("service"), "started": event.get("time"),
+                                  "last_seen": event.get("time"), "username": "", "commands": 0, "last_command": ""}
+                if len(self.live) > self.max_live:
+                    self.live.popitem(last=False)
+                return
+            session = self.live.get(sid)
+            if session is None:
+                return
+            session["last_seen"] = event.get("time")
+            if kind == "login":
+                session["username"] = event.get("username", "")
+            elif kind == "command":
+                session["commands"] += 1
+                session["last_command"] = event.get("cmd", "")
+            elif kind == "end":
+                del self.live[sid]
+                self.ended.append(dict(session, ended=event.get("time"), tarpit=event.get("tarpit") or ""))
+
+    def snapshot(self, events=50):
+        """Copies for display: open sessions, recently ended ones, latest events."""
+        with self.lock:
+            live = [dict(s) for s in reversed(self.live.values())]
+            ended = [dict(s) for s in reversed(self.ended)]
+            recent = list(self.events)[-events:][::-1]
+            return {"live": live, "ended": ended, "events": recent,
+                    "received": self.received, "connected": len(self.connected)}
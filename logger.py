@@ -1,6 +1,18 @@
 import json
 import os
 import datetime
+import asyncio
+import atexit
+import functools
+import threading
+import time
+import uuid
+from queue import Empty
+import ipenrich
+import logstore
+import metrics
+import rollups
+import transcriptstore
 
 BASE_DIR = os.path.dirname(__file__)
 LOG_DIR = os.path.join(BASE_DIR, "logs")
@@ -9,16 +21,397 @@ os.makedirs(LOG_DIR, exist_ok=True)
 # 👇 All logs go here
 LOG_FILE = os.path.join(LOG_DIR, "all_sessions.jsonl")
 
-def log_request(src_ip, service, path, method, data):
-    """Append a single JSON log line to one shared file."""
+# Async writer settings (can be overridden from the environment)
+QUEUE_SIZE = int(os.environ.get("HONEYPOT_LOG_QUEUE_SIZE", "10000"))
+BATCH_SIZE = int(os.environ.get("HONEYPOT_LOG_BATCH_SIZE", "256"))
+FLUSH_INTERVAL = float(os.environ.get("HONEYPOT_LOG_FLUSH_INTERVAL", "0.5"))
+# what to do when the queue is full: "block", "drop" or "spill"
+OVERFLOW_POLICY = os.environ.get("HONEYPOT_LOG_OVERFLOW", "block")
+OVERFLOW_POLICIES = ("block", "drop", "spill")
+# print writer stats (queue depth, flush latency) every N seconds; 0 disables
+STATS_INTERVAL = float(os.environ.get("HONEYPOT_LOG_STATS_INTERVAL", "60"))
+
+LOG_WRITE_SECONDS = metrics.Histogram("honeypot_log_write_seconds", "Time to write one batch of log lines")
+LOG_ENTRIES = metrics.Counter("honeypot_log_entries_total", "Log entries by outcome", labels=("outcome",))
+LOG_WRITTEN = LOG_ENTRIES.labels("written")
+LOG_DROPPED = LOG_ENTRIES.labels("dropped")
+LOG_SPILLED = LOG_ENTRIES.labels("spilled")
+LOG_QUEUE_DEPTH = metrics.Gauge("honeypot_log_queue_depth", "Entries waiting for the background log writer")
+LOG_QUEUE_DEPTH.set_function(lambda: _writer.queue.qsize() if _writer is not None else 0)
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+@functools.lru_cache(maxsize=ipenrich.CACHE_SIZE)
+def src_info(ip):
+    """Enrichment of one source address, memoized per IP so repeat visitors
+    skip the address parse and the Enricher's lock (do not modify the result)."""
+    return ipenrich.lookup(ip)
+
+def make_entry(src_ip, service, path, method, data, session_id=None):
+    # time, session_id and src_ip stay first: logindex keys lines by this prefix
     entry = {
         "time": datetime.datetime.utcnow().isoformat() + "Z",
+        "session_id": session_id or new_session_id(),
         "src_ip": src_ip,
         "service": service,
         "path": path,
         "method": method,
         "data": data
     }
-    with open(LOG_FILE, "a") as f:
-        f.write(json.dumps(entry) + "\n")
+    # ASN / country / tags from the local enrichment database (see ipenrich.py)
+    info = src_info(str(src_ip)) if src_ip else None
+    if info:
+        entry["src_info"] = info
+    return entry
+
+def serialize(entry):
+    """One JSON line; a transcript goes to the transcript store and is logged
+    as a reference (see transcriptstore.py)."""
+    if transcriptstore.ENABLED:
+        transcriptstore.dedup_entry(entry)
+    return json.dumps(entry) + "\n"
+
+def append_lines(path, lines):
+    """Append already-serialized JSON lines with a single write.
+
+    Goes through logstore so the file is rotated/compressed by size or age.
+    """
+    logstore.get_log(path).write(lines)
+
+# rollup per log file written by this process (see rollups.py)
+_rollups = {}
+_rollups_lock = threading.Lock()
+
+def update_rollup(path, entries):
+    """Fold logged entries into this process's rollup for `path`."""
+    if not rollups.ENABLED:
+        return
+    writer = _rollups.get(path)
+    if writer is None:
+        with _rollups_lock:
+            writer = _rollups.get(path)
+            if writer is None:
+                writer = _rollups[path] = rollups.RollupWriter(path)
+    writer.add(entries)
+
+def save_rollups():
+    for writer in list(_rollups.values()):
+        writer.save()
+
+atexit.register(save_rollups)
+
+class AsyncLogWriter:
+    """Bounded queue + background task that writes log entries in batches.
+
+    Handlers only put entries on the queue; serialization and disk writes
+    happen in the writer task, and the blocking write itself runs in the
+    default executor so the event loop never waits on the disk.
+
+    `sink(lines)` receives each serialized batch; by default it appends to
+    `path`, but a worker process can pass one that forwards to a log writer
+    process instead.
+    """
+
+    def __init__(self, path=None, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, policy=OVERFLOW_POLICY, sink=None):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"unknown overflow policy: {policy!r}")
+        self.path = path or LOG_FILE
+        self.spill_path = self.path + ".spill"
+        self.sink = sink or functools.partial(append_lines, self.path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self._task = None
+        # spilled entries are appended in the executor and merged back into
+        # the log once the queue has drained (see _merge_spill)
+        self._spill_lock = threading.Lock()
+        self._spilling = set()
+        self._spill_pending = False
+        # entries written through past a full queue ("block" policy, sync callers)
+        self._writing = set()
+        # counters for stats()
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    async def start(self):
+        if self._task is None:
+            # lines spilled by an earlier run that stopped before merging them
+            await asyncio.get_running_loop().run_in_executor(None, self._merge_spill)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def put_nowait(self, entry):
+        """Queue an entry without waiting. Returns False if it was not queued.
+
+        With the "block" policy a full queue leaves the entry to the caller
+        (log_request writes it through); "drop" loses it and "spill" hands it
+        to the executor to append to the spill file.
+        """
+        try:
+            self.queue.put_nowait(entry)
+            return True
+        except asyncio.QueueFull:
+            pass
+        if self.policy == "block":
+            return False
+        if self.policy == "spill":
+            # rare path: a side file rather than lose the entry, off the loop
+            future = asyncio.get_running_loop().run_in_executor(None, self._spill, entry)
+            self._spilling.add(future)
+            future.add_done_callback(self._spilling.discard)
+            self._spill_pending = True
+            self.spilled += 1
+            LOG_SPILLED.inc()
+        else:
+            self.dropped += 1
+            LOG_DROPPED.inc()
+        return False
+
+    def write_through(self, entry):
+        """Write one entry through the sink in the executor, bypassing the full queue."""
+        future = asyncio.get_running_loop().run_in_executor(None, self._write, [entry])
+        self._writing.add(future)
+        future.add_done_callback(self._written_through)
+
+    def _written_through(self, future):
+        self._writing.discard(future)
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            print(f"[logger] failed to write 1 entry: {future.exception()}")
+            return
+        self.written += 1
+        LOG_WRITTEN.inc()
+
+    def _spill(self, entry):
+        line = serialize(entry)
+        with self._spill_lock:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def _merge_spill(self):
+        """Append spilled lines to the log through the sink and drop the spill file."""
+        with self._spill_lock:
+            try:
+                with open(self.spill_path, "r", encoding="utf-8", errors="replace") as f:
+                    lines = [ln if ln.endswith("\n") else ln + "\n" for ln in f if ln.strip()]
+            except FileNotFoundError:
+                return 0
+            if lines:
+                self.sink(lines)
+            os.remove(self.spill_path)
+        entries = []
+        for ln in lines:
+            try:
+                entries.append(json.loads(ln))
+            except ValueError:
+                continue
+        update_rollup(self.path, entries)
+        return len(lines)
+
+    async def _drain_spill(self):
+        self._spill_pending = False
+        if self._spilling:
+            await asyncio.gather(*list(self._spilling), return_exceptions=True)
+        await asyncio.get_running_loop().run_in_executor(None, self._merge_spill)
+
+    async def put(self, entry):
+        """Queue an entry, waiting for room when the policy is "block"."""
+        if self.policy == "block":
+            await self.queue.put(entry)
+            return True
+        return self.put_nowait(entry)
+
+    async def _next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush(self, batch):
+        t0 = time.perf_counter()
+        try:
+            # serialized in the executor too: new transcripts are written to the store
+            await asyncio.get_running_loop().run_in_executor(None, self._write, batch)
+        finally:
+            elapsed = (time.perf_counter() - t0) * 1000.0
+            self.flushes += 1
+            self.last_flush_ms = elapsed
+            self.total_flush_ms += elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+            LOG_WRITE_SECONDS.observe(elapsed / 1000.0)
+            for _ in batch:
+                self.queue.task_done()
+        self.written += len(batch)
+        LOG_WRITTEN.inc(len(batch))
+
+    def _write(self, entries):
+        self.sink([serialize(entry) for entry in entries])
+        update_rollup(self.path, entries)
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._flush(batch)
+                if self._spill_pending and self.queue.empty():
+                    await self._drain_spill()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[logger] failed to write {len(batch)} entries: {e}")
+
+    async def close(self):
+        """Flush everything still queued, then stop the writer task."""
+        if self._task is None:
+            return
+        if self.running:
+            await self.queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # anything queued after the task died still gets written
+        leftover = []
+        while not self.queue.empty():
+            leftover.append(self.queue.get_nowait())
+            self.queue.task_done()
+        if leftover:
+            self._write(leftover)
+            self.written += len(leftover)
+        if self._writing:
+            await asyncio.gather(*list(self._writing), return_exceptions=True)
+        await self._drain_spill()
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "policy": self.policy,
+            "written": self.written,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "flushes": self.flushes,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+        }
+
+def run_log_writer(queue, path=None):
+    """Single-writer process: append line batches sent by worker processes.
+
+    Each batch is written whole, so lines from different workers never
+    interleave. Stops when None is received.
+    """
+    path = path or LOG_FILE
+    done = False
+    while not done:
+        lines = queue.get()
+        if lines is None:
+            break
+        # coalesce whatever else is already waiting into one write
+        while True:
+            try:
+                more = queue.get_nowait()
+            except Empty:
+                break
+            if more is None:
+                done = True
+                break
+            lines.extend(more)
+        append_lines(path, lines)
+
+# shared writer used by the servers (None = synchronous writes)
+_writer = None
+_reporter = None
+
+async def _report_stats(interval):
+    while True:
+        await asyncio.sleep(interval)
+        if _writer is not None:
+            print(f"[logger] {_writer.stats()}")
+
+async def start_writer(stats_interval=STATS_INTERVAL, **kwargs):
+    """Start the shared async writer on the running loop."""
+    global _writer, _reporter
+    if _writer is None:
+        _writer = AsyncLogWriter(**kwargs)
+    await _writer.start()
+    if stats_interval > 0 and _reporter is None:
+        _reporter = asyncio.get_running_loop().create_task(_report_stats(stats_interval))
+    return _writer
+
+async def stop_writer():
+    """Flush and stop the shared writer; later calls write synchronously."""
+    global _writer, _reporter
+    if _reporter is not None:
+        _reporter.cancel()
+        _reporter = None
+    if _writer is not None:
+        await _writer.close()
+        _writer = None
+    save_rollups()
+
+def writer_stats():
+    return _writer.stats() if _writer is not None else None
+
+def write_now(entry):
+    """Synchronous write, used when no async writer is running."""
+    t0 = metrics.timer()
+    append_lines(LOG_FILE, [serialize(entry)])
+    update_rollup(LOG_FILE, [entry])
+    if t0:
+        LOG_WRITE_SECONDS.observe(time.perf_counter() - t0)
+    LOG_WRITTEN.inc()
+
+def log_request(src_ip, service, path, method, data, session_id=None):
+    """Append a single JSON log line to one shared file.
+
+    For code that cannot await; handlers use log_request_async. If the async
+    writer is running the entry is queued; when the queue is full, the
+    "block" policy writes it through in the executor (outside the queue, but
+    never on the event loop) and "drop"/"spill" apply as usual. Without a
+    writer it is written synchronously.
+    """
+    entry = make_entry(src_ip, service, path, method, data, session_id)
+    if _writer is not None and _writer.running:
+        if not _writer.put_nowait(entry) and _writer.policy == "block":
+            _writer.write_through(entry)
+    else:
+        write_now(entry)
+    return LOG_FILE
+
+async def log_request_async(src_ip, service, path, method, data, session_id=None):
+    """Like log_request, but honours the "block" overflow policy."""
+    entry = make_entry(src_ip, service, path, method, data, session_id)
+    if _writer is not None and _writer.running:
+        await _writer.put(entry)
+    else:
+        write_now(entry)
     return LOG_FILE
@@ -0,0 +1,390 @@
+# logindex.py - sidecar byte-offset index over JSONL session logs
+#
+# For a log file `all_sessions.jsonl` the index lives next to it:
+#
+#   all_sessions.jsonl.idx        one fixed 32-byte record per line, in file order:
+#                                 offset, length, epoch second, ip key, session key
+#   all_sessions.jsonl.idx.ts     sorted keys followed by their record numbers, for
+#   all_sessions.jsonl.idx.ip     the first N records; records after that are the
+#   all_sessions.jsonl.idx.sid    unsorted tail and are scanned (vectorized)
+#   all_sessions.jsonl.idx.meta   {"version": 1, "sorted": N}
+#
+# The writer appends records as lines are written (logstore.RotatingLog holds
+# the log file's flock across a line write and its records, so the records of
+# several writing processes stay in offset order) and re-sorts the key files
+# every SORT_EVERY records. Readers mmap everything,
+# binary-search the sorted runs, scan the short tail, then seek straight to
+# the matching lines. Keys are hashes/seconds, so every hit is re-checked
+# against the parsed line.
+#
+# On rotation the sidecars follow the segment, compressed or not: offsets
+# are into the uncompressed stream, so a lookup in a .gz/.zst segment skips
+# it outright when nothing matches and otherwise decompresses only up to
+# the last matching line, parsing just the matching lines.
+import argparse
+import json
+import mmap
+import os
+import re
+import socket
+import struct
+import zlib
+from datetime import datetime
+
+import logstore
+
+VERSION = 1
+RECORD = struct.Struct("<QIIQQ")  # offset, length, ts, ip key, session key
+KEYS = ("ts", "ip", "sid")
+# re-sort the key files once this many records are past the sorted part
+SORT_EVERY = int(os.environ.get("HONEYPOT_LOG_INDEX_SORT_EVERY", "65536"))
+ENABLED = os.environ.get("HONEYPOT_LOG_INDEX", "1") not in ("", "0", "false", "no")
+
+EPOCH = datetime(1970, 1, 1)
+# logger writes time, session_id and src_ip first, so most lines are keyed
+# without a full json.loads
+_HEAD = re.compile(rb'^\{"time": ?"([^"]*)", ?"session_id": ?"([^"]*)", ?"src_ip": ?"([^"]*)"')
+
+def _rec_dtype():
+    import numpy as np
+    return np.dtype([("offset", "<u8"), ("length", "<u4"), ("ts", "<u4"), ("ip", "<u8"), ("sid", "<u8")])
+
+def is_compressed(path):
+    return str(path).endswith((".gz", ".zst"))
+
+def index_path(path):
+    return str(path) + ".idx"
+
+def sidecar_paths(path):
+    base = index_path(path)
+    return [base, base + ".meta"] + [f"{base}.{k}" for k in KEYS]
+
+# --- Keys --------------------------------------------------------------
+def ts_key(ts):
+    if isinstance(ts, str):
+        try:
+            # whole seconds are enough for a key; hits are re-checked exactly
+            t = datetime.fromisoformat(ts[:19])
+        except ValueError:
+            t = logstore.parse_time(ts)
+    else:
+        t = logstore.parse_time(ts)
+    return max(0, int((t - EPOCH).total_seconds())) if t is not None else 0
+
+def ip_key(ip):
+    # IPv4 maps to its integer value; anything else to a hash above 2**32
+    try:
+        return int.from_bytes(socket.inet_aton(ip), "big") if ip.count(".") == 3 else (1 << 32) | zlib.crc32(ip.encode())
+    except (OSError, AttributeError):
+        return (1 << 32) | zlib.crc32(str(ip).encode())
+
+def sid_key(sid):
+    if not sid:
+        return 0
+    try:
+        return int(sid[:16], 16)
+    except ValueError:
+        return (1 << 63) | zlib.crc32(str(sid).encode())
+
+def line_keys(line):
+    """(ts, ip, sid) keys for one serialized log line (bytes)."""
+    m = _HEAD.match(line)
+    if m is not None:
+        ts, sid, ip = (g.decode("utf-8", "replace") for g in m.groups())
+    else:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return 0, 0, 0
+        if not isinstance(entry, dict):
+            return 0, 0, 0
+        ts, sid, ip = entry.get("time"), entry.get("session_id"), entry.get("src_ip")
+    return ts_key(ts), ip_key(ip) if ip else 0, sid_key(sid)
+
+# --- Writing -----------------------------------------------------------
+class IndexWriter:
+    """Keeps the sidecar index of one log file in step with its appends.
+
+    Every process writing the log may own one, as long as appends to the
+    log and its index are serialized (RotatingLog.write holds the log
+    file's flock). On open it indexes whatever the file holds past the last
+    indexed line (e.g. lines written before the index existed), and starts
+    over if the log was replaced.
+    """
+
+    def __init__(self, path, sort_every=SORT_EVERY):
+        self.path = str(path)
+        self.idx_path = index_path(self.path)
+        self.sort_every = sort_every
+        self.count = 0
+        self.end = 0
+        self._file = None  # append handle, kept open between writes
+        self.sorted = load_meta(self.path).get("sorted", 0)
+        if os.path.exists(self.idx_path):
+            size = os.path.getsize(self.idx_path)
+            self.count = size // RECORD.size
+            if size % RECORD.size:
+                # torn record from a crash: drop it
+                with open(self.idx_path, "r+b") as f:
+                    f.truncate(self.count * RECORD.size)
+            if self.count:
+                with open(self.idx_path, "rb") as f:
+                    f.seek((self.count - 1) * RECORD.size)
+                    offset, length = RECORD.unpack(f.read(RECORD.size))[:2]
+                self.end = offset + length
+        if self.sorted > self.count:
+            self.reset()
+        if is_compressed(self.path):
+            return  # closed segment: indexed before it was compressed, or by build()
+        log_size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if self.end > log_size:
+            self.reset()
+        if self.end < log_size:
+            self.catch_up()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def reset(self):
+        self.close()
+        for p in sidecar_paths(self.path):
+            if os.path.exists(p):
+                os.remove(p)
+        self.count = self.end = self.sorted = 0
+
+    def catch_up(self):
+        """Index complete lines between the last indexed one and EOF."""
+        with logstore.open_raw(self.path) as f:
+            f.seek(self.end)
+            lines = []
+            for ln in f:
+                if not ln.endswith(b"\n"):
+                    break
+                lines.append(ln)
+                if len(lines) >= 65536:
+                    self.append(self.end, lines)
+                    lines = []
+            if lines:
+                self.append(self.end, lines)
+
+    def append(self, offset, lines):
+        """Record `lines` (bytes, each ending in a newline) written at `offset`."""
+        out = bytearray()
+        for ln in lines:
+            if ln.strip():
+                out += RECORD.pack(offset, len(ln), *line_keys(ln))
+                self.count += 1
+            offset += len(ln)
+        if out:
+            if self._file is None:
+                self._file = open(self.idx_path, "ab")
+            self._file.write(out)
+            self._file.flush()
+            # other processes append to the same file: count their records too
+            self.count = self._file.tell() // RECORD.size
+        self.end = offset
+        if self.count - self.sorted >= self.sort_every:
+            self.sorted = load_meta(self.path).get("sorted", 0)  # maybe sorted by another writer
+            if self.count - self.sorted >= self.sort_every:
+                self.sort()
+
+    def sort(self):
+        """Rewrite the sorted key files to cover every record so far."""
+        import numpy as np
+        try:
+            with open(self.idx_path, "rb") as f:
+                data = f.read()
+            recs = np.frombuffer(data, dtype=_rec_dtype(), count=len(data) // RECORD.size)
+        except FileNotFoundError:
+            # nothing indexed (blank lines only): write empty files so the index exists
+            open(self.idx_path, "ab").close()
+            recs = np.empty(0, _rec_dtype())
+        for key in KEYS:
+            order = np.argsort(recs[key], kind="stable")
+            tmp = f"{self.idx_path}.{key}.tmp"
+            with open(tmp, "wb") as f:
+                # all keys, then the matching record numbers: both contiguous
+                # so readers can searchsorted() the mmap without copying
+                f.write(recs[key][order].astype("<u8").tobytes())
+                f.write(order.astype("<u8").tobytes())
+            os.replace(tmp, f"{self.idx_path}.{key}")
+        self.count = self.sorted = len(recs)
+        save_meta(self.path, {"version": VERSION, "sorted": self.sorted})
+
+def load_meta(path):
+    try:
+        with open(index_path(path) + ".meta", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {"version": VERSION, "sorted": 0}
+    return meta if meta.get("version") == VERSION else {"version": VERSION, "sorted": 0}
+
+def save_meta(path, meta):
+    tmp = index_path(path) + ".meta.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp, index_path(path) + ".meta")
+
+def build(path):
+    """(Re)build the index of a JSONL file (plain, .gz or .zst) from scratch."""
+    writer = IndexWriter(path)
+    writer.reset()
+    writer.catch_up()
+    writer.sort()
+    return writer.count
+
+def move_sidecars(src, dst):
+    """Follow a renamed log (dst=None: drop them)."""
+    for p in sidecar_paths(src):
+        if os.path.exists(p):
+            if dst is None:
+                os.remove(p)
+            else:
+                os.replace(p, str(dst) + p[len(str(src)):])
+
+# --- Reading -----------------------------------------------------------
+def _map(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _match(entry, since, until, ip, session_id):
+    if not isinstance(entry, dict):
+        return False
+    if ip is not None and entry.get("src_ip") != ip:
+        return False
+    if session_id is not None and entry.get("session_id") != session_id:
+        return False
+    return logstore.in_range(entry.get("time"), since, until)
+
+def _key_range(key, since, until, ip, session_id):
+    if key == "ts":
+        lo = ts_key(since) if since is not None else 0
+        hi = ts_key(until) if until is not None else (1 << 32) - 1
+        return lo, hi
+    k = ip_key(ip) if key == "ip" else sid_key(session_id)
+    return k, k
+
+def lookup(path, since=None, until=None, ip=None, session_id=None):
+    """Entries of one plain log file matching all given filters, in file order.
+
+    Returns None when the file has no usable index (the caller scans).
+    """
+    import numpy as np
+    path = str(path)
+    idx_path = index_path(path)
+    if not os.path.exists(idx_path) or not os.path.exists(path):
+        return None
+    compressed = is_compressed(path)
+    log_map = None
+    if not compressed:
+        log_map = _map(path)
+        if log_map is None:
+            return []
+    idx_map = _map(idx_path)
+    recs = np.frombuffer(idx_map, dtype=_rec_dtype()) if idx_map is not None else np.empty(0, _rec_dtype())
+    # records from before writers were serialized may be out of offset order:
+    # the indexed part ends at the furthest record, not the last one
+    end = int((recs["offset"] + recs["length"]).max()) if len(recs) else 0
+    if log_map is not None and end > len(log_map):
+        return None  # the log was truncated or replaced under the index
+
+    wanted = [k for k, v in (("ts", since or until), ("ip", ip), ("sid", session_id)) if v]
+    picked = None
+    for key in wanted:
+        lo, hi = _key_range(key, since, until, ip, session_id)
+        rows, start = [], 0
+        run_path = f"{idx_path}.{key}"
+        run_map = _map(run_path) if os.path.exists(run_path) else None
+        if run_map is not None:
+            n = min(len(run_map) // 16, len(recs))
+            keys = np.frombuffer(run_map, dtype="<u8", count=n)
+            a, b = np.searchsorted(keys, lo, side="left"), np.searchsorted(keys, hi, side="right")
+            rows.append(np.frombuffer(run_map, dtype="<u8", count=n, offset=8 * n)[a:b].astype(np.int64))
+            start = n
+        tail = recs[key][start:]
+        rows.append(np.nonzero((tail >= lo) & (tail <= hi))[0].astype(np.int64) + start)
+        found = np.concatenate(rows)
+        picked = found if picked is None else np.intersect1d(picked, found, assume_unique=True)
+    if picked is None:
+        picked = np.arange(len(recs))
+    # file order, each line once
+    picked = picked[np.unique(recs["offset"][picked], return_index=True)[1]]
+
+    if compressed:
+        return _read_compressed(path, recs, picked, since, until, ip, session_id)
+    out = []
+    for r in picked:
+        off, length = int(recs[r]["offset"]), int(recs[r]["length"])
+        try:
+            entry = json.loads(log_map[off:off + length])
+        except ValueError:
+            return None  # offsets do not point at lines: stale index
+        if _match(entry, since, until, ip, session_id):
+            out.append(entry)
+    # lines appended after the last indexed one (writer not caught up yet)
+    if end < len(log_map):
+        tail = log_map[end:]
+        for ln in tail[:tail.rfind(b"\n") + 1].splitlines():
+            try:
+                entry = json.loads(ln)
+            except ValueError:
+                continue
+            if _match(entry, since, until, ip, session_id):
+                out.append(entry)
+    return out
+
+def _read_compressed(path, recs, picked, since, until, ip, session_id):
+    """Matching lines of a compressed segment: decompress up to the last one."""
+    out = []
+    if not len(picked):
+        return out
+    with logstore.open_raw(path) as f:
+        for r in picked:
+            off, length = int(recs[r]["offset"]), int(recs[r]["length"])
+            if off < f.tell():
+                return None  # records out of order: not an index of this file
+            f.seek(off)
+            try:
+                entry = json.loads(f.read(length))
+            except ValueError:
+                return None  # offsets do not point at lines: stale index
+            if _match(entry, since, until, ip, session_id):
+                out.append(entry)
+    return out
+
+def find_entries(paths, since=None, until=None, ip=None, session_id=None):
+    """Yield matching entries from several files, using indexes where present."""
+    for path in paths:
+        found = lookup(path, since, until, ip, session_id)
+        if found is None:
+            found = (e for e in logstore.iter_entries([path], since, until)
+                     if _match(e, None, None, ip, session_id))
+        yield from found
+
+def main():
+    p = argparse.ArgumentParser(description="Build or query the sidecar index of JSONL session logs.")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="(Re)build the index of log files (plain or compressed)")
+    b.add_argument("files", nargs="+")
+    q = sub.add_parser("query", help="Print matching entries as JSONL")
+    q.add_argument("files", nargs="+")
+    q.add_argument("--ip")
+    q.add_argument("--session-id")
+    q.add_argument("--since")
+    q.add_argument("--until")
+    args = p.parse_args()
+    if args.cmd == "build":
+        for path in args.files:
+            print(f"{path}: {build(path)} records indexed")
+        return
+    since = logstore.parse_time(args.since) if args.since else None
+    until = logstore.parse_time(args.until) if args.until else None
+    for entry in find_entries(args.files, since, until, args.ip, args.session_id):
+        print(json.dumps(entry))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# logmerge.py - query many JSONL log files in parallel and merge them by time
+#
+#   python3 logmerge.py                                  # logs/ -> all_sessions.jsonl
+#   python3 logmerge.py --since 2026-10-01 -o october.jsonl
+#   python3 logmerge.py logs/all_sessions.worker*.jsonl -o merged.jsonl
+#
+# Files (and byte ranges of large plain files) are scanned by a process
+# pool. Each task parses its lines, drops records outside the time range,
+# keeps only the requested fields and returns them sorted by time; the
+# chunks are then combined with a streaming k-way merge (heapq.merge), so
+# memory follows the size of the result, not of the logs. The CLI writes
+# query()'s merge; the dashboard's session browser builds its row tables
+# in the same pool (get_pool, PARALLEL_MIN_BYTES) and compares times with
+# the same sort_key().
+import argparse
+import heapq
+import json
+import multiprocessing
+import os
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+
+import logindex
+import logstore
+import rollups
+
+WORKERS = int(os.environ.get("HONEYPOT_MERGE_WORKERS", "0")) or os.cpu_count() or 1
+SPLIT_BYTES = 32 * 1024 * 1024      # plain files larger than this are scanned in ranges
+PARALLEL_MIN_BYTES = 8 * 1024 * 1024  # below this in total, scanning in-process is faster
+OUTPUT = "all_sessions.jsonl"
+
+def sort_key(ts):
+    """Comparable form of an entry time ("" when missing or unparsable).
+
+    isoformat() leaves out zero microseconds, so the raw strings do not
+    always sort in time order.
+    """
+    if isinstance(ts, str) and len(ts) == 27 and ts[19] == "." and ts[26] == "Z":
+        return ts[:26]  # what the logger writes: already in that form
+    t = logstore.parse_time(ts) if ts else None
+    return t.isoformat(timespec="microseconds") if t is not None else ""
+
+def project(entry, fields):
+    """A copy of `entry` with only `fields` (dotted paths keep their nesting)."""
+    out = {}
+    for field in fields:
+        src, dst = entry, out
+        *parents, leaf = field.split(".")
+        for name in parents:
+            src = src.get(name) if isinstance(src, dict) else None
+            if src is None:
+                break
+            dst = dst.setdefault(name, {})
+        else:
+            if isinstance(src, dict) and leaf in src:
+                dst[leaf] = src[leaf]
+    return out
+
+def _lines(path, start, end):
+    """Lines (bytes) of `path` that start within [start, end) (the whole file when end is None)."""
+    if end is None and path.endswith((".gz", ".zst")):
+        with logstore.open_log(path) as f:
+            for line in f:
+                yield line.encode("utf-8")
+        return
+    with open(path, "rb") as f:
+        if end is None:
+            yield from f
+            return
+        if start:
+            f.seek(start - 1)
+            f.readline()  # finish the line that straddles the boundary
+        pos = f.tell()
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            yield line
+
+def scan(task):
+    """One file or byte range: (rows sorted by time, received tokens, skipped lines).
+
+    Rows are (sort key, record); the record is the original line when
+    `raw`, else the projected entry with "_source" set to the file.
+    """
+    path, start, end, since, until, fields, raw, tokens = task
+    lo = since.isoformat(timespec="microseconds") if since else None
+    hi = until.isoformat(timespec="microseconds") if until else None
+    rows, counts, skipped = [], Counter(), 0
+    # copying lines through needs only their time, usually read off the line's head
+    head = logindex._HEAD.match if raw and not tokens else None
+    for line in _lines(path, start, end):
+        line = line.strip()
+        if not line:
+            continue
+        m = head(line) if head else None
+        if m is not None:
+            key = sort_key(m.group(1).decode())
+            if not ((lo and key < lo) or (hi and key > hi)):
+                rows.append((key, line.decode("utf-8", "replace")))
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            skipped += 1
+            continue
+        if not isinstance(entry, dict):
+            skipped += 1
+            continue
+        key = sort_key(entry.get("time"))
+        if (lo and key < lo) or (hi and key > hi):
+            continue
+        if tokens:
+            for txt in rollups.received_texts(entry):
+                txt = str(txt).strip()
+                if txt:
+                    counts[txt.split()[0]] += 1
+        if raw:
+            record = line.decode("utf-8", "replace")
+        else:
+            record = project(entry, fields) if fields else entry
+            record["_source"] = str(path)
+        rows.append((key, record))
+    rows.sort(key=itemgetter(0))
+    return rows, counts, skipped
+
+def plan(paths, split_bytes=SPLIT_BYTES):
+    """(path, start, end) tasks: compressed files whole, large plain files in ranges."""
+    tasks = []
+    for path in map(str, paths):
+        size = os.path.getsize(path)
+        if path.endswith((".gz", ".zst")) or size <= split_bytes:
+            tasks.append((path, 0, None, size))
+            continue
+        for start in range(0, size, split_bytes):
+            tasks.append((path, start, min(size, start + split_bytes), split_bytes))
+    return tasks
+
+_pool = None
+
+def get_pool(workers=WORKERS):
+    # kept between queries (dashboard reruns); started without fork because
+    # the caller may have threads (Streamlit, the live feed subscriber)
+    global _pool
+    if _pool is None:
+        methods = multiprocessing.get_all_start_methods()
+        ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+    return _pool
+
+def run_scan(paths, since=None, until=None, fields=None, raw=False, tokens=False, workers=WORKERS):
+    """Scan `paths` (in parallel when worth it); returns (chunks, tokens, skipped)."""
+    tasks = plan([p for p in paths if os.path.exists(p)])
+    total = sum(size for *_, size in tasks)
+    args = [(path, start, end, since, until, tuple(fields) if fields else None, raw, tokens)
+            for path, start, end, _ in tasks]
+    if workers > 1 and len(args) > 1 and total >= PARALLEL_MIN_BYTES:
+        results = get_pool(workers).map(scan, args)
+    else:
+        results = map(scan, args)
+    chunks, counts, skipped = [], Counter(), 0
+    for rows, c, s in results:
+        if rows:
+            chunks.append(rows)
+        counts.update(c)
+        skipped += s
+    return chunks, counts, skipped
+
+def merge(chunks):
+    """Records of time-sorted chunks, in time order (a streaming k-way merge)."""
+    for _, record in heapq.merge(*chunks, key=itemgetter(0)):
+        yield record
+
+def query(paths, since=None, until=None, fields=None, raw=False, workers=WORKERS):
+    """Matching records of all `paths`, oldest first."""
+    chunks, _, _ = run_scan(paths, since, until, fields, raw, workers=workers)
+    return merge(chunks)
+
+def write_merged(paths, out, since=None, until=None, workers=WORKERS):
+    """Write the time-ordered merge of `paths` to `out` (atomically); returns lines written."""
+    out = os.path.abspath(out)
+    if os.path.exists(out) and any(os.path.exists(p) and os.path.samefile(p, out) for p in paths):
+        raise ValueError(f"{out} is one of the input files")
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(out), prefix=".merge-")
+    n = 0
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for line in query(paths, since, until, raw=True, workers=workers):
+                f.write(line + "\n")
+                n += 1
+        os.replace(tmp, out)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return n
+
+def main():
+    p = argparse.ArgumentParser(description="Merge JSONL session logs into one time-ordered file.")
+    p.add_argument("files", nargs="*", help="Log files (default: every log file in --log-dir)")
+    p.add_argument("--log-dir", default="logs")
+    p.add_argument("--since", help="Keep entries at or after this time (ISO, UTC)")
+    p.add_argument("--until", help="Keep entries at or before this time (ISO, UTC)")
+    p.add_argument("-o", "--output", default=OUTPUT, help=f"Merged file (default {OUTPUT})")
+    p.add_argument("--workers", type=int, default=WORKERS, help="Scanner processes (default: CPU count)")
+    args = p.parse_args()
+    since = logstore.parse_time(args.since) if args.since else None
+    until = logstore.parse_time(args.until) if args.until else None
+    paths = args.files or logstore.select_segments(args.log_dir, since, until)
+    if not paths:
+        raise SystemExit("No log files to merge")
+    try:
+        n = write_merged(paths, args.output, since, until, args.workers)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print(f"{args.output}: {n} entries from {len(paths)} files")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+# logstore.py - rotating session log, compressed segments and the segment manifest
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import logindex
+
+try:
+    import zstandard
+except ImportError:  # optional: fall back to gzip
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: rotation is then only safe within one process
+    fcntl = None
+
+# Rotation settings (0 disables that trigger)
+ROTATE_BYTES = int(os.environ.get("HONEYPOT_LOG_ROTATE_BYTES", str(64 * 1024 * 1024)))
+ROTATE_INTERVAL = int(os.environ.get("HONEYPOT_LOG_ROTATE_INTERVAL", "86400"))
+# "auto" (zstd if installed, else gzip), "zstd", "gzip" or "none"
+COMPRESSION = os.environ.get("HONEYPOT_LOG_COMPRESSION", "auto")
+
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = "manifest.json.lock"
+LOG_SUFFIXES = (".jsonl", ".json", ".jsonl.gz", ".jsonl.zst")
+
+# --- Reading -----------------------------------------------------------
+def open_log(path):
+    """Open a plain, gzip or zstd JSONL file for text reading."""
+    path = str(path)
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is not installed, cannot read {path}")
+        raw = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        return io.TextIOWrapper(raw, encoding="utf-8", errors="replace")
+    return open(path, "r", encoding="utf-8", errors="replace")
+
+def open_raw(path):
+    """Binary stream of a log's uncompressed bytes; forward seeks are supported
+    (compressed streams decompress and discard up to the target)."""
+    path = str(path)
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is not installed, cannot read {path}")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True))
+    return open(path, "rb")
+
+def is_log_file(name):
+    return name != MANIFEST_NAME and name.endswith(LOG_SUFFIXES)
+
+def parse_time(ts):
+    """Parse an ISO timestamp ("...Z" or naive) into a naive UTC datetime."""
+    if isinstance(ts, datetime):
+        return ts.replace(tzinfo=None)
+    try:
+        return datetime.fromisoformat(str(ts).replace("Z", "")).replace(tzinfo=None)
+    except Exception:
+        return None
+
+def in_range(ts, since=None, until=None):
+    if since is None and until is None:
+        return True
+    t = parse_time(ts)
+    if t is None:
+        return False
+    return (since is None or t >= since) and (until is None or t <= until)
+
+# --- Manifest ----------------------------------------------------------
+def manifest_path(log_dir):
+    return os.path.join(str(log_dir), MANIFEST_NAME)
+
+def load_manifest(log_dir):
+    try:
+        with open(manifest_path(log_dir), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+    manifest.setdefault("version", 1)
+    manifest.setdefault("segments", [])
+    return manifest
+
+def save_manifest(log_dir, manifest):
+    # write-then-rename so readers never see a half-written manifest; the tmp
+    # name is unique so concurrent writers never rename each other's file
+    path = manifest_path(log_dir)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=MANIFEST_NAME + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def select_segments(log_dir, since=None, until=None, source=None):
+    """Return log files that may hold records in [since, until], oldest first.
+
+    Closed segments are picked from the manifest by their recorded time
+    range; live (unrotated) files are always included since their range
+    is not known yet.
+    """
+    log_dir = str(log_dir)
+    manifest = load_manifest(log_dir)
+    known = set()
+    picked = []
+    for seg in manifest["segments"]:
+        known.add(seg["file"])
+        if source and seg.get("source") != source:
+            continue
+        start, end = parse_time(seg.get("start")), parse_time(seg.get("end"))
+        if since is not None and end is not None and end < since:
+            continue
+        if until is not None and start is not None and start > until:
+            continue
+        picked.append((seg.get("start") or "", os.path.join(log_dir, seg["file"])))
+    picked.sort()
+    paths = [p for _, p in picked if os.path.exists(p)]
+    if os.path.isdir(log_dir):
+        for name in sorted(os.listdir(log_dir)):
+            if name in known or not is_log_file(name) or name.endswith((".gz", ".zst")):
+                continue
+            if source and name != source:
+                continue
+            paths.append(os.path.join(log_dir, name))
+    return paths
+
+def iter_entries(paths, since=None, until=None):
+    """Yield parsed records from the given files, filtered by time range."""
+    for path in paths:
+        with open_log(path) as f:
+            for ln in f:
+                ln = ln.strip()
+                if not ln:
+                    continue
+                try:
+                    entry = json.loads(ln)
+                except ValueError:
+                    continue
+                if in_range(entry.get("time"), since, until):
+                    yield entry
+
+# --- Writing / rotation ------------------------------------------------
+def pick_codec(codec=COMPRESSION):
+    if codec == "auto":
+        return "zstd" if zstandard is not None else "gzip"
+    if codec == "zstd" and zstandard is None:
+        return "gzip"
+    return codec
+
+def compress_segment(path, codec):
+    """Compress a closed segment in one pass, collecting its manifest stats."""
+    records, start, end = 0, None, None
+    raw_bytes = os.path.getsize(path)
+    if codec == "gzip":
+        out_path = path + ".gz"
+        out = gzip.open(out_path, "wb")
+    elif codec == "zstd":
+        out_path = path + ".zst"
+        out = zstandard.ZstdCompressor(level=3).stream_writer(open(out_path, "wb"), closefd=True)
+    else:
+        out_path, out = path, None
+    with open(path, "rb") as f:
+        for ln in f:
+            if out is not None:
+                out.write(ln)
+            if not ln.strip():
+                continue
+            records += 1
+            try:
+                ts = json.loads(ln).get("time")
+            except ValueError:
+                continue
+            if ts:
+                # ISO strings in the same format sort chronologically
+                start = ts if start is None or ts < start else start
+                end = ts if end is None or ts > end else end
+    if out is not None:
+        out.close()
+        os.remove(path)
+    return {
+        "file": os.path.basename(out_path),
+        "codec": codec,
+        "start": start,
+        "end": end,
+        "records": records,
+        "bytes": os.path.getsize(out_path),
+        "raw_bytes": raw_bytes,
+    }
+
+def first_record_time(path):
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return parse_time(json.loads(f.readline()).get("time"))
+    except Exception:
+        return None
+
+class RotatingLog:
+    """Append-only JSONL file that rotates by size and/or wall-clock interval.
+
+    On rotation the active file is renamed to <name>-<UTC stamp>.jsonl,
+    compressed and recorded in the directory's manifest.
+
+    Several processes may write to one directory (server.py and
+    telenet_server.py share all_sessions.jsonl; workers write their own
+    files next to one manifest). Each write holds a shared flock on
+    manifest.json.lock and a rotation holds it exclusively from the rename
+    until the manifest is saved, so no line lands in a segment being
+    compressed and no manifest update is lost. Appending a batch and its
+    index records also holds an exclusive flock on the active file itself,
+    so the index sees every process's lines in file order.
+    """
+
+    def __init__(self, path, max_bytes=ROTATE_BYTES, interval=ROTATE_INTERVAL, codec=COMPRESSION):
+        self.path = str(path)
+        self.log_dir = os.path.dirname(self.path) or "."
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.codec = pick_codec(codec)
+        self._lock = threading.Lock()
+        self._lock_file = None
+        self._file = None  # the active file, kept open between writes
+        self.index = None  # logindex.IndexWriter, opened on first write
+        self.size = 0
+        self.inode = None  # of the active file as last seen, to notice rotations by other processes
+        self.started = None
+        self._sync()
+
+    def _flock(self, op):
+        if fcntl is None:
+            return
+        if self._lock_file is None:
+            self._lock_file = open(os.path.join(self.log_dir, LOCK_NAME), "a")
+        fcntl.flock(self._lock_file.fileno(), op)
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.path, "ab")
+            self.inode = os.fstat(self._file.fileno()).st_ino
+        return self._file
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+
+    def _sync(self):
+        """Pick up the active file's state as it is on disk."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self.size, self.inode, self.started = 0, None, None
+            return
+        self.size, self.inode, self.started = st.st_size, st.st_ino, None
+        if self.size:
+            t = first_record_time(self.path)
+            self.started = (t - datetime(1970, 1, 1)).total_seconds() if t else st.st_mtime
+
+    def _check_active(self):
+        """Follow a rotation another process did since our last look (lock held)."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        if st is None or st.st_ino != self.inode or st.st_size < self.size:
+            self._close()  # both are of the renamed file
+            self._sync()
+        else:
+            self.size = st.st_size  # other processes' appends count too
+
+    def _should_rotate(self, now, incoming):
+        if not self.size:
+            return False
+        if self.max_bytes and self.size + incoming > self.max_bytes:
+            return True
+        # wall-clock aligned, e.g. interval=86400 rotates at midnight UTC
+        if self.interval and self.started is not None:
+            return int(now // self.interval) != int(self.started // self.interval)
+        return False
+
+    def write(self, lines):
+        encoded = [ln.encode("utf-8") for ln in lines]
+        data = b"".join(encoded)
+        with self._lock:
+            now = time.time()
+            self._flock(fcntl.LOCK_SH if fcntl else None)
+            try:
+                self._check_active()
+                if self._should_rotate(now, len(data)):
+                    # the upgrade is not atomic: re-check, someone may have rotated in between
+                    self._flock(fcntl.LOCK_EX if fcntl else None)
+                    self._check_active()
+                    if self._should_rotate(now, len(data)):
+                        self._rotate()
+                f = self._open()
+                if fcntl:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    if logindex.ENABLED and self.index is None:
+                        self.index = logindex.IndexWriter(self.path)
+                    offset = f.seek(0, os.SEEK_END)
+                    f.write(data)
+                    f.flush()
+                    self.size = offset + len(data)
+                    if self.index is not None:
+                        self.index.append(offset, encoded)
+                finally:
+                    if fcntl:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            finally:
+                self._flock(fcntl.LOCK_UN if fcntl else None)
+            if self.started is None:
+                self.started = now
+
+    def rotate(self):
+        with self._lock:
+            self._flock(fcntl.LOCK_EX if fcntl else None)
+            try:
+                self._check_active()
+                if self.size:
+                    self._rotate()
+            finally:
+                self._flock(fcntl.LOCK_UN if fcntl else None)
+
+    def _rotate(self):
+        # callers hold self._lock and the exclusive flock
+        stem = os.path.basename(self.path)
+        if stem.endswith(".jsonl"):
+            stem = stem[:-len(".jsonl")]
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        closed = os.path.join(self.log_dir, f"{stem}-{stamp}.jsonl")
+        n = 1
+        while any(os.path.exists(closed + ext) for ext in ("", ".gz", ".zst")):
+            closed = os.path.join(self.log_dir, f"{stem}-{stamp}-{n}.jsonl")
+            n += 1
+        index = self.index
+        self._close()
+        os.replace(self.path, closed)
+        self.size = 0
+        self.inode = None
+        self.started = None
+        # the index follows the segment; its offsets are into the uncompressed
+        # stream, so it stays valid once the segment is compressed
+        if logindex.ENABLED:
+            if index is not None:
+                index.sort()
+                logindex.move_sidecars(self.path, closed)
+            else:
+                # e.g. rotating on the first write after a restart: pick up
+                # the sidecars there are and index what they miss
+                logindex.move_sidecars(self.path, closed)
+                logindex.IndexWriter(closed).sort()
+        else:
+            logindex.move_sidecars(self.path, None)  # stale: lines were written unindexed
+        info = compress_segment(closed, self.codec)
+        if info["file"] != os.path.basename(closed):
+            logindex.move_sidecars(closed, os.path.join(self.log_dir, info["file"]))
+        info["source"] = os.path.basename(self.path)
+        manifest = load_manifest(self.log_dir)
+        manifest["segments"].append(info)
+        save_manifest(self.log_dir, manifest)
+        return info
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+def get_log(path):
+    """Shared RotatingLog per path, so every writer sees the same size/state."""
+    path = os.path.abspath(str(path))
+    with _logs_lock:
+        log = _logs.get(path)
+        if log is None:
+            log = _logs[path] = RotatingLog(path)
+        return log
@@ -0,0 +1,210 @@
+# metrics.py - counters, gauges and histograms rendered in Prometheus text format
+import asyncio
+import bisect
+import os
+import time
+
+# Recording is a no-op until enable() is called (or HONEYPOT_METRICS=1), so
+# instrumented code costs one global check per call when metrics are off.
+ENABLED = os.environ.get("HONEYPOT_METRICS", "0") not in ("", "0", "false", "no")
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_registry = []
+
+def enable():
+    global ENABLED
+    ENABLED = True
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _fmt_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Family:
+    kind = "untyped"
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self._children = {}
+        _registry.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _samples(self):
+        # unlabelled families act as their own single child
+        if not self.label_names:
+            return [((), self.labels())]
+        return list(self._children.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self._samples():
+            lines.extend(child.render(self.name, self.label_names, values))
+        return lines
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        if ENABLED:
+            self.value += amount
+
+    def render(self, name, names, values):
+        return [f"{name}{_fmt_labels(names, values)} {self.value}"]
+
+class _GaugeChild:
+    __slots__ = ("value", "fn")
+
+    def __init__(self):
+        self.value = 0
+        self.fn = None
+
+    def set(self, value):
+        if ENABLED:
+            self.value = value
+
+    def inc(self, amount=1):
+        if ENABLED:
+            self.value += amount
+
+    def dec(self, amount=1):
+        if ENABLED:
+            self.value -= amount
+
+    def set_function(self, fn):
+        """Read the value from fn() at scrape time instead of tracking it."""
+        self.fn = fn
+
+    def render(self, name, names, values):
+        value = self.fn() if self.fn is not None else self.value
+        return [f"{name}{_fmt_labels(names, values)} {value}"]
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        if ENABLED:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self, name, names, values):
+        lines, running = [], 0
+        for bound, n in zip(self.buckets, self.counts):
+            running += n
+            le = 'le="%s"' % bound
+            lines.append(f"{name}_bucket{_fmt_labels(names, values, le)} {running}")
+        le = 'le="+Inf"'
+        lines.append(f"{name}_bucket{_fmt_labels(names, values, le)} {self.count}")
+        lines.append(f"{name}_sum{_fmt_labels(names, values)} {self.sum}")
+        lines.append(f"{name}_count{_fmt_labels(names, values)} {self.count}")
+        return lines
+
+class Counter(_Family):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+class Gauge(_Family):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, fn):
+        self.labels().set_function(fn)
+
+class Histogram(_Family):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, doc, labels)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+def render():
+    """All registered metrics in Prometheus text exposition format."""
+    lines = []
+    for family in _registry:
+        lines.extend(family.render())
+    return "\n".join(lines) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- Shared process metrics ----------------------------------------------
+LOOP_LAG = Histogram("honeypot_event_loop_lag_seconds", "How late the event loop woke a periodic timer")
+# per service; sessions/sec is rate(honeypot_sessions_total[1m])
+SESSIONS = Counter("honeypot_sessions_total", "Sessions/requests started", labels=("service",))
+ACTIVE_SESSIONS = Gauge("honeypot_active_sessions", "Sessions/requests in progress", labels=("service",))
+BYTES_IN = Counter("honeypot_bytes_received_total", "Bytes received from clients", labels=("service",))
+BYTES_OUT = Counter("honeypot_bytes_sent_total", "Bytes sent to clients", labels=("service",))
+
+async def monitor_loop_lag(interval=0.5):
+    """Observe event-loop lag: how much later than scheduled a sleep returns."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - start - interval))
+
+# --- Minimal scrape listener (for processes without aiohttp) -------------
+async def _serve_scrape(reader, writer):
+    try:
+        request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+        path = request.split(b" ", 2)[1] if request.count(b" ") >= 2 else b""
+        if path.split(b"?")[0] == b"/metrics":
+            body, status = render().encode(), b"200 OK"
+        else:
+            body, status = b"not found\n", b"404 Not Found"
+        writer.write(b"HTTP/1.0 " + status + b"\r\nContent-Type: " + CONTENT_TYPE.encode()
+                     + b"\r\nContent-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+        await writer.drain()
+    except Exception:
+        pass
+    finally:
+        writer.close()
+
+async def start_listener(host=None, port=None, unix_path=None):
+    """Serve GET /metrics on a local TCP port or Unix socket."""
+    if unix_path:
+        if os.path.exists(unix_path):
+            os.remove(unix_path)
+        return await asyncio.start_unix_server(_serve_scrape, unix_path, limit=8192)
+    return await asyncio.start_server(_serve_scrape, host or "127.0.0.1", port, limit=8192)
+
+def timer():
+    """perf_counter() when metrics are on, else 0 (skips the clock read)."""
+    return time.perf_counter() if ENABLED else 0.0
@@ -1,21 +1,42 @@
 #!/usr/bin/env python3
-# replay.py - replay a telnet/http session transcript for demo
+# replay.py - replay a telnet/http session transcript for demo, or load-test the honeypot
 import argparse
+import asyncio
 import json
+import sys
 import time
 import glob
 import os
 from datetime import datetime
+import logindex
+import logstore
+import transcript
 
 def find_newest_session():
     files = sorted(glob.glob("logs/session_*.jsonl"), key=os.path.getmtime, reverse=True)
+    if not files:
+        # the shared log written by logger.py
+        files = sorted(glob.glob("logs/*.jsonl"), key=os.path.getmtime, reverse=True)
     return files[0] if files else None
 
 def load_session(path):
-    with open(path, "r") as f:
-        # each file contains a single JSON object line
-        data = json.load(f)
-    return data
+    """Last session in a JSONL file (or the single object of a .json file)."""
+    # plain or compressed (.gz / .zst) file
+    with logstore.open_log(path) as f:
+        text = f.read()
+    last = None
+    for ln in text.splitlines():
+        ln = ln.strip()
+        if not ln:
+            continue
+        try:
+            last = json.loads(ln)
+        except ValueError:
+            continue
+    if last is None:
+        # a pretty-printed single session
+        last = json.loads(text)
+    return last
 
 def pretty_print_meta(sess):
     print("="*60)
@@ -25,45 +46,348 @@ def pretty_print_meta(sess):
     print("="*60)
 
 def replay_transcript(sess, speed=1.0, keep_timestamps=False):
-    # transcript expected as list of {"ts":..., "dir":"in"/"out", "text":...}
-    transcript = sess.get("data", {}).get("transcript") or sess.get("transcript") or []
-    if not transcript:
+    # any stored transcript format, as (offset_ms, dir, text); see transcript.py
+    events = [ev for ev in transcript.events(sess) if ev[1] != "meta"]
+    if not events:
         print("No transcript found in session.")
         return
 
     # If timestamps exist and keep_timestamps True, use their intervals; otherwise use fixed delay
-    if keep_timestamps and all("ts" in t for t in transcript):
-        # compute time differences in seconds
-        times = [datetime.fromisoformat(t["ts"].replace("Z","")) for t in transcript]
-        # normalize to start at 0
-        base = times[0]
-        intervals = [(t - base).total_seconds() for t in times]
-        last = 0.0
-        for interval, entry in zip(intervals, transcript):
-            wait = max(0.0, (interval - last) / speed)
-            time.sleep(wait)
-            last = interval
-            dir_ = entry.get("dir","?")
-            text = entry.get("text","")
-            prefix = "IN: " if dir_.lower().startswith("in") else "OUT"
+    if keep_timestamps and all(ev[0] is not None for ev in events):
+        last = events[0][0]
+        for offset, dir_, text in events:
+            time.sleep(max(0.0, (offset - last) / 1000.0 / speed))
+            last = offset
+            prefix = "IN: " if dir_ in ("in", "recv") else "OUT"
             print(f"{prefix} {text}")
     else:
         # simple fixed-delay replay
-        for entry in transcript:
-            dir_ = entry.get("dir","?")
-            text = entry.get("text","")
-            prefix = "IN:  " if dir_.lower().startswith("in") else "OUT: "
+        for offset, dir_, text in events:
+            prefix = "IN:  " if dir_ in ("in", "recv") else "OUT: "
             print(f"{prefix}{text}")
             # small pause for readability; scale with speed
             time.sleep(max(0.05, 0.5 / float(speed)))
 
+# --- Load generator ----------------------------------------------------
+# `replay.py load ...` drives recorded (or generated) sessions against a
+# running telenet_server.py / server.py and writes a JSON report.
+
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return {}
+    vals = sorted(values)
+    out = {f"p{p}": round(vals[min(len(vals) - 1, int(len(vals) * p / 100))], 3) for p in points}
+    out["max"] = round(vals[-1], 3)
+    out["mean"] = round(sum(vals) / len(vals), 3)
+    return out
+
+def inbound_steps(sess, speed):
+    """(delay_seconds, text) for each client line, delays taken from recorded timing."""
+    steps, prev = [], None
+    for offset, dir_, text in transcript.events(sess):
+        if dir_ in ("in", "recv"):
+            delay = (offset - prev) / 1000.0 if offset is not None and prev is not None and speed > 0 else 0.0
+            steps.append((max(0.0, delay / speed) if speed > 0 else 0.0, text))
+        prev = offset if offset is not None else prev
+    return steps
+
+def load_sessions(args):
+    if args.generate:
+        import random
+        import simulate
+        random.seed(args.seed)
+        return [simulate.generate_virtual_entry() for _ in range(args.generate)]
+    since = logstore.parse_time(args.since) if args.since else None
+    until = logstore.parse_time(args.until) if args.until else None
+    paths = args.files or logstore.select_segments(args.log_dir, since, until)
+    picked = []
+    for sess in logindex.find_entries(paths, since, until):
+        if args.target == "telnet" and sess.get("method") != "SESSION":
+            continue
+        if args.target == "http" and sess.get("method") in ("SESSION", "REJECTED"):
+            continue
+        picked.append(sess)
+        if len(picked) >= args.max_load:
+            break
+    return picked
+
+# every load connection comes from one source address, which telenet_server's
+# per-IP admission control (HONEYPOT_IP_BURST / HONEYPOT_IP_RATE /
+# HONEYPOT_MAX_PER_IP) refuses after the first few sessions
+ADMISSION_NOTE = (
+    "note: all connections come from one source IP. With its defaults the telnet server admits 10 at once, "
+    "then 2/s, and at most 20 concurrent sessions per IP; refused ones count as closed_by_server. To measure "
+    "the honeypot rather than the rate limiter, start it with "
+    "HONEYPOT_IP_BURST=1000000 HONEYPOT_IP_RATE=1000000 HONEYPOT_MAX_PER_IP=1000000.")
+
+class LoadStats:
+    def __init__(self):
+        self.started = 0
+        self.completed = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.closed = 0  # hung up by the server before login finished (e.g. refused by admission control)
+        self.latencies = []
+        self.connect = []
+        self.closed_at = {}  # marker -> client close time, for log lag
+        self.log_lag = []
+
+async def read_prompt(reader, prompt, timeout):
+    return await asyncio.wait_for(reader.readuntil(prompt), timeout)
+
+async def run_telnet_session(sess, n, args, table, stats):
+    steps = inbound_steps(sess, args.speed)
+    # recorded honeypot sessions start with user/<password>/user/<password>;
+    # generated ones only hold shell commands, so a login is prepended
+    if len(steps) >= 4 and steps[1][1] == "<password>":
+        login, commands = steps[:4], steps[4:]
+    else:
+        user = sess.get("data", {}).get("username") or "admin"
+        login = [(0.0, user), (0.0, "<password>"), (0.0, user), (0.0, "<password>")]
+        commands = steps
+    marker = f"load-{args.run_id}-{n}"
+    if args.server_log:
+        # tag the accepted username so the session can be found in the server log
+        login[2] = (login[2][0], marker)
+    prompts = [table.password_prompt, b"login: ", table.password_prompt, table.prompt]
+    t0 = time.perf_counter()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(args.host, args.port), args.timeout)
+    stats.connect.append((time.perf_counter() - t0) * 1000.0)
+    try:
+        await read_prompt(reader, b"login: ", args.timeout)
+        for (delay, text), prompt in zip(login, prompts):
+            if delay:
+                await asyncio.sleep(delay)
+            writer.write(("password" if text == "<password>" else text).encode() + b"\r\n")
+            await read_prompt(reader, prompt, args.timeout)
+        for delay, text in commands:
+            if delay:
+                await asyncio.sleep(delay)
+            t0 = time.perf_counter()
+            writer.write(text.encode() + b"\r\n")
+            try:
+                await read_prompt(reader, table.prompt, args.timeout)
+            except asyncio.IncompleteReadError:
+                break  # server hung up (exit/logout)
+            stats.latencies.append((time.perf_counter() - t0) * 1000.0)
+    finally:
+        writer.close()
+        stats.closed_at[marker] = time.time()
+
+def post_body(data):
+    """(form fields or text, content type) to POST again for a logged request's data."""
+    if isinstance(data.get("form"), dict):
+        return dict(data["form"]), None
+    body = data.get("body")
+    if isinstance(body, dict):
+        # a body stored on disk was logged with its preview only
+        return body.get("text", body.get("preview", "")), body.get("content_type")
+    # entries from before bodies were captured: the form fields themselves
+    return {k: v for k, v in data.items() if k not in ("query", "user_agent")}, None
+
+async def run_http_session(sess, n, args, http, stats):
+    path = sess.get("path") or "/"
+    method = sess.get("method") or "GET"
+    data, content_type = post_body(sess.get("data") or {}) if method == "POST" else (None, None)
+    marker = f"load-{args.run_id}-{n}"
+    params = headers = None
+    if data is not None and args.server_log:
+        if isinstance(data, dict):
+            data["_load_marker"] = marker
+        else:
+            params = {"_load_marker": marker}  # logged under data.query
+    if content_type and not isinstance(data, dict):
+        headers = {"Content-Type": content_type}
+    t0 = time.perf_counter()
+    async with http.request(method, f"http://{args.host}:{args.port}{path}", data=data,
+                            params=params, headers=headers) as resp:
+        await resp.read()
+    stats.latencies.append((time.perf_counter() - t0) * 1000.0)
+    if data is not None and args.server_log:
+        # only POSTs carry the marker into the log line
+        stats.closed_at[marker] = time.time()
+
+async def tail_server_log(path, stats, stop):
+    """Measure how long after the client finished each tagged session shows up in the log."""
+    offset = os.path.getsize(path) if os.path.exists(path) else 0
+    needle = b"load-"
+    while True:
+        if os.path.exists(path):
+            if os.path.getsize(path) < offset:
+                offset = 0  # rotated underneath us
+            with open(path, "rb") as f:
+                f.seek(offset)
+                chunk = f.read()
+            end = chunk.rfind(b"\n") + 1
+            now = time.time()
+            for ln in chunk[:end].splitlines():
+                i = ln.find(needle)
+                if i < 0:
+                    continue
+                j = ln.find(b'"', i)
+                marker = ln[i:j].decode(errors="ignore")
+                closed = stats.closed_at.pop(marker, None)
+                if closed is not None:
+                    stats.log_lag.append((now - closed) * 1000.0)
+            offset += end
+        if stop.is_set() and not stats.closed_at:
+            return
+        await asyncio.sleep(0.05)
+
+async def run_load(args, sessions):
+    import shell
+    table = shell.load_persona(args.persona)
+    stats = LoadStats()
+    sem = asyncio.Semaphore(args.concurrency)
+    http = None
+    if args.target == "http":
+        import aiohttp
+        http = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=args.timeout))
+    stop = asyncio.Event()
+    tailer = asyncio.ensure_future(tail_server_log(args.server_log, stats, stop)) if args.server_log else None
+
+    async def one(n):
+        sess = sessions[n % len(sessions)]
+        try:
+            if http is not None:
+                await run_http_session(sess, n, args, http, stats)
+            else:
+                await run_telnet_session(sess, n, args, table, stats)
+            stats.completed += 1
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            stats.closed += 1
+        except Exception:
+            stats.errors += 1
+        finally:
+            sem.release()
+
+    tasks = []
+    t_start = time.perf_counter()
+    for n in range(args.sessions or len(sessions)):
+        await sem.acquire()
+        if args.rate:
+            # open connections on a fixed schedule rather than as fast as possible
+            delay = t_start + n / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        stats.started += 1
+        tasks.append(asyncio.ensure_future(one(n)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - t_start
+    if http is not None:
+        await http.close()
+    if tailer is not None:
+        stop.set()
+        try:
+            await asyncio.wait_for(tailer, args.log_wait)
+        except asyncio.TimeoutError:
+            pass
+
+    return {
+        "run_id": args.run_id,
+        "time": datetime.utcnow().isoformat() + "Z",
+        "config": {
+            "target": args.target, "host": args.host, "port": args.port,
+            "concurrency": args.concurrency, "rate": args.rate, "speed": args.speed,
+            "source": "generated" if args.generate else "logs", "loaded_sessions": len(sessions),
+        },
+        "elapsed_s": round(elapsed, 3),
+        "sessions_started": stats.started,
+        "sessions_completed": stats.completed,
+        "connections_per_s": round(stats.completed / elapsed, 2) if elapsed else 0.0,
+        "errors": stats.errors,
+        "timeouts": stats.timeouts,
+        "closed_by_server": stats.closed,
+        "commands": len(stats.latencies),
+        "command_latency_ms": percentiles(stats.latencies),
+        "connect_latency_ms": percentiles(stats.connect),
+        "log_lag_ms": percentiles(stats.log_lag),
+        "log_lag_missing": len(stats.closed_at) if args.server_log else None,
+    }
+
+def load_main(argv):
+    p = argparse.ArgumentParser(prog="replay.py load",
+                                description="Drive recorded/generated sessions against a running honeypot.")
+    p.add_argument("files", nargs="*", help="Log files to take sessions from (default: logs/ via the manifest)")
+    p.add_argument("--target", choices=("telnet", "http"), default="telnet")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, help="Default 2323 for telnet, 8080 for http")
+    p.add_argument("--concurrency", type=int, default=50, help="Max sessions in flight (default 50)")
+    p.add_argument("--rate", type=float, default=0.0, help="New connections per second (default: as fast as concurrency allows)")
+    p.add_argument("--sessions", type=int, default=0, help="Sessions to run, cycling the loaded ones (default: each once)")
+    p.add_argument("--speed", type=float, default=1.0, help="Scale recorded inter-command timing; 0 = no waiting")
+    p.add_argument("--timeout", type=float, default=10.0, help="Per-step timeout in seconds")
+    p.add_argument("--generate", type=int, default=0, help="Use N sessions from simulate.generate_virtual_entry instead of logs")
+    p.add_argument("--seed", type=int, default=1, help="Random seed for --generate")
+    p.add_argument("--since", help="Only take logged sessions at/after this ISO time")
+    p.add_argument("--until", help="Only take logged sessions at/before this ISO time")
+    p.add_argument("--log-dir", default="logs")
+    p.add_argument("--max-load", type=int, default=10000, help="Max sessions read from logs")
+    p.add_argument("--persona", default=None, help="Persona file for the prompts (default: routeros)")
+    p.add_argument("--server-log", help="Server log to tail for log lag (e.g. logs/all_sessions.jsonl)")
+    p.add_argument("--log-wait", type=float, default=10.0, help="Seconds to wait for tagged sessions to reach the server log")
+    p.add_argument("--report", default="load_report.json", help="Where to write the JSON report")
+    args = p.parse_args(argv)
+    if args.port is None:
+        args.port = 2323 if args.target == "telnet" else 8080
+    if args.persona is None:
+        import shell
+        args.persona = shell.DEFAULT_PERSONA
+    args.run_id = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+
+    sessions = load_sessions(args)
+    if not sessions:
+        print("No sessions to replay.")
+        return
+    if args.target == "telnet":
+        print(ADMISSION_NOTE, file=sys.stderr)
+    report = asyncio.run(run_load(args, sessions))
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Report written to {args.report}")
+    if report["closed_by_server"]:
+        print(f"{report['closed_by_server']} sessions were closed by the server before logging in: "
+              "most likely refused by its per-IP admission limits (see above).", file=sys.stderr)
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "load":
+        return load_main(sys.argv[2:])
     p = argparse.ArgumentParser(description="Replay a honeypot session transcript (JSONL).")
     p.add_argument("session_file", nargs="?", help="Path to session JSONL file (default: newest in logs/)")
     p.add_argument("--speed", type=float, default=1.0, help="Playback speed multiplier (default 1.0). >1 = faster")
     p.add_argument("--timestamps", action="store_true", help="Respect recorded timestamps (if available)")
+    p.add_argument("--since", help="Replay logged sessions at/after this ISO time (uses logs/manifest.json)")
+    p.add_argument("--until", help="Replay logged sessions at/before this ISO time")
+    p.add_argument("--ip", help="Replay logged sessions from this source IP")
+    p.add_argument("--session-id", help="Replay the logged session with this id")
+    p.add_argument("--limit", type=int, default=1, help="Max sessions to replay with --since/--until/--ip (default 1)")
+    p.add_argument("--log-dir", default="logs", help="Log directory for the selectors (default logs/)")
     args = p.parse_args()
 
+    if args.since or args.until or args.ip or args.session_id:
+        since = logstore.parse_time(args.since) if args.since else None
+        until = logstore.parse_time(args.until) if args.until else None
+        # rotated segments outside the range are skipped without being opened,
+        # and indexed files are read only at the matching offsets
+        if args.session_file:
+            paths = [args.session_file]
+        else:
+            paths = logstore.select_segments(args.log_dir, since, until)
+        replayed = 0
+        for sess in logindex.find_entries(paths, since, until, ip=args.ip, session_id=args.session_id):
+            pretty_print_meta(sess)
+            replay_transcript(sess, speed=args.speed, keep_timestamps=args.timestamps)
+            print("\n--- End of session ---")
+            replayed += 1
+            if replayed >= args.limit:
+                break
+        if not replayed:
+            print("No matching sessions found.")
+        return
+
     session_file = args.session_file
     if not session_file:
         session_file = find_newest_session()
@@ -0,0 +1,385 @@
+# rollups.py - aggregates kept up to date as sessions are logged
+#
+# Each process that logs sessions keeps a Rollup for the log it writes and
+# saves it every SAVE_INTERVAL seconds to logs/rollups/<log name>.<pid>.json.
+# Every part is mergeable (counter sums, heavy-hitter merge, HyperLogLog
+# register max), so readers just merge all files for a log; the cost depends
+# on the retention window and sketch sizes, not on how big the log is.
+import base64
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import ioc
+import ipenrich
+import transcript
+
+ROLLUP_DIR_NAME = "rollups"
+ENABLED = os.environ.get("HONEYPOT_ROLLUPS", "1") not in ("", "0", "false", "no")
+SAVE_INTERVAL = float(os.environ.get("HONEYPOT_ROLLUP_SAVE_INTERVAL", "10"))
+# per-minute counts are kept this long; older minutes are folded into hours
+MINUTE_RETENTION = timedelta(days=int(os.environ.get("HONEYPOT_ROLLUP_MINUTE_DAYS", "7")))
+# distinct-IP sketches are kept per hour for this long
+HLL_RETENTION = timedelta(days=int(os.environ.get("HONEYPOT_ROLLUP_HLL_DAYS", "30")))
+IP_CAPACITY = 1000
+TOKEN_CAPACITY = 500
+CAMPAIGN_CAPACITY = 1000
+ASN_CAPACITY = 1000
+IOC_CAPACITY = 20000
+HLL_P = 11  # 2048 registers, ~2.3% standard error
+
+# --- Sketches ------------------------------------------------------------
+class TopK:
+    """Heavy-hitters sketch: exact counts for at most `capacity` items.
+
+    When the table reaches twice the capacity it is pruned back to the top
+    `capacity` items, and `error` remembers the largest count thrown away:
+    any item's true count is at most its count here plus `error`, so items
+    well above `error` are reliably the heaviest ones.
+    """
+
+    def __init__(self, capacity, counts=None, error=0):
+        self.capacity = capacity
+        self.counts = Counter(counts or {})
+        self.error = error
+
+    def add(self, item, n=1):
+        self.counts[item] += n
+        if len(self.counts) >= 2 * self.capacity:
+            self._prune()
+
+    def _prune(self):
+        keep = self.counts.most_common(self.capacity)
+        if len(self.counts) > len(keep):
+            self.error = max(self.error, keep[-1][1])
+        self.counts = Counter(dict(keep))
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.error += other.error
+        if len(self.counts) > self.capacity:
+            self._prune()
+
+    def top(self, n):
+        return self.counts.most_common(n)
+
+    def to_dict(self):
+        return {"capacity": self.capacity, "error": self.error, "counts": dict(self.counts)}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["capacity"], d["counts"], d.get("error", 0))
+
+class IocTable:
+    """Deduplicated IOCs: "kind:value" -> [first seen, last seen, hits].
+
+    Pruned like TopK (back to the `capacity` most hit when twice as large),
+    so a flood of one-off values cannot grow it without bound.
+    """
+
+    def __init__(self, capacity=IOC_CAPACITY, rows=None):
+        self.capacity = capacity
+        self.rows = dict(rows or {})
+
+    def add(self, key, ts, n=1):
+        row = self.rows.get(key)
+        if row is None:
+            self.rows[key] = [ts, ts, n]
+            if len(self.rows) >= 2 * self.capacity:
+                self._prune()
+            return
+        if ts and (not row[0] or ts < row[0]):
+            row[0] = ts
+        if ts and (not row[1] or ts > row[1]):
+            row[1] = ts
+        row[2] += n
+
+    def _prune(self):
+        keep = sorted(self.rows.items(), key=lambda kv: (kv[1][2], kv[1][1] or ""), reverse=True)
+        self.rows = dict(keep[: self.capacity])
+
+    def merge(self, other):
+        for key, (first, last, hits) in other.rows.items():
+            row = self.rows.get(key)
+            if row is None:
+                self.rows[key] = [first, last, hits]
+                continue
+            row[0] = min(t for t in (row[0], first) if t) if row[0] or first else None
+            row[1] = max(row[1] or "", last or "") or None
+            row[2] += hits
+        if len(self.rows) > 2 * self.capacity:
+            self._prune()
+
+    def top(self, n, kind=None):
+        """[(kind, value, first, last, hits)] by hits."""
+        rows = ((k.split(":", 1), r) for k, r in self.rows.items())
+        rows = [(kv[0], kv[1], r[0], r[1], r[2]) for kv, r in rows if kind is None or kv[0] == kind]
+        return sorted(rows, key=lambda r: r[4], reverse=True)[:n]
+
+    def to_dict(self):
+        return {"capacity": self.capacity, "rows": self.rows}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d.get("capacity", IOC_CAPACITY), d.get("rows"))
+
+class HyperLogLog:
+    """Distinct-count estimate in 2**p one-byte registers."""
+
+    def __init__(self, p=HLL_P, registers=None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+
+    def add(self, item):
+        x = int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), "big")
+        idx = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # small range: linear counting is more accurate
+            return round(m * math.log(m / zeros))
+        return round(estimate)
+
+    def to_str(self):
+        return base64.b64encode(bytes(self.registers)).decode()
+
+    @classmethod
+    def from_str(cls, s, p=HLL_P):
+        return cls(p, base64.b64decode(s))
+
+# --- Rollup --------------------------------------------------------------
+def received_texts(entry):
+    """What the client sent: transcript "in" lines and "recv" events."""
+    for _, dir_, text in transcript.events(entry):
+        if dir_ in ("in", "recv"):
+            yield text
+
+class Rollup:
+    """Per-minute counts, per-service counts, top IPs, top command tokens,
+    top campaigns (transcript store hashes), the IOC table, sessions per
+    ASN and country and distinct IPs per hour for one log."""
+
+    def __init__(self):
+        self.total = 0
+        self.minutes = Counter()  # "YYYY-MM-DDTHH:MM" -> sessions
+        self.hours = Counter()    # "YYYY-MM-DDTHH" -> sessions, for minutes past retention
+        self.services = Counter()
+        self.ips = TopK(IP_CAPACITY)
+        self.tokens = TopK(TOKEN_CAPACITY)
+        self.campaigns = TopK(CAMPAIGN_CAPACITY)
+        self.iocs = IocTable()
+        self.asns = TopK(ASN_CAPACITY)
+        self.countries = Counter()
+        self.distinct = {}        # "YYYY-MM-DDTHH" -> HyperLogLog
+        self.first = None
+        self.last = None
+
+    def add(self, entry):
+        ts = str(entry.get("time") or "")
+        ip = entry.get("src_ip")
+        self.total += 1
+        # ISO strings: the minute and hour are prefixes
+        if len(ts) >= 16:
+            self.minutes[ts[:16]] += 1
+            if ip:
+                hll = self.distinct.get(ts[:13])
+                if hll is None:
+                    hll = self.distinct[ts[:13]] = HyperLogLog()
+                hll.add(ip)
+            self.first = ts if self.first is None or ts < self.first else self.first
+            self.last = ts if self.last is None or ts > self.last else self.last
+        self.services[str(entry.get("service", ""))] += 1
+        if ip:
+            self.ips.add(ip)
+        for text in received_texts(entry):
+            text = str(text).strip()
+            if text:
+                self.tokens.add(text.split()[0])
+        campaign = transcript.ref(entry)
+        if campaign:
+            self.campaigns.add(campaign)
+        for kind, value in ioc.items(entry):
+            self.iocs.add(f"{kind}:{value}", ts or None)
+        info = entry.get("src_info")
+        if isinstance(info, dict):
+            asn = ipenrich.asn_label(info)
+            if asn:
+                self.asns.add(asn)
+            if info.get("country"):
+                self.countries[str(info["country"])] += 1
+
+    def merge(self, other):
+        self.total += other.total
+        self.minutes.update(other.minutes)
+        self.hours.update(other.hours)
+        self.services.update(other.services)
+        self.ips.merge(other.ips)
+        self.tokens.merge(other.tokens)
+        self.campaigns.merge(other.campaigns)
+        self.iocs.merge(other.iocs)
+        self.asns.merge(other.asns)
+        self.countries.update(other.countries)
+        for hour, hll in other.distinct.items():
+            if hour in self.distinct:
+                self.distinct[hour].merge(hll)
+            else:
+                self.distinct[hour] = HyperLogLog(hll.p, hll.registers)
+        for attr in ("first", "last"):
+            mine, theirs = getattr(self, attr), getattr(other, attr)
+            if mine is None or (theirs is not None and (theirs < mine if attr == "first" else theirs > mine)):
+                setattr(self, attr, theirs)
+
+    def expire(self, now=None):
+        """Fold minutes past MINUTE_RETENTION into hours; drop old HLLs."""
+        now = now or datetime.utcnow()
+        cutoff = (now - MINUTE_RETENTION).strftime("%Y-%m-%dT%H:%M")
+        for minute in [m for m in self.minutes if m < cutoff]:
+            self.hours[minute[:13]] += self.minutes.pop(minute)
+        cutoff = (now - HLL_RETENTION).strftime("%Y-%m-%dT%H")
+        for hour in [h for h in self.distinct if h < cutoff]:
+            del self.distinct[hour]
+
+    def distinct_ips(self):
+        """{hour: estimated distinct source IPs}"""
+        return {hour: hll.count() for hour, hll in sorted(self.distinct.items())}
+
+    def to_dict(self):
+        return {
+            "version": 1, "total": self.total, "first": self.first, "last": self.last,
+            "minutes": dict(self.minutes), "hours": dict(self.hours), "services": dict(self.services),
+            "ips": self.ips.to_dict(), "tokens": self.tokens.to_dict(), "campaigns": self.campaigns.to_dict(),
+            "iocs": self.iocs.to_dict(), "asns": self.asns.to_dict(), "countries": dict(self.countries),
+            "distinct": {h: hll.to_str() for h, hll in self.distinct.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        r = cls()
+        r.total = d.get("total", 0)
+        r.first, r.last = d.get("first"), d.get("last")
+        r.minutes = Counter(d.get("minutes", {}))
+        r.hours = Counter(d.get("hours", {}))
+        r.services = Counter(d.get("services", {}))
+        r.ips = TopK.from_dict(d["ips"]) if "ips" in d else TopK(IP_CAPACITY)
+        r.tokens = TopK.from_dict(d["tokens"]) if "tokens" in d else TopK(TOKEN_CAPACITY)
+        r.campaigns = TopK.from_dict(d["campaigns"]) if "campaigns" in d else TopK(CAMPAIGN_CAPACITY)
+        r.iocs = IocTable.from_dict(d["iocs"]) if "iocs" in d else IocTable()
+        r.asns = TopK.from_dict(d["asns"]) if "asns" in d else TopK(ASN_CAPACITY)
+        r.countries = Counter(d.get("countries", {}))
+        r.distinct = {h: HyperLogLog.from_str(s) for h, s in d.get("distinct", {}).items()}
+        return r
+
+# --- Files -----------------------------------------------------------------
+def rollup_dir(log_dir):
+    return os.path.join(str(log_dir), ROLLUP_DIR_NAME)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class RollupWriter:
+    """The Rollup of one log in this process, saved every `interval` seconds.
+
+    On start it adopts files left by processes that have exited (renaming
+    a file first, so only one new process can claim it), which keeps the
+    number of files bounded across restarts.
+    """
+
+    def __init__(self, log_path, interval=SAVE_INTERVAL):
+        self.dir = rollup_dir(os.path.dirname(os.path.abspath(str(log_path))))
+        self.source = os.path.basename(str(log_path))
+        self.path = os.path.join(self.dir, f"{self.source}.{os.getpid()}.json")
+        self.interval = interval
+        self.rollup = Rollup()
+        self._next_save = time.monotonic() + interval
+        self.dirty = False
+        self.lock = threading.Lock()
+        os.makedirs(self.dir, exist_ok=True)
+        self._adopt()
+
+    def _adopt(self):
+        for name in os.listdir(self.dir):
+            parts = name.split(".")
+            if not name.startswith(self.source + ".") or not name.endswith(".json") or not parts[-2].isdigit():
+                continue
+            pid = int(parts[-2])
+            if pid == os.getpid() or _pid_alive(pid):
+                continue
+            claimed = os.path.join(self.dir, f"{name}.claimed-{os.getpid()}")
+            try:
+                os.rename(os.path.join(self.dir, name), claimed)
+            except OSError:
+                continue  # another process got it first
+            try:
+                with open(claimed, "r", encoding="utf-8") as f:
+                    self.rollup.merge(Rollup.from_dict(json.load(f)))
+            except (OSError, ValueError):
+                pass
+            self._save()
+            os.remove(claimed)
+
+    def add(self, entries):
+        with self.lock:
+            for entry in entries:
+                self.rollup.add(entry)
+            self.dirty = True
+            if time.monotonic() >= self._next_save:
+                self._save()
+
+    def save(self):
+        with self.lock:
+            if self.dirty:
+                self._save()
+
+    def _save(self):
+        self.rollup.expire()
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.rollup.to_dict(), f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+        self.dirty = False
+        self._next_save = time.monotonic() + self.interval
+
+def load(log_dir, source):
+    """Merged Rollup of every process file for one log (None if there are none)."""
+    d = rollup_dir(log_dir)
+    if not os.path.isdir(d):
+        return None
+    merged = None
+    for name in sorted(os.listdir(d)):
+        if not name.startswith(source + ".") or not name.endswith(".json"):
+            continue
+        if not name[len(source) + 1:-len(".json")].isdigit():
+            continue
+        try:
+            with open(os.path.join(d, name), "r", encoding="utf-8") as f:
+                part = Rollup.from_dict(json.load(f))
+        except (OSError, ValueError):
+            continue  # replaced while reading; picked up next time
+        if merged is None:
+            merged = part
+        else:
+            merged.merge(part)
+    return merged
@@ -1,43 +1,258 @@
 # server.py
+#
+# Every path and method goes to one catch-all handler. Request bodies are
+# read as a stream: up to BODY_CAP bytes stay in memory and are logged
+# whole; a larger body goes to a content-addressed file
+#
+#   logs/bodies/<first 2 hex>/<sha256>.bin
+#
+# and the log line keeps {"size", "sha256", "preview", "stored"} instead,
+# "stored" being that name relative to the bodies directory.
+# Replies come from PAGES, built once at import: serving a fake page only
+# wraps bytes that already exist in a Response.
 from aiohttp import web
-from logger import log_request
+import livefeed
+import logger
+import metrics
+from logger import log_request_async
 import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import time
+from urllib.parse import parse_qsl
 
 # Config
 HOST = "0.0.0.0"
 PORT = 8080
 SERVICE_NAME = "virtual-iot-http"
+METRICS_PATH = "/metrics"
+# serve METRICS_PATH on the decoy port itself (explicit opt-in); otherwise it is
+# a path like any other and metrics are scraped from a local listener
+PUBLIC_METRICS = os.environ.get("HONEYPOT_HTTP_METRICS", "0") not in ("", "0", "false", "no")
 
-async def index(request):
-    ip = request.remote or request.transport.get_extra_info('peername')[0]
-    # log GET to /
-    log_request(ip, SERVICE_NAME, "/", "GET", {})
-    return web.Response(text="Device status: OK\n", content_type='text/plain')
+# Request bodies (can be overridden from the environment)
+BODY_CAP = int(os.environ.get("HONEYPOT_HTTP_BODY_CAP", str(8 * 1024)))          # kept in memory / logged whole
+BODY_MAX = int(os.environ.get("HONEYPOT_HTTP_BODY_MAX", str(16 * 1024 * 1024)))  # read at most this much
+BODY_TIMEOUT = float(os.environ.get("HONEYPOT_HTTP_BODY_TIMEOUT", "30"))         # seconds for the whole body
+BODY_DIR = os.environ.get("HONEYPOT_HTTP_BODY_DIR", os.path.join(logger.LOG_DIR, "bodies"))
+BODY_PREVIEW = 1024  # bytes of a spilled body kept in the log line
+CHUNK_SIZE = 64 * 1024
 
-async def login(request):
-    ip = request.remote or request.transport.get_extra_info('peername')[0]
+REQUESTS = metrics.SESSIONS.labels(SERVICE_NAME)
+ACTIVE_REQUESTS = metrics.ACTIVE_SESSIONS.labels(SERVICE_NAME)
+BYTES_IN = metrics.BYTES_IN.labels(SERVICE_NAME)
+BYTES_OUT = metrics.BYTES_OUT.labels(SERVICE_NAME)
+HANDLER_SECONDS = metrics.Histogram("honeypot_http_handler_seconds", "Time spent in HTTP handlers", labels=("method",))
+BODIES = metrics.Counter("honeypot_http_bodies_total", "Request bodies by where they were kept", labels=("outcome",))
+BODIES_INLINE = BODIES.labels("inline")
+BODIES_SPILLED = BODIES.labels("spilled")
+BODIES_TRUNCATED = BODIES.labels("truncated")
+
+# --- Pre-built responses ---------------------------------------------------
+def page(body, content_type="text/html", status=200, **headers):
+    """(status, body bytes, headers) of a reply, serialized once."""
+    if not isinstance(body, bytes):
+        body = (json.dumps(body) if content_type == "application/json" else body).encode("utf-8")
+    return status, body, {"Content-Type": f"{content_type}; charset=utf-8", **headers}
+
+LOGIN_FORM = """<html><head><title>SmartCam-1000</title></head><body>
+<form method="POST" action="/login"><h3>SmartCam-1000 Web Admin</h3>
+User <input name="username"> Password <input name="password" type="password">
+<input type="submit" value="Login"></form></body></html>
+"""
+
+# (method or "*", path) -> reply; unknown paths get NOT_FOUND
+PAGES = {
+    ("GET", "/"): page("Device status: OK\n", "text/plain"),
+    ("GET", "/status"): page({"device": "SmartCam-1000", "uptime": "3 days", "status": "ok"}, "application/json"),
+    ("POST", "/login"): page("Invalid credentials\n", "text/plain"),
+    ("GET", "/login"): page(LOGIN_FORM),
+    ("*", "/cgi-bin/luci"): page(LOGIN_FORM),
+    ("*", "/HNAP1/"): page('<?xml version="1.0" encoding="utf-8"?><soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body><GetDeviceSettingsResponse><ModelName>SmartCam-1000</ModelName></GetDeviceSettingsResponse></soap:Body></soap:Envelope>', "text/xml"),
+    ("*", "/boaform/admin/formLogin"): page(LOGIN_FORM),
+    ("*", "/GponForm/diag_Form"): page("", "text/plain"),
+    ("*", "/shell"): page("", "text/plain"),
+}
+NOT_FOUND = page("<html><body><h1>404 - Not Found</h1></body></html>\n", status=404)
+
+def reply_for(method, path):
+    if method == "HEAD":
+        method = "GET"  # same status and headers; aiohttp leaves the body out
+    return PAGES.get((method, path)) or PAGES.get(("*", path)) or NOT_FOUND
+
+# --- Request bodies ----------------------------------------------------------
+def body_path(digest):
+    return os.path.join(BODY_DIR, digest[:2], f"{digest}.bin")
+
+def _store(tmp, digest):
+    """Move a spilled body to its content-addressed name (once per content);
+    returns that name relative to BODY_DIR."""
+    path = body_path(digest)
+    if os.path.exists(path):
+        os.unlink(tmp)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp, path)
+    return os.path.relpath(path, BODY_DIR)
+
+async def capture_body(request):
+    """Read the body in chunks; returns (record for the log, the bytes if kept in memory).
+
+    Up to BODY_CAP bytes are kept and returned; past that, what was read and
+    the rest go to a temporary file that is renamed to its SHA-256 at the end.
+    Reading stops at BODY_MAX bytes or BODY_TIMEOUT seconds.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + BODY_TIMEOUT
+    digest = hashlib.sha256()
+    head = bytearray()
+    spill = tmp = None
+    size, stopped = 0, None
     try:
-        post = await request.post()
-        data = dict(post)
-    except Exception:
-        # fallback to raw body
-        body = await request.text()
-        data = {"raw": body}
-    # log the POSTed credentials / body
-    log_request(ip, SERVICE_NAME, "/login", "POST", data)
-    # Return a plausible-but-fake response
-    return web.Response(text="Invalid credentials\n", content_type='text/plain')
-
-async def status(request):
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                stopped = "timeout"
+                break
+            try:
+                chunk = await asyncio.wait_for(request.content.read(CHUNK_SIZE), remaining)
+            except asyncio.TimeoutError:
+                stopped = "timeout"
+                break
+            if not chunk:
+                break
+            if size + len(chunk) > BODY_MAX:
+                chunk = chunk[:BODY_MAX - size]
+                stopped = "max_size"
+            size += len(chunk)
+            digest.update(chunk)
+            if spill is None and len(head) + len(chunk) <= BODY_CAP:
+                head += chunk
+            else:
+                if spill is None:
+                    os.makedirs(BODY_DIR, exist_ok=True)
+                    fd, tmp = tempfile.mkstemp(dir=BODY_DIR, prefix=".body-")
+                    spill = os.fdopen(fd, "wb")
+                    await loop.run_in_executor(None, spill.write, bytes(head))
+                    del head[BODY_PREVIEW:]
+                if len(head) < BODY_PREVIEW:
+                    head += chunk[:BODY_PREVIEW - len(head)]
+                # the disk write runs in the executor, like the log writer's
+                await loop.run_in_executor(None, spill.write, chunk)
+            if stopped:
+                break
+    except BaseException:
+        # also on CancelledError (the client went away): no partial file is left
+        if spill is not None:
+            spill.close()
+            os.unlink(tmp)
+        raise
+    request["body_bytes"] = size
+    record = {"size": size, "sha256": digest.hexdigest()}
+    if stopped:
+        record["truncated"] = stopped
+        BODIES_TRUNCATED.inc()
+    if spill is None:
+        BODIES_INLINE.inc()
+        return record, bytes(head)
+    spill.close()
+    record["preview"] = bytes(head).decode("utf-8", "replace")
+    record["stored"] = await loop.run_in_executor(None, _store, tmp, record["sha256"])
+    BODIES_SPILLED.inc()
+    return record, None
+
+def body_fields(request, record, body):
+    """Log data for a body: the body under "body", form fields under "form"
+    (so a field cannot overwrite "body", "query" or "user_agent")."""
+    data = {}
+    if request.content_type:
+        # so replay.py can send the body again as it came
+        record = dict(record, content_type=request.content_type)
+    if body is not None:
+        text = body.decode("utf-8", "replace")
+        if request.content_type == "application/x-www-form-urlencoded":
+            form = data["form"] = dict(parse_qsl(text, keep_blank_values=True))
+            if "username" in form:
+                # where the session list, columnar tables and replay.py read it
+                data["username"] = form["username"]
+        record = dict(record, text=text)
+    data["body"] = record
+    return data
+
+# --- Handlers ------------------------------------------------------------------
+@web.middleware
+async def instrument(request, handler):
+    if request.path == METRICS_PATH and PUBLIC_METRICS and metrics.ENABLED:
+        return await handler(request)
+    REQUESTS.inc()
+    # only undo an inc that counted: metrics may be enabled mid-request
+    active = metrics.ENABLED
+    if active:
+        ACTIVE_REQUESTS.inc()
+    t0 = metrics.timer()
+    try:
+        resp = await handler(request)
+    finally:
+        if active:
+            ACTIVE_REQUESTS.dec()
+        if t0:
+            HANDLER_SECONDS.labels(request.method).observe(time.perf_counter() - t0)
+    livefeed.publish("request", None, request.remote, SERVICE_NAME, method=request.method, path=request.path)
+    BYTES_IN.inc(request.get("body_bytes", request.content_length or 0))
+    body = getattr(resp, "body", None)
+    if isinstance(body, (bytes, bytearray)):
+        BYTES_OUT.inc(len(body))
+    return resp
+
+async def catch_all(request):
     ip = request.remote or request.transport.get_extra_info('peername')[0]
-    log_request(ip, SERVICE_NAME, "/status", "GET", {})
-    fake_json = {"device":"SmartCam-1000","uptime":"3 days","status":"ok"}
-    return web.json_response(fake_json)
-
-app = web.Application()
-app.router.add_get("/", index)
-app.router.add_get("/status", status)
-app.router.add_post("/login", login)
+    data = {}
+    if request.query_string:
+        data["query"] = request.query_string
+    if request.headers.get("User-Agent"):
+        data["user_agent"] = request.headers["User-Agent"]
+    if request.body_exists:
+        record, body = await capture_body(request)
+        data.update(body_fields(request, record, body))
+    await log_request_async(ip, SERVICE_NAME, request.path, request.method, data)
+    status, payload, headers = reply_for(request.method, request.path)
+    resp = web.Response(status=status, body=payload, headers=headers)
+    if data.get("body", {}).get("truncated"):
+        resp.force_close()  # the rest of the body was not read
+    return resp
+
+async def metrics_page(request):
+    # the route always exists: metrics may be enabled after this module is
+    # imported; scanners get the catch-all unless HONEYPOT_HTTP_METRICS is set
+    if not (PUBLIC_METRICS and metrics.ENABLED):
+        return await catch_all(request)
+    return web.Response(text=metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+async def start_logging(app):
+    await logger.start_writer()
+    await livefeed.start(livefeed.SOCKET_PATH)  # when HONEYPOT_LIVE_SOCKET is set
+    if metrics.ENABLED:
+        app["loop_lag"] = asyncio.get_running_loop().create_task(metrics.monitor_loop_lag())
+
+async def stop_logging(app):
+    if "loop_lag" in app:
+        app["loop_lag"].cancel()
+    livefeed.stop()
+    # flush queued entries on shutdown
+    await logger.stop_writer()
+
+def make_app():
+    app = web.Application(middlewares=[instrument])
+    app.on_startup.append(start_logging)
+    app.on_cleanup.append(stop_logging)
+    app.router.add_get(METRICS_PATH, metrics_page)
+    # every path and method, so scanners' probes are all captured
+    app.router.add_route("*", "/{tail:.*}", catch_all)
+    return app
+
+app = make_app()
 
 if __name__ == "__main__":
     web.run_app(app, host=HOST, port=PORT)
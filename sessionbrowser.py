@@ -0,0 +1,528 @@
+# sessionbrowser.py - server-side filtered, paginated session list for the dashboard
+#
+# The dashboard used to build a label for every session and send them all
+# to the browser. Instead, each log file gets a compact row table, one row
+# per session:
+#
+#   time (int64 us), ip (int64, -1 unless IPv4), src_ip, service, username,
+#   input (what the client sent, joined), tokens (first word of each line
+#   sent), ref (transcript store hash), iocs ("kind:value" lines),
+#   session_id (bytes), offset (int64)
+#
+# Strings are pandas categoricals, so repeated values (bot inputs, services)
+# are stored once. A table covers one file and time range (the dashboard's
+# "All files" range; entries outside it are never turned into rows, and
+# compacted segments read only the matching row groups). Tables are checked
+# against the file's (inode, size, mtime): a plain file that grew only has
+# its appended lines parsed, anything else is read again; compressed
+# segments are read once and compacted segments are built from their
+# columnar tables. Files read from scratch are read in logmerge's process
+# pool when there is enough to read, and the least recently used tables are
+# dropped past MAX_TABLES. find() builds small tables from sidecar index
+# lookups instead (one address or session). A query filters every table
+# with vectorized masks, sorts only the matching keys, and page() turns one
+# page of rows into dicts; the dashboard's panels count the matching rows
+# per distinct value (counts(), tokens(), iocs()). load() reads a full
+# entry back (a seek to its offset in a plain file).
+import ipaddress
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import columnar
+import ioc
+import ipenrich
+import logindex
+import logmerge
+import logstore
+import rollups
+import transcript
+
+PAGE_SIZE = 50
+INPUT_CHARS = 500  # client input kept per session for the command filter and the list
+# row tables kept between queries (one per file and time range)
+MAX_TABLES = int(os.environ.get("HONEYPOT_BROWSER_TABLES", "64"))
+# bytes just before the parsed offset, re-checked to catch truncate-and-regrow
+FINGERPRINT_BYTES = 64
+SORTS = ("newest", "oldest", "src_ip", "service")
+CATEGORY_COLUMNS = ("src_ip", "service", "username", "input", "tokens", "ref", "iocs")
+
+def ip_int(ip):
+    """An IPv4 address as an int, -1 for anything else."""
+    rng = ipenrich.ipv4_range(ip) if ip and "/" not in ip else None
+    return rng[0] if rng else -1
+
+def first_tokens(texts):
+    """The first word of each non-blank text, space-joined (the "Top received tokens" panel)."""
+    return " ".join(t.split()[0] for t in (str(x).strip() for x in texts) if t)
+
+def scan_iocs(texts):
+    """The "iocs" column value of a session, extracted from what it received."""
+    found = {}
+    for text in texts:
+        ioc.EXTRACTOR.scan(str(text), found)
+    return "\n".join(f"{kind}:{value}" for kind, values in (ioc.to_record(found) or {}).items() for value in values)
+
+def client_input(entry, memo):
+    """(what the client sent joined, its first_tokens); transcripts shared
+    through the store are joined once."""
+    ref = transcript.ref(entry)
+    if ref and ref in memo:
+        return memo[ref]
+    texts = list(rollups.received_texts(entry))
+    text = " ; ".join(t for t in (str(x).strip() for x in texts) if t and t != "<password>")[:INPUT_CHARS]
+    out = (text, first_tokens(texts))
+    if ref:
+        memo[ref] = out
+    return out
+
+def _entries(lines):
+    """(offset, entry) for the (offset, raw line) pairs that parse to an object."""
+    for offset, line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(entry, dict):
+            yield offset, entry
+
+def to_frame(cols):
+    df = pd.DataFrame({
+        "time": columnar._to_us(cols["time"]),
+        "ip": np.asarray(cols["ip"], dtype=np.int64),
+        "offset": np.asarray(cols["offset"], dtype=np.int64),
+        "session_id": np.asarray(cols["session_id"], dtype=bytes),
+    })
+    for c in CATEGORY_COLUMNS:
+        df[c] = pd.Categorical(cols[c])
+    return df
+
+class FileRows:
+    """The row table of one log file (within [since, until]), in chunks
+    appended as the file grows."""
+
+    def __init__(self, path, events_table=None, since=None, until=None):
+        self.path = str(path)
+        self.events_table = events_table  # compacted segment: rows come from its tables
+        self.since, self.until = since, until
+        # compared with logmerge.sort_key() of each entry, as logmerge.scan does
+        self._lo = since.isoformat(timespec="microseconds") if since else None
+        self._hi = until.isoformat(timespec="microseconds") if until else None
+        self.ident = None
+        self.size = 0
+        self.mtime = 0
+        self.offset = 0
+        self.fingerprint = b""
+        self.chunks = []
+        self._memo = {}
+
+    def __len__(self):
+        return sum(len(c) for c in self.chunks)
+
+    def _append(self, cols):
+        if cols["time"]:
+            self.chunks.append(to_frame(cols))
+        if len(self.chunks) > 8:
+            # keep the number of chunks (and per-query overhead) small
+            frames = [c.copy() for c in self.chunks]
+            for c in CATEGORY_COLUMNS:
+                union = pd.api.types.union_categoricals([f[c] for f in frames])
+                for f in frames:
+                    f[c] = pd.Categorical(f[c], categories=union.categories)
+            self.chunks = [pd.concat(frames, ignore_index=True)]
+
+    def _rows(self, pairs):
+        """Column lists from the (offset, entry) pairs within the time range."""
+        cols = {c: [] for c in ("time", "ip", "offset", "session_id") + CATEGORY_COLUMNS}
+        for offset, entry in pairs:
+            if self._lo or self._hi:
+                key = logmerge.sort_key(entry.get("time"))
+                if (self._lo and key < self._lo) or (self._hi and key > self._hi):
+                    continue
+            data = entry.get("data") if isinstance(entry.get("data"), dict) else {}
+            ip = str(entry.get("src_ip") or "")
+            cols["time"].append(entry.get("time"))
+            cols["ip"].append(ip_int(ip))
+            cols["offset"].append(offset)
+            cols["session_id"].append(str(entry.get("session_id") or "").encode())
+            cols["src_ip"].append(ip)
+            cols["service"].append(str(entry.get("service") or ""))
+            cols["username"].append(str(data.get("username") or ""))
+            text, tokens = client_input(entry, self._memo)
+            cols["input"].append(text)
+            cols["tokens"].append(tokens)
+            cols["ref"].append(transcript.ref(entry) or "")
+            cols["iocs"].append("\n".join(f"{kind}:{value}" for kind, value in ioc.items(entry)))
+        return cols
+
+    def read_tail(self):
+        """Rows for the complete lines appended after self.offset."""
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # a partially written last line is read next time
+        lines, pos = [], self.offset
+        for line in data[:end].splitlines(keepends=True):
+            if line.strip():
+                lines.append((pos, line))
+            pos += len(line)
+        self._append(self._rows(_entries(lines)))
+        self.offset += end
+        self.fingerprint = self._read_fingerprint()
+
+    def _read_fingerprint(self):
+        start = max(0, self.offset - FINGERPRINT_BYTES)
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            return f.read(self.offset - start)
+
+    def same_prefix(self):
+        return self._read_fingerprint() == self.fingerprint
+
+    def read_compressed(self):
+        # rotated segments never change: read once, loaded back by session id
+        with logstore.open_log(self.path) as f:
+            self._append(self._rows(_entries((-1, line) for line in f if line.strip())))
+        self.offset = os.path.getsize(self.path)
+
+    def read_entries(self, entries):
+        self._append(self._rows((-1, entry) for entry in entries))
+
+    def read_tables(self, sessions_table):
+        # only the row groups in the time range, and the events of those sessions
+        frame = columnar.session_frame(sessions_table, self.since, self.until,
+                                       columns=("time", "src_ip", "service", "username", "session_id", "ref"))
+        self.offset = os.path.getsize(self.path)
+        if not len(frame):
+            return
+        filters = [("dir", "in", ["in", "recv"])]
+        if self.since is not None or self.until is not None:
+            filters.append(("session_id", "in", frame["session_id"].astype(str).unique().tolist()))
+        ev = columnar.read_table(self.events_table, columns=["session_id", "text"], filters=filters)
+        ev = ev[ev["text"].astype(str).str.strip().ne("")]
+        by_session = ev.groupby(ev["session_id"].astype(str), sort=False)["text"]
+        joined = by_session.agg(lambda t: " ; ".join(x for x in map(str, t) if x != "<password>")[:INPUT_CHARS])
+        tokens = by_session.agg(first_tokens)
+        if ioc.EXTRACTOR is not None:
+            # the tables keep no "iocs": they are extracted again from what was received
+            found = by_session.agg(scan_iocs)
+        else:
+            found = pd.Series(dtype=object)
+        sids = frame["session_id"].astype(str)
+        ips = frame["src_ip"].astype(str).tolist()
+        self._append({
+            "time": pd.Series(frame["time"]).dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ").tolist(),
+            "ip": [ip_int(ip) for ip in ips], "offset": [-1] * len(frame),
+            "session_id": [s.encode() for s in sids], "src_ip": ips,
+            "service": frame["service"].astype(str).tolist(), "username": frame["username"].astype(str).tolist(),
+            "input": sids.map(joined).fillna("").tolist(), "tokens": sids.map(tokens).fillna("").tolist(),
+            # tables compacted before "ref" was kept have none (columnar.py compact --force)
+            "ref": frame["ref"].astype(str).tolist() if "ref" in frame else [""] * len(frame),
+            "iocs": sids.map(found).fillna("").tolist(),
+        })
+
+def load_rows(path, tables=None, since=None, until=None):
+    """The row table of a file read from scratch (run in logmerge's pool for cold loads)."""
+    log = FileRows(path, tables[1] if tables else None, since, until)
+    if tables:
+        log.read_tables(tables[0])
+    elif str(path).endswith((".gz", ".zst")):
+        log.read_compressed()
+    else:
+        log.read_tail()
+    log._memo = {}  # only saves work on this file's later tail reads
+    return log
+
+def _cat_mask(series, test):
+    """Rows of a categorical whose value passes `test`, called once per distinct value."""
+    hits = np.fromiter((bool(test(str(v))) for v in series.cat.categories), dtype=bool,
+                       count=len(series.cat.categories))
+    codes = series.cat.codes.to_numpy()
+    return np.append(hits, False)[codes]  # code -1 (missing) picks the False
+
+def _contains(needle):
+    needle = needle.lower()
+    return lambda v: needle in v.lower()
+
+def _in_network(net):
+    def test(v):
+        try:
+            return ipaddress.ip_address(v) in net
+        except ValueError:
+            return False
+    return test
+
+def _us(dt):
+    return int(np.datetime64(dt.replace(tzinfo=None), "us").astype(np.int64))
+
+class Query:
+    """Matching rows of a query, in sort order; page(n) materializes one page."""
+
+    def __init__(self, parts=(), which=None, local=None, page_size=PAGE_SIZE, rows=()):
+        self.parts = list(parts)  # [(FileRows, chunk index)]
+        self.rows = list(rows)    # matching rows of each part, unsorted (for the aggregates)
+        # row k in sort order is row local[k] of chunk parts[which[k]]
+        self.which = which if which is not None else np.empty(0, dtype=np.int64)
+        self.local = local if local is not None else np.empty(0, dtype=np.int64)
+        self.total = len(self.which)
+        self.page_size = page_size
+
+    @property
+    def pages(self):
+        return max(1, -(-self.total // self.page_size))
+
+    def page(self, n):
+        """Row dicts of page `n` (0-based)."""
+        sl = slice(n * self.page_size, (n + 1) * self.page_size)
+        which, local = self.which[sl], self.local[sl]
+        out = [None] * len(which)
+        for part in np.unique(which):
+            at = np.flatnonzero(which == part)
+            log, ci = self.parts[part]
+            chunk = log.chunks[ci].iloc[local[at]]
+            for k, t, sid, ip, svc, user, text, off in zip(
+                    at, chunk["time"].to_numpy().astype("datetime64[us]"), chunk["session_id"], chunk["src_ip"],
+                    chunk["service"], chunk["username"], chunk["input"], chunk["offset"]):
+                out[k] = {"time": np.datetime_as_string(t) + "Z", "session_id": sid.decode("utf-8", "replace"),
+                          "src_ip": ip, "service": svc, "username": user, "input": text,
+                          "_path": log.path, "_offset": int(off), "_events": log.events_table}
+        return out
+
+    def _matching(self):
+        for (log, ci), rows in zip(self.parts, self.rows):
+            yield log.chunks[ci], rows
+
+    def counts(self, column):
+        """Counter of the values of a categorical column over the matching rows."""
+        out = Counter()
+        for chunk, rows in self._matching():
+            col = chunk[column]
+            # code -1 (missing) lands in bin 0 and is dropped
+            n = np.bincount(col.cat.codes.to_numpy()[rows] + 1, minlength=len(col.cat.categories) + 1)[1:]
+            for i in np.flatnonzero(n):
+                out[str(col.cat.categories[i])] += int(n[i])
+        out.pop("", None)
+        return out
+
+    def tokens(self):
+        """First tokens of everything the matching sessions received."""
+        out = Counter()
+        for value, n in self.counts("tokens").items():
+            for token in value.split():
+                out[token] += n
+        return out
+
+    def minutes(self):
+        """Matching sessions per minute ({UTC Timestamp: n})."""
+        out = Counter()
+        for chunk, rows in self._matching():
+            t = chunk["time"].to_numpy()[rows]
+            m, n = np.unique(t[t != columnar.NAT] // 60_000_000, return_counts=True)
+            for minute, k in zip(m, n):
+                out[pd.Timestamp(int(minute) * 60, unit="s", tz="UTC")] += int(k)
+        return out
+
+    def iocs(self):
+        """rollups.IocTable of the matching sessions' IOCs (first/last seen, hits)."""
+        table = rollups.IocTable()
+        for chunk, rows in self._matching():
+            col = chunk["iocs"]
+            codes = col.cat.codes.to_numpy()[rows]
+            times = chunk["time"].to_numpy()[rows]
+            keep = (codes >= 0) & (times != columnar.NAT)
+            codes, times = codes[keep], times[keep]
+            order = np.argsort(codes, kind="stable")
+            codes, times = codes[order], times[order]
+            # one group per distinct value: its hits and time range
+            starts = np.flatnonzero(np.diff(codes, prepend=-1))
+            ends = np.append(starts[1:], len(codes))
+            for lo, hi in zip(starts, ends):
+                value = str(col.cat.categories[codes[lo]])
+                if not value:
+                    continue
+                span = times[lo:hi]
+                first, last = (np.datetime_as_string(np.datetime64(int(t), "us")) + "Z" for t in (span.min(), span.max()))
+                for key in value.split("\n"):
+                    table.add(key, first, int(hi - lo))
+                    table.add(key, last, 0)
+        return table
+
+class SessionBrowser:
+    """Row tables of the log files, shared by dashboard reruns.
+
+    Keyed by file and time range and checked against (inode, size, mtime):
+    an unchanged file is a hit, a plain file that grew with the same prefix
+    has only its tail parsed, anything else is read again. At most
+    `max_tables` tables are kept, least recently used dropped first.
+    """
+
+    def __init__(self, log_dir, max_tables=MAX_TABLES, workers=logmerge.WORKERS):
+        self.log_dir = str(log_dir)
+        self.max_tables = max_tables
+        self.workers = workers
+        self.logs = OrderedDict()  # (path, since, until) -> FileRows
+        self.hits = 0
+        self.tails = 0
+        self.loads = 0
+        self.last_ms = 0.0
+        self._lock = threading.Lock()
+
+    def _cached(self, key, st):
+        """The cached table for `key`, brought up to date; None if it must be read from scratch."""
+        log = self.logs.get(key)
+        if log is None or log.ident != (st.st_dev, st.st_ino):
+            return None
+        self.logs.move_to_end(key)
+        if log.size == st.st_size and log.mtime == st.st_mtime_ns:
+            self.hits += 1
+        elif (not log.path.endswith((".gz", ".zst")) and log.events_table is None
+              and st.st_size >= log.offset and log.same_prefix()):
+            log.read_tail()
+            self.tails += 1
+        else:
+            return None
+        log.size, log.mtime = st.st_size, st.st_mtime_ns
+        return log
+
+    def _load(self, jobs):
+        """load_rows() for each (path, tables, since, until), in logmerge's
+        process pool when there are several files and enough bytes to read."""
+        total = sum(os.path.getsize(job[0]) for job in jobs)
+        if self.workers > 1 and len(jobs) > 1 and total >= logmerge.PARALLEL_MIN_BYTES:
+            return list(logmerge.get_pool(self.workers).map(load_rows, *zip(*jobs)))
+        return [load_rows(*job) for job in jobs]
+
+    def tables(self, paths, since=None, until=None):
+        """Row tables of the existing `paths`, holding their entries in [since, until]."""
+        with self._lock:
+            t0 = time.perf_counter()
+            col_index = columnar.load_index(self.log_dir)
+            found, cold = {}, []
+            for path in map(str, paths):
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                key = (path, since, until)
+                log = self._cached(key, st)
+                if log is not None:
+                    found[path] = log
+                else:
+                    # stat before reading: whatever is appended meanwhile is a tail next time
+                    cold.append((key, st, (path, columnar.tables_for(self.log_dir, path, col_index), since, until)))
+            if cold:
+                self.loads += len(cold)
+                for (key, st, _), log in zip(cold, self._load([job for *_, job in cold])):
+                    log.ident, log.size, log.mtime = (st.st_dev, st.st_ino), st.st_size, st.st_mtime_ns
+                    self.logs[key] = found[key[0]] = log
+                    self.logs.move_to_end(key)
+            while len(self.logs) > self.max_tables:
+                self.logs.popitem(last=False)
+            self.last_ms = (time.perf_counter() - t0) * 1000.0
+            return [found[p] for p in map(str, paths) if p in found]
+
+    def find(self, paths, ip=None, session_id=None, since=None, until=None):
+        """Row tables of only the entries from `ip` and/or of `session_id`,
+        looked up through the sidecar indexes (not cached: they are small)."""
+        out = []
+        for path in map(str, paths):
+            if not os.path.exists(path):
+                continue
+            log = FileRows(path, since=since, until=until)
+            log.read_entries(logindex.find_entries([path], since, until, ip, session_id))
+            if len(log):
+                out.append(log)
+        return out
+
+    def services(self, tables):
+        """Services seen in row `tables`, most common first (for the filter's choices)."""
+        counts = Counter()
+        for log in tables:
+            for chunk in log.chunks:
+                counts.update(chunk["service"].value_counts().to_dict())
+        return [s for s, n in counts.most_common() if n]
+
+    def query(self, tables, ip=None, service=None, username=None, since=None, until=None,
+              command=None, session_id=None, sort="newest", page_size=PAGE_SIZE):
+        """The rows of row `tables` that pass every given filter, sorted by `sort`.
+
+        ip is an address or CIDR; service a list of services; username and
+        command are case-insensitive substrings; since/until naive UTC datetimes.
+        """
+        if sort not in SORTS:
+            raise ValueError(f"unknown sort: {sort!r}")
+        net = None
+        if ip:
+            try:
+                net = ipaddress.ip_network(ip.strip(), strict=False)
+            except ValueError:
+                pass
+        lo, hi = (_us(since) if since else None), (_us(until) if until else None)
+        parts = []  # (FileRows, chunk index, matching rows)
+        for log in tables:
+            for ci, chunk in enumerate(log.chunks):
+                mask = np.ones(len(chunk), dtype=bool)
+                if lo is not None:
+                    mask &= chunk["time"].to_numpy() >= lo
+                if hi is not None:
+                    mask &= chunk["time"].to_numpy() <= hi
+                if net is not None and net.version == 4:
+                    ips = chunk["ip"].to_numpy()
+                    mask &= (ips >= int(net.network_address)) & (ips <= int(net.broadcast_address))
+                elif net is not None:
+                    mask &= _cat_mask(chunk["src_ip"], _in_network(net))
+                elif ip:
+                    mask &= (chunk["src_ip"] == ip.strip()).to_numpy()
+                if service:
+                    mask &= chunk["service"].isin(service).to_numpy()
+                if username:
+                    mask &= _cat_mask(chunk["username"], _contains(username))
+                if command:
+                    mask &= _cat_mask(chunk["input"], _contains(command))
+                if session_id:
+                    mask &= chunk["session_id"].to_numpy() == session_id.strip().encode()
+                rows = np.flatnonzero(mask)
+                if len(rows):
+                    parts.append((log, ci, rows))
+        if not parts:
+            return Query(page_size=page_size)
+        times = np.concatenate([log.chunks[ci]["time"].to_numpy()[rows] for log, ci, rows in parts])
+        if sort in ("src_ip", "service"):
+            # one rank per distinct value across chunks, then time within it
+            values = [log.chunks[ci][sort] for log, ci, _ in parts]
+            names = sorted(set().union(*(v.cat.categories for v in values)),
+                           key=(lambda s: (ip_int(s) < 0, ip_int(s), s)) if sort == "src_ip" else str)
+            rank = {name: i for i, name in enumerate(names)}
+            keys = np.concatenate([np.array([rank[c] for c in v.cat.categories], dtype=np.int64)[v.cat.codes.to_numpy()[rows]]
+                                   for v, (_, _, rows) in zip(values, parts)])
+            order = np.lexsort((-times, keys))
+        else:
+            order = np.argsort(-times if sort == "newest" else times, kind="stable")
+        which = np.concatenate([np.full(len(rows), i) for i, (_, _, rows) in enumerate(parts)])[order]
+        local = np.concatenate([rows for _, _, rows in parts])[order]
+        return Query([(log, ci) for log, ci, _ in parts], which, local, page_size, [rows for _, _, rows in parts])
+
+    def load(self, row):
+        """The full log entry of a page row."""
+        if row.get("_offset", -1) >= 0:
+            with open(row["_path"], "rb") as f:
+                f.seek(row["_offset"])
+                try:
+                    return json.loads(f.readline())
+                except ValueError:
+                    pass
+        stub = {"time": row["time"], "session_id": row["session_id"], "src_ip": row["src_ip"],
+                "service": row["service"], "data": {"username": row["username"]}}
+        if row.get("_events"):
+            return columnar.load_session(dict(stub, _events=row["_events"]))
+        key, found = logmerge.sort_key(row["time"]), None
+        for entry in logindex.find_entries([row["_path"]], session_id=row["session_id"]):
+            found = found or entry
+            if logmerge.sort_key(entry.get("time")) == key:
+                return entry
+        return found or stub
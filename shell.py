@@ -0,0 +1,124 @@
+# shell.py - table-driven command engine for the fake device shell
+import json
+import os
+import functools
+import re
+
+BASE_DIR = os.path.dirname(__file__)
+PERSONA_DIR = os.path.join(BASE_DIR, "personas")
+DEFAULT_PERSONA = os.path.join(PERSONA_DIR, "routeros.json")
+# up to this many "contains" literals are checked with `in` (faster than re on
+# CPython for a handful of words); beyond it they join the compiled pattern
+MAX_LITERAL_SCAN = 8
+# dispatch is a pure function of the command string, and bots repeat the same
+# commands endlessly, so results are memoized (least recently used evicted)
+MEMO_SIZE = 4096
+
+class CommandTable:
+    """Dispatches shell commands in three passes, in this order:
+
+    1. exact match (dict, case-sensitive, then case-insensitive)
+    2. longest prefix match (case-insensitive; one C-level startswith()
+       over all prefixes rules out most commands)
+    3. keyword rules: a few plain substrings with `in`, everything else in
+       one compiled alternation (first match wins)
+
+    dispatch() returns a (payload, text, close) tuple: the bytes to send,
+    the text for the transcript and whether to hang up. Static replies are
+    encoded once, with the prompt already appended.
+    """
+
+    def __init__(self, persona, memo_size=MEMO_SIZE):
+        self.persona = persona
+        self.name = persona.get("name", "custom")
+        self.prompt = persona.get("prompt", "> ").encode()
+        # login dialogue: bytes to send and the text recorded in the transcript
+        self.banner_text = persona["banner"]
+        self.banner = self.banner_text.encode()
+        self.password_text = persona.get("password_prompt", "Password: ")
+        self.password_prompt = self.password_text.encode()
+        login_failed = persona.get("login_failed", "Login incorrect\r\nlogin: ")
+        self.login_failed = login_failed.encode()
+        self.login_failed_text = login_failed.split("\r\n")[0]
+        welcome = persona.get("welcome", "\r\n")
+        self.welcome = welcome.encode() + self.prompt
+        self.welcome_text = welcome.strip()
+
+        exit_cfg = persona.get("exit", {})
+        exit_resp = exit_cfg.get("response", "Logout\r\n")
+        # exits are matched case-insensitively and logged without the trailing newline
+        self.exact_nocase = {c.lower(): (exit_resp.encode(), exit_resp.strip(), True)
+                             for c in exit_cfg.get("commands", ())}
+        for cmd, resp in persona.get("exact_nocase", {}).items():
+            self.exact_nocase.setdefault(cmd.lower(), self._static(resp))
+        self.exact = {cmd: self._static(resp) for cmd, resp in persona.get("exact", {}).items()}
+
+        # longest first, so the first that matches is the longest
+        self.prefixes = tuple((prefix.lower(), self._static(resp)) for prefix, resp in
+                              sorted(persona.get("prefix_nocase", {}).items(), key=lambda kv: -len(kv[0])))
+        self.prefix_keys = tuple(prefix for prefix, _ in self.prefixes)
+
+        rules = persona.get("keywords", ())
+        literals = [(lit, i) for i, rule in enumerate(rules) for lit in rule.get("contains", ())]
+        fold = len(literals) > MAX_LITERAL_SCAN
+        self.literals = () if fold else tuple((lit, self._static(rules[i]["response"])) for lit, i in literals)
+        parts, self.keyword_replies = [], {}
+        for i, rule in enumerate(rules):
+            alts = []
+            if rule.get("pattern"):
+                alts.append(rule["pattern"])
+            if fold:
+                alts.extend(re.escape(lit) for lit in rule.get("contains", ()))
+            if not alts:
+                continue
+            pattern = "|".join(alts)
+            if rule.get("nocase"):
+                pattern = f"(?i:{pattern})"
+            group = f"k{i}"
+            parts.append(f"(?P<{group}>{pattern})")
+            self.keyword_replies[group] = self._static(rule["response"])
+        self.keywords = re.compile("|".join(parts)) if parts else None
+
+        self.empty = self._static(persona.get("empty", ""))
+        # "sh: {cmd}: command not found" is split around the command once
+        head, _, tail = persona.get("not_found", "sh: {cmd}: command not found\r\n").partition("{cmd}")
+        self._nf_head, self._nf_tail = head, tail
+        self.memo_size = memo_size
+        # C-level LRU: a hit costs about one dict lookup, and varied input
+        # only evicts the oldest entries instead of emptying the memo
+        self._memo = functools.lru_cache(maxsize=memo_size)(self._lookup) if memo_size else self._lookup
+
+    def _static(self, resp):
+        return (resp.encode() + self.prompt, resp, False)
+
+    def dispatch(self, cmd):
+        reply = self.exact.get(cmd)
+        if reply is not None:
+            return reply
+        return self._memo(cmd)
+
+    def _lookup(self, cmd):
+        lower = cmd.lower()
+        reply = self.exact_nocase.get(lower)
+        if reply is not None:
+            return reply
+        if lower.startswith(self.prefix_keys):
+            for prefix, reply in self.prefixes:
+                if lower.startswith(prefix):
+                    return reply
+        for lit, reply in self.literals:
+            if lit in cmd:
+                return reply
+        if self.keywords is not None:
+            m = self.keywords.search(cmd)
+            if m is not None:
+                return self.keyword_replies[m.lastgroup]
+        if not cmd.strip():
+            return self.empty
+        text = self._nf_head + cmd + self._nf_tail
+        return (text.encode() + self.prompt, text, False)
+
+def load_persona(path=DEFAULT_PERSONA, memo_size=MEMO_SIZE):
+    """Build a CommandTable from a persona JSON file (see personas/routeros.json)."""
+    with open(path, "r", encoding="utf-8") as f:
+        return CommandTable(json.load(f), memo_size=memo_size)
@@ -3,6 +3,9 @@ import os
 import datetime
 import random
 import time
+import uuid
+
+import transcript
 
 BASE_DIR = os.path.dirname(__file__)
 LOG_DIR = os.path.join(BASE_DIR, "logs")
@@ -20,30 +23,24 @@ def generate_virtual_entry():
     password = random.choice(passwords)
     src_ip = f"192.168.{random.randint(0, 255)}.{random.randint(1, 254)}"
 
-    # Simulate a fake transcript for Telnet/SSH sessions
-    transcript = []
-    now = datetime.datetime.utcnow()
+    # Simulate a fake transcript for Telnet/SSH sessions: [ms offset, dir, text]
+    start = datetime.datetime.utcnow()
+    events = []
+    offset = 0
     for cmd in random.sample(commands, random.randint(2, 4)):
-        now += datetime.timedelta(seconds=random.randint(1, 3))
-        transcript.append({
-            "ts": now.isoformat() + "Z",
-            "dir": "in",
-            "text": cmd
-        })
-        transcript.append({
-            "ts": (now + datetime.timedelta(milliseconds=200)).isoformat() + "Z",
-            "dir": "out",
-            "text": f"sh: {cmd}: command not found\\r\\n"
-        })
+        offset += random.randint(1, 3) * 1000
+        events.append([offset, "i", cmd])
+        events.append([offset + 200, "o", f"sh: {cmd}: command not found\\r\\n"])
 
     data = {
-        "session_start": datetime.datetime.utcnow().isoformat() + "Z",
+        "session_start": start.isoformat() + "Z",
         "username": username,
-        "transcript": transcript
+        "transcript": {"v": transcript.VERSION, "t0": start.isoformat() + "Z", "ev": events}
     }
 
     entry = {
         "time": datetime.datetime.utcnow().isoformat() + "Z",
+        "session_id": uuid.uuid4().hex,
         "src_ip": src_ip,
         "service": service,
         "path": f"/{service}",
@@ -57,10 +54,203 @@ def append_entry(entry):
     with open(LOG_FILE, "a", encoding="utf-8") as f:
         f.write(json.dumps(entry) + "\n")
 
-if __name__ == "__main__":
+# --- Bulk mode ---------------------------------------------------------
+# `simulate.py --sessions 5_000_000 --seed 7` writes a reproducible dataset:
+# every batch draws from its own generator seeded with (seed, batch), so the
+# output is identical whatever --processes is.
+
+MAX_COMMANDS = 8
+STOP_WEIGHT = 1.5  # relative weight of "session ends" in each Markov row
+
+def command_chain(seed):
+    """Start distribution and transition matrix over `commands` + an END state.
+
+    Each row favours the next command in list order (a typical scripted
+    flow) with seeded Dirichlet noise, so chains look scripted but vary.
+    """
+    import numpy as np
+    rng = np.random.default_rng([seed, 0xC0FFEE])
+    c = len(commands)
+    alpha = np.ones((c, c + 1))
+    alpha[np.arange(c), (np.arange(c) + 1) % c] += 6.0
+    alpha[:, c] = STOP_WEIGHT
+    trans = rng.dirichlet(np.ones(c + 1), size=c) * 0.3 + np.array([rng.dirichlet(a) for a in alpha]) * 0.7
+    trans = np.vstack([trans, np.eye(1, c + 1, c)])  # END is absorbing
+    start = rng.dirichlet(np.linspace(4.0, 1.0, c))
+    return np.cumsum(start), np.cumsum(trans, axis=1)
+
+def command_replies():
+    # realistic output text from the telnet persona's command table
+    try:
+        import shell
+        table = shell.load_persona()
+        return [table.dispatch(cmd)[1] for cmd in commands]
+    except Exception:
+        return [f"sh: {cmd}: command not found\r\n" for cmd in commands]
+
+def rank_to_ip(rank):
+    # spread Zipf ranks over the address space deterministically
+    x = (int(rank) * 2654435761 + 0x5BD1E995) & 0xFFFFFFFF
+    return f"{x >> 24}.{(x >> 16) & 255}.{(x >> 8) & 255}.{x & 255}"
+
+def generate_batch(cfg, k):
+    """Serialized JSONL bytes for batch k of a bulk run."""
+    import numpy as np
+    n = min(cfg["batch_size"], cfg["sessions"] - k * cfg["batch_size"])
+    rng = np.random.default_rng([cfg["seed"], k])
+    start_cum, trans_cum = command_chain(cfg["seed"])
+    replies = cfg["replies"]
+
+    # bursty arrivals: part uniform background, part clustered around a few burst starts
+    slice_us = cfg["slice_us"]
+    centers = rng.uniform(0, slice_us, cfg["bursts"])
+    in_burst = rng.random(n) < cfg["burst_frac"]
+    offsets = np.where(
+        in_burst,
+        centers[rng.integers(0, cfg["bursts"], n)] + rng.exponential(cfg["burst_width_us"], n),
+        rng.uniform(0, slice_us, n),
+    )
+    starts = cfg["start_us"] + k * slice_us + np.sort(np.clip(offsets, 0, slice_us - 1)).astype(np.int64)
+
+    ranks = rng.zipf(cfg["zipf"], n) % cfg["ip_space"]
+    service_idx = rng.integers(0, len(services), n)
+    user_idx = rng.integers(0, len(usernames), n)
+    session_ids = rng.integers(0, 1 << 63, (n, 2), dtype=np.int64)  # 32 hex chars, like uuid4().hex
+
+    # Markov chain over commands, all sessions stepped together
+    c = len(commands)
+    states = np.empty((n, MAX_COMMANDS), dtype=np.int64)
+    states[:, 0] = np.minimum((rng.random(n)[:, None] > start_cum).sum(1), c - 1)
+    for t in range(1, MAX_COMMANDS):
+        states[:, t] = (rng.random(n)[:, None] > trans_cum[states[:, t - 1]]).sum(1)
+    lengths = np.argmax(np.hstack([states, np.full((n, 1), c)]) == c, axis=1)
+
+    # event times: think time before each command, reply 200 ms later
+    think = np.cumsum(rng.exponential(2_000_000, (n, MAX_COMMANDS)).astype(np.int64) + 300_000, axis=1)
+    in_us = starts[:, None] + think
+    offsets = ((in_us - starts[:, None]) // 1000).tolist()
+    end_us = in_us[np.arange(n), np.maximum(lengths - 1, 0)] + 200_000
+    ts_start = np.char.add(np.datetime_as_string(starts.astype("datetime64[us]"), unit="us"), "Z")
+    ts_end = np.char.add(np.datetime_as_string(end_us.astype("datetime64[us]"), unit="us"), "Z")
+
+    ip_cache = cfg.setdefault("ip_cache", {})
+    out = []
+    for i in range(n):
+        rank = int(ranks[i])
+        ip = ip_cache.get(rank)
+        if ip is None:
+            ip = ip_cache[rank] = rank_to_ip(rank)
+        events = []
+        row, off = states[i], offsets[i]
+        for j in range(int(lengths[i])):
+            cmd = int(row[j])
+            events.append([off[j], "i", commands[cmd]])
+            events.append([off[j] + 200, "o", replies[cmd]])
+        service = services[int(service_idx[i])]
+        out.append(_dumps({
+            "time": str(ts_end[i]),
+            "session_id": f"{int(session_ids[i, 0]):016x}{int(session_ids[i, 1]):016x}",
+            "src_ip": ip,
+            "service": service,
+            "path": f"/{service}",
+            "method": "SESSION",
+            "data": {
+                "session_start": str(ts_start[i]),
+                "username": usernames[int(user_idx[i])],
+                "transcript": {"v": transcript.VERSION, "t0": str(ts_start[i]), "ev": events},
+            },
+        }))
+    return b"\n".join(out) + b"\n"
+
+try:
+    import orjson
+    _dumps = orjson.dumps
+except ImportError:  # optional: ~3x faster serialization when installed
+    def _dumps(obj):
+        return json.dumps(obj).encode()
+
+_worker_cfg = None
+
+def _init_worker(cfg):
+    global _worker_cfg
+    _worker_cfg = cfg
+
+def _batch_in_worker(k):
+    return k, generate_batch(_worker_cfg, k)
+
+def bulk_generate(args):
+    n_batches = (args.sessions + args.batch_size - 1) // args.batch_size
+    start = datetime.datetime.fromisoformat(args.start.replace("Z", ""))
+    span_us = int(args.span_days * 86400 * 1_000_000)
+    cfg = {
+        "sessions": args.sessions, "batch_size": args.batch_size, "seed": args.seed,
+        "start_us": int((start - datetime.datetime(1970, 1, 1)).total_seconds() * 1_000_000),
+        "slice_us": max(1, span_us // n_batches),
+        "zipf": args.zipf, "ip_space": args.ip_space,
+        "burst_frac": args.burst_frac, "bursts": args.bursts, "burst_width_us": int(args.burst_width * 1_000_000),
+        "replies": command_replies(),
+    }
+    os.makedirs(args.out, exist_ok=True)
+    files = max(1, min(args.files, n_batches))
+    if files == 1:
+        paths = [os.path.join(args.out, f"{args.name}.jsonl")]
+    else:
+        paths = [os.path.join(args.out, f"{args.name}-{j:02d}.jsonl") for j in range(files)]
+    # contiguous runs of batches per file keep every file time-ordered
+    per_file = (n_batches + files - 1) // files
+    handles = [open(p, "wb", buffering=16 * 1024 * 1024) for p in paths]
+    t0 = time.time()
+    try:
+        if args.processes > 1:
+            import multiprocessing
+            with multiprocessing.Pool(args.processes, initializer=_init_worker, initargs=(cfg,)) as pool:
+                for k, data in pool.imap(_batch_in_worker, range(n_batches)):
+                    handles[k // per_file].write(data)
+                    progress(k, n_batches, t0)
+        else:
+            for k in range(n_batches):
+                handles[k // per_file].write(generate_batch(cfg, k))
+                progress(k, n_batches, t0)
+    finally:
+        for h in handles:
+            h.close()
+    elapsed = time.time() - t0
+    print(f"\nWrote {args.sessions:,} sessions to {len(paths)} file(s) in {elapsed:.1f}s "
+          f"({args.sessions / max(elapsed, 1e-9):,.0f} sessions/s)")
+    for p in paths:
+        print(f"  {p}")
+
+def progress(k, total, t0):
+    if k % 10 == 9 or k == total - 1:
+        print(f"\r  batch {k + 1}/{total}  {time.time() - t0:6.1f}s", end="", flush=True)
+
+def live_simulation():
     print("Simulating virtual honeypot sessions... (Press Ctrl+C to stop)")
     while True:
         entry = generate_virtual_entry()
         append_entry(entry)
         print(f"[+] Added log for {entry['src_ip']} on {entry['service']}")
         time.sleep(random.randint(2, 5))
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Simulate honeypot sessions (live trickle, or a bulk dataset with --sessions).")
+    ap.add_argument("--sessions", type=int, default=0, help="Bulk mode: number of sessions to generate (e.g. 5_000_000)")
+    ap.add_argument("--seed", type=int, default=0, help="Same seed + options = byte-identical output")
+    ap.add_argument("--start", default="2025-01-01T00:00:00", help="First arrival time (UTC, ISO)")
+    ap.add_argument("--span-days", type=float, default=7.0, help="Time span the arrivals cover")
+    ap.add_argument("--zipf", type=float, default=1.3, help="Zipf exponent for source IP popularity (>1)")
+    ap.add_argument("--ip-space", type=int, default=200_000, help="Max distinct source IPs")
+    ap.add_argument("--burst-frac", type=float, default=0.6, help="Share of sessions that arrive in bursts")
+    ap.add_argument("--bursts", type=int, default=3, help="Bursts per batch")
+    ap.add_argument("--burst-width", type=float, default=120.0, help="Mean burst duration, seconds")
+    ap.add_argument("--batch-size", type=int, default=20_000)
+    ap.add_argument("--files", type=int, default=1, help="Split the output across N files")
+    ap.add_argument("--processes", type=int, default=1, help="Generate batches in N processes")
+    ap.add_argument("--out", default=LOG_DIR, help="Output directory (default logs/)")
+    ap.add_argument("--name", default="bulk_sessions", help="Output file name stem")
+    args = ap.parse_args()
+    if args.sessions:
+        bulk_generate(args)
+    else:
+        live_simulation()
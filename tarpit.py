@@ -0,0 +1,253 @@
+# tarpit.py - hold bot connections open for as long as possible, cheaply
+#
+# A telnet session that matches the tarpit criteria (a download command such
+# as wget/curl, or a source IP that keeps coming back) is handed to the shared
+# TarpitEngine. The session coroutine then ends: the socket's protocol is
+# swapped for a small Held object, and a single task drips one byte at a time
+# to every held socket from a hierarchical timer wheel. A held connection
+# costs its socket, its (now idle) stream objects and one slotted object;
+# no coroutine, timeout handle or transcript stays alive.
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict
+
+import metrics
+from logger import log_request_async
+
+ENABLED = os.environ.get("HONEYPOT_TARPIT", "0") not in ("", "0", "false", "no")
+# commands that send a session to the tarpit (matched with re.search)
+COMMANDS = os.environ.get("HONEYPOT_TARPIT_COMMANDS", r"\b(wget|curl|tftp|ftpget)\b")
+# an IP with this many earlier sessions is tarpitted straight after login (0 = off)
+REPEAT = int(os.environ.get("HONEYPOT_TARPIT_REPEAT", "5"))
+MAX_HELD = int(os.environ.get("HONEYPOT_TARPIT_MAX", "50000"))
+INTERVAL = float(os.environ.get("HONEYPOT_TARPIT_INTERVAL", "5"))   # seconds between drips
+MAX_HOLD = float(os.environ.get("HONEYPOT_TARPIT_MAX_HOLD", "0"))   # seconds, 0 = until the client leaves
+REPORT_INTERVAL = float(os.environ.get("HONEYPOT_TARPIT_REPORT_INTERVAL", "60"))
+TICK = 0.25
+MAX_BUFFERED = 1024       # skip drips while a client leaves this much unread
+MAX_TRACKED_IPS = 65536   # repeat-offender table size (least recently seen dropped)
+SERVICE = "virtual-iot-tarpit"
+
+HELD = metrics.Gauge("honeypot_tarpit_held", "Connections currently held in the tarpit")
+DRIPPED = metrics.Counter("honeypot_tarpit_bytes_total", "Bytes dripped to tarpitted clients")
+WASTED = metrics.Counter("honeypot_tarpit_seconds_total", "Attacker-seconds spent in the tarpit (closed connections)")
+
+class TimerWheel:
+    """Hierarchical timer wheel: O(1) schedule, work per tick ~ timers due.
+
+    Level 0 has 2**bits[0] slots of one tick each, every further level
+    covers the whole span of the levels below it per slot. When a lower
+    level wraps, the matching slot of the next level is cascaded down.
+    Items need a writable `due` attribute (the tick they fire on).
+    """
+
+    def __init__(self, tick=TICK, bits=(8, 6, 6), now=None):
+        self.tick = tick
+        self.bits = bits
+        self.masks = [(1 << b) - 1 for b in bits]
+        self.levels = [[[] for _ in range(1 << b)] for b in bits]
+        self.span = (1 << sum(bits)) - 1
+        self.start = time.monotonic() if now is None else now
+        self.current = 0
+
+    def schedule(self, item, delay):
+        # clamped to the wheel's span, so _place always finds a level
+        ticks = min(self.span, max(1, int(delay / self.tick + 0.999999)))
+        item.due = self.current + ticks
+        self._place(item)
+
+    def _place(self, item):
+        delta = item.due - self.current
+        shift = 0
+        for level, bits, mask in zip(self.levels, self.bits, self.masks):
+            if delta < (1 << (shift + bits)):
+                level[(item.due >> shift) & mask].append(item)
+                return
+            shift += bits
+
+    def advance(self, now=None):
+        """Items that became due up to `now` (monotonic seconds), removed from the wheel."""
+        now = time.monotonic() if now is None else now
+        target = int((now - self.start) / self.tick)
+        due = []
+        levels, bits, masks = self.levels, self.bits, self.masks
+        while self.current < target:
+            self.current += 1
+            t = self.current
+            shift = 0
+            for i in range(1, len(levels)):
+                shift += bits[i - 1]
+                if t & ((1 << shift) - 1):
+                    break
+                idx = (t >> shift) & masks[i]
+                slot = levels[i][idx]
+                if slot:
+                    levels[i][idx] = []
+                    for item in slot:
+                        self._place(item)
+            idx = t & masks[0]
+            slot = levels[0][idx]
+            if slot:
+                levels[0][idx] = []
+                due.extend(slot)
+        return due
+
+class Held(asyncio.Protocol):
+    """Per-connection tarpit state; also the socket's protocol, so a client
+    hanging up is seen at once (connection_lost) and its input is dropped."""
+
+    __slots__ = ("engine", "writer", "transport", "since", "due", "payload", "pos", "closed")
+
+    def __init__(self, engine, writer, payload, since):
+        self.engine = engine
+        # a collected StreamWriter closes its socket, so it is kept (and nothing else)
+        self.writer = writer
+        self.transport = writer.transport
+        self.payload = payload
+        self.pos = 0
+        self.since = since
+        self.due = 0
+        self.closed = False
+
+    def data_received(self, data):
+        pass
+
+    def eof_received(self):
+        return False  # close our side too
+
+    def connection_lost(self, exc):
+        self.engine._release(self)
+
+class TarpitEngine:
+    """Holds handed-off connections and drips bytes to them from one task."""
+
+    def __init__(self, max_held=MAX_HELD, interval=INTERVAL, max_hold=MAX_HOLD,
+                 commands=COMMANDS, repeat=REPEAT, tick=TICK):
+        self.max_held = max_held
+        self.interval = interval
+        self.max_hold = max_hold
+        self.pattern = re.compile(commands) if commands else None
+        self.repeat = repeat
+        self.wheel = TimerWheel(tick)
+        self.seen = OrderedDict()
+        self.held = 0
+        self.total = 0
+        self.refused = 0
+        self.bytes = 0
+        self.closed_seconds = 0.0
+        self._since_sum = 0.0  # sum of `since` over held connections
+        self._task = None
+        HELD.set_function(lambda: self.held)
+
+    # --- criteria ---
+    def matches(self, cmd):
+        return self.pattern is not None and self.pattern.search(cmd) is not None
+
+    def note_session(self, ip):
+        """Count a session from `ip`; True if it is now a repeat offender."""
+        seen = self.seen
+        count = seen.pop(ip, 0) + 1
+        seen[ip] = count
+        if len(seen) > MAX_TRACKED_IPS:
+            seen.popitem(last=False)
+        return self.repeat > 0 and count > self.repeat
+
+    # --- holding ---
+    def hold(self, writer, payload):
+        """Take over the connection of a StreamWriter; False if the tarpit is
+        full (the caller keeps the connection)."""
+        transport = writer.transport
+        if self.held >= self.max_held or transport.is_closing():
+            self.refused += 1
+            return False
+        held = Held(self, writer, payload or b"\x00", time.monotonic())
+        transport.set_protocol(held)
+        if not transport.is_reading():
+            transport.resume_reading()  # so a hang-up is noticed
+        self.held += 1
+        self.total += 1
+        self._since_sum += held.since
+        self.wheel.schedule(held, self.interval)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return True
+
+    def _release(self, held):
+        if held.closed:
+            return
+        held.closed = True
+        seconds = time.monotonic() - held.since
+        self.held -= 1
+        self._since_sum -= held.since
+        self.closed_seconds += seconds
+        WASTED.inc(seconds)
+
+    def drip(self, now=None):
+        """Send one byte to every connection that is due; returns how many."""
+        now = time.monotonic() if now is None else now
+        sent = 0
+        for held in self.wheel.advance(now):
+            if held.closed:
+                continue  # closed items simply fall out of the wheel
+            transport = held.transport
+            if self.max_hold and now - held.since >= self.max_hold:
+                transport.abort()
+                self._release(held)
+                continue
+            if transport.get_write_buffer_size() < MAX_BUFFERED:
+                payload = held.payload
+                transport.write(payload[held.pos:held.pos + 1])
+                held.pos = (held.pos + 1) % len(payload)
+                sent += 1
+            self.wheel.schedule(held, self.interval)
+        self.bytes += sent
+        DRIPPED.inc(sent)
+        return sent
+
+    def stats(self):
+        now = time.monotonic()
+        live = self.held * now - self._since_sum
+        return {"held": self.held, "total": self.total, "refused": self.refused,
+                "bytes_dripped": self.bytes, "attacker_seconds": round(self.closed_seconds + live, 1)}
+
+    async def _run(self):
+        next_report = time.monotonic() + REPORT_INTERVAL
+        last = None
+        while True:
+            await asyncio.sleep(self.wheel.tick)
+            self.drip()
+            if REPORT_INTERVAL > 0 and time.monotonic() >= next_report:
+                next_report += REPORT_INTERVAL
+                stats = self.stats()
+                if stats != last:
+                    await log_request_async("-", SERVICE, "/tarpit", "TARPIT", stats)
+                    last = stats
+
+    def close(self):
+        """Drop every held connection (shutdown)."""
+        if self._task is not None:
+            self._task.cancel()
+        for level in self.wheel.levels:
+            for slot in level:
+                for held in slot:
+                    if not held.closed:
+                        held.transport.abort()
+                        self._release(held)
+                slot.clear()
+
+ENGINE = TarpitEngine() if ENABLED else None
+
+def enable(**kwargs):
+    """Turn the tarpit on (e.g. from a command-line flag)."""
+    global ENGINE
+    if ENGINE is None:
+        ENGINE = TarpitEngine(**kwargs)
+    return ENGINE
+
+async def shutdown():
+    """Log the final stats and drop held connections (before the log writer stops)."""
+    if ENGINE is not None and ENGINE.total:
+        await log_request_async("-", SERVICE, "/tarpit", "TARPIT", ENGINE.stats())
+        ENGINE.close()
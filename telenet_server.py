@@ -1,37 +1,174 @@
 # telnet_server.py
+import argparse
 import asyncio
-import datetime
-from logger import log_request
+import collections
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import ioc
+import livefeed
+import logger
+import metrics
+import shell
+import tarpit
+import telnetproto
+from admission import AdmissionControl
+from transcript import Recorder
+from logger import log_request_async
 
 HOST = "0.0.0.0"
 PORT = 2323
 SERVICE = "virtual-iot-telnet"
+# device persona: banner, prompts and the command table
+PERSONA_FILE = os.environ.get("HONEYPOT_PERSONA", shell.DEFAULT_PERSONA)
+COMMANDS = shell.load_persona(PERSONA_FILE)
+
+# --workers mode: "per-worker" log files or one "single-writer" process
+LOG_MODES = ("per-worker", "single-writer")
+LOG_MODE = os.environ.get("HONEYPOT_LOG_MODE", "single-writer")
+LOG_QUEUE_BATCHES = 1024  # batches buffered between workers and the log writer
+RESTART_DELAY = 1.0
+SHUTDOWN_TIMEOUT = 10.0
+
+# Admission control / resource limits (seconds, bytes, counts)
+LOGIN_TIMEOUT = float(os.environ.get("HONEYPOT_LOGIN_TIMEOUT", "30"))
+PASSWORD_TIMEOUT = float(os.environ.get("HONEYPOT_PASSWORD_TIMEOUT", "30"))
+IDLE_TIMEOUT = float(os.environ.get("HONEYPOT_IDLE_TIMEOUT", "300"))
+WRITE_TIMEOUT = float(os.environ.get("HONEYPOT_WRITE_TIMEOUT", "30"))
+MAX_LINE = int(os.environ.get("HONEYPOT_MAX_LINE", "4096"))
+READ_CHUNK = 4096
+MAX_SESSIONS = int(os.environ.get("HONEYPOT_MAX_SESSIONS", "1000"))
+MAX_PER_IP = int(os.environ.get("HONEYPOT_MAX_PER_IP", "20"))
+IP_RATE = float(os.environ.get("HONEYPOT_IP_RATE", "2"))  # new connections/second per IP
+IP_BURST = int(os.environ.get("HONEYPOT_IP_BURST", "10"))
+REJECT_REPORT_INTERVAL = float(os.environ.get("HONEYPOT_REJECT_REPORT_INTERVAL", "60"))
+
+ADMISSION = AdmissionControl(MAX_SESSIONS, MAX_PER_IP, IP_RATE, IP_BURST)
+
+SESSIONS = metrics.SESSIONS.labels(SERVICE)
+ACTIVE_SESSIONS = metrics.ACTIVE_SESSIONS.labels(SERVICE)
+BYTES_IN = metrics.BYTES_IN.labels(SERVICE)
+BYTES_OUT = metrics.BYTES_OUT.labels(SERVICE)
+COMMANDS_PER_SESSION = metrics.Histogram("honeypot_telnet_commands_per_session",
+                                         "Shell commands per telnet session", buckets=metrics.COUNT_BUCKETS)
+DISPATCH_SECONDS = metrics.Histogram("honeypot_telnet_dispatch_seconds", "Time to dispatch one shell command",
+                                     buckets=(1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 1e-3))
+
+class SessionLimit(Exception):
+    """A session was cut short by a timeout or size limit."""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+class TelnetReader:
+    """readline() on top of telnetproto.TelnetParser.
+
+    Negotiation bytes are answered and kept out of the lines; a line longer
+    than MAX_LINE raises ValueError like StreamReader.readline() does.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.parser = telnetproto.TelnetParser(MAX_LINE)
+        self.lines = collections.deque()
+        self.eof = False
+
+    async def readline(self):
+        parser = self.parser
+        while not self.lines:
+            if self.eof:
+                # like StreamReader: a final unterminated line, then b""
+                rest = bytes(parser.line)
+                parser.line.clear()
+                return rest
+            data = await self.reader.read(READ_CHUNK)
+            if not data:
+                self.eof = True
+                continue
+            BYTES_IN.inc(len(data))
+            self.lines.extend(parser.feed(data))
+            replies = parser.take_replies()
+            if replies:
+                send(self.writer, replies)
+            if parser.overflow:
+                raise ValueError("line too long")
+        return self.lines.popleft() + b"\n"
+
+async def read_line(reader, timeout, stage):
+    try:
+        return await asyncio.wait_for(reader.readline(), timeout)
+    except asyncio.TimeoutError:
+        raise SessionLimit(f"{stage}_timeout")
+    except ValueError:
+        # no newline within MAX_LINE bytes
+        raise SessionLimit("line_too_long")
+
+def send(writer, data):
+    writer.write(data)
+    BYTES_OUT.inc(len(data))
+
+async def drain(writer):
+    # a client that never reads must not hold the session forever
+    try:
+        await asyncio.wait_for(writer.drain(), WRITE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise SessionLimit("write_timeout")
 
-async def handle_client(reader, writer):
+async def handle_client(reader, writer, persona=None):
     peer = writer.get_extra_info("peername")
     src_ip = peer[0] if peer else "unknown"
-    session_start = datetime.datetime.utcnow().isoformat() + "Z"
-
-    # session transcript: list of {"ts":..., "dir":"in"/"out", "text":...}
-    transcript = []
+    if ADMISSION.admit(src_ip) is not None:
+        # rejected: free the socket right away, counted in the aggregated report
+        writer.transport.abort()
+        return
+    SESSIONS.inc()
+    active = metrics.ENABLED  # dec only what was counted, like metrics.timer()
+    if active:
+        ACTIVE_SESSIONS.inc()
+    try:
+        await serve_session(reader, writer, src_ip, persona)
+    finally:
+        if active:
+            ACTIVE_SESSIONS.dec()
+        ADMISSION.release(src_ip)
+
+async def serve_session(reader, writer, src_ip, persona=None):
+    persona = persona or COMMANDS
+    reader = TelnetReader(reader, writer)
+
+    # session transcript: ms offsets + direction codes + text (see transcript.py)
+    transcript = Recorder()
+    session_start = transcript.t0.isoformat() + "Z"
+    # known up front so live viewers can follow the session before it is logged
+    session_id = logger.new_session_id()
     username = None
-
-    def add(dir_, text):
-        transcript.append({
-            "ts": datetime.datetime.utcnow().isoformat() + "Z",
-            "dir": dir_,
-            "text": text
-        })
-
+    commands = 0
+    add = transcript.add
+    # IOCs of everything the client sends after login (see ioc.py)
+    found = {}
+    scan = ioc.EXTRACTOR.scan if ioc.EXTRACTOR is not None else None
+    # set when the connection is handed to the tarpit instead of being closed
+    held = None
+    engine = tarpit.ENGINE
+
+    livefeed.publish("start", session_id, src_ip, SERVICE)
     try:
+        if engine is not None and engine.note_session(src_ip) and engine.hold(writer, persona.banner):
+            # repeat offender: drip the banner instead of talking to it
+            held = "repeat"
+            return
+
         # send initial banner + login prompt
-        banner = "RouterOS v1.0 (simulated)\r\nlogin: "
-        writer.write(banner.encode())
-        await writer.drain()
-        add("out", banner)
+        send(writer, persona.banner)
+        await drain(writer)
+        add("out", persona.banner_text)
 
         # read username
-        data = await reader.readline()
+        data = await read_line(reader, LOGIN_TIMEOUT, "login")
         if not data:
             writer.close()
             await writer.wait_closed()
@@ -40,11 +177,11 @@ async def handle_client(reader, writer):
         add("in", username)
 
         # ask for password
-        writer.write(b"Password: ")
-        await writer.drain()
-        add("out", "Password: ")
+        send(writer, persona.password_prompt)
+        await drain(writer)
+        add("out", persona.password_text)
 
-        data = await reader.readline()
+        data = await read_line(reader, PASSWORD_TIMEOUT, "password")
         if not data:
             writer.close()
             await writer.wait_closed()
@@ -54,12 +191,12 @@ async def handle_client(reader, writer):
         # log credential attempt as part of session data below
 
         # fake auth result (always fail once, then accept) - mimic routers that lock or reject then accept
-        writer.write(b"Login incorrect\r\nlogin: ")
-        await writer.drain()
-        add("out", "Login incorrect")
+        send(writer, persona.login_failed)
+        await drain(writer)
+        add("out", persona.login_failed_text)
 
         # read another username (simulate retry)
-        data = await reader.readline()
+        data = await read_line(reader, LOGIN_TIMEOUT, "login")
         if not data:
             writer.close()
             await writer.wait_closed()
@@ -67,10 +204,10 @@ async def handle_client(reader, writer):
         username = data.decode(errors="ignore").strip()
         add("in", username)
 
-        writer.write(b"Password: ")
-        await writer.drain()
-        add("out", "Password: ")
-        data = await reader.readline()
+        send(writer, persona.password_prompt)
+        await drain(writer)
+        add("out", persona.password_text)
+        data = await read_line(reader, PASSWORD_TIMEOUT, "password")
         if not data:
             writer.close()
             await writer.wait_closed()
@@ -79,116 +216,227 @@ async def handle_client(reader, writer):
         add("in", "<password>")
 
         # accept and drop to fake shell
-        writer.write(b"\r\nWelcome to RouterOS CLI\r\n> ")
-        await writer.drain()
-        add("out", "Welcome to RouterOS CLI")
+        send(writer, persona.welcome)
+        await drain(writer)
+        add("out", persona.welcome_text)
+        livefeed.publish("login", session_id, src_ip, SERVICE, username=username)
 
         # handle simple commands until client closes
+        dispatch = persona.dispatch
         while True:
-            data = await reader.readline()
+            data = await read_line(reader, IDLE_TIMEOUT, "idle")
             if not data:
                 break
             cmd = data.decode(errors="ignore").rstrip("\r\n")
             add("in", cmd)
-
-            # RouterOS + Linux command emulation
-            if cmd.lower() in ("exit", "quit", "logout"):
-                resp = "Logout\r\n"
-                writer.write(resp.encode())
-                add("out", resp.strip())
-                await writer.drain()
+            livefeed.publish("command", session_id, src_ip, SERVICE, cmd=cmd)
+            if scan is not None:
+                scan(cmd, found)
+
+            # RouterOS + Linux command emulation (see personas/*.json);
+            # payload already ends with the prompt
+            t0 = metrics.timer()
+            payload, text, close = dispatch(cmd)
+            if t0:
+                DISPATCH_SECONDS.observe(time.perf_counter() - t0)
+            commands += 1
+            if engine is not None and engine.matches(cmd) and engine.hold(writer, payload):
+                # e.g. a download: the reply is dripped a byte at a time from now on
+                held = "command"
+                break
+            send(writer, payload)
+            add("out", text)
+            await drain(writer)
+            if close:
                 break
 
-            elif cmd == "/system resource print":
-                resp = (
-                    "uptime: 1d2h3m\r\n"
-                    "version: 6.48.6\r\n"
-                    "cpu: MIPS 24Kc\r\n"
-                    "cpu-frequency: 600MHz\r\n"
-                    "free-memory: 128MiB\r\n"
-                    "total-memory: 256MiB\r\n"
-                )
-
-            elif cmd == "/system identity print":
-                resp = 'name="MikroTik"\r\n'
-
-            elif cmd == "/interface print":
-                resp = (
-                    "Flags: X - disabled, R - running\r\n"
-                    " #   NAME       TYPE\r\n"
-                    " 0   ether1     ether\r\n"
-                    " 1   ether2     ether\r\n"
-                )
-
-            elif cmd == "/ip address print":
-                resp = "0   192.168.88.1/24    ether1\r\n"
-
-            elif cmd == "/system clock print":
-                resp = "time: 12:32:10\r\ndate: nov/20/2025\r\n"
-
-            elif cmd == "/user print":
-                resp = "0   admin    full\r\n"
-
-            elif cmd == "/ip route print":
-                resp = "0   0.0.0.0/0   192.168.88.1   1\r\n"
-
-            elif cmd == "/system routerboard print":
-                resp = (
-                    "routerboard: yes\r\n"
-                    "model: RB750Gr3\r\n"
-                    "serial-number: A1B2C3D4E5\r\n"
-                    "firmware-type: qca9531L\r\n"
-                )
-
-            # common attacker / Linux-style commands
-            elif cmd.lower() == "ls":
-                resp = "bin  etc  lib  usr  tmp\r\n"
-
-            elif cmd.lower().startswith("cat "):
-                resp = "root:x:0:0:root:/root:/bin/sh\r\n"
-
-            elif "wget" in cmd or "curl" in cmd:
-                resp = (
-                    "Downloading...\r\n"
-                    "sh: 1: ./payload: Permission denied\r\n"
-                )
-
-            elif cmd.strip() == "":
-                resp = ""
-
-            else:
-                resp = f"sh: {cmd}: command not found\r\n"
-
-            # send response and prompt again
-            writer.write(resp.encode() + b"> ")
-            add("out", resp)
-            await writer.drain()
-
+    except SessionLimit as e:
+        add("out", f"CLOSED: {e.reason}")
+        ADMISSION.reject(src_ip, e.reason)
     except Exception as e:
         # log exception to transcript
         add("out", f"ERROR: {e}")
     finally:
-        # log the session as one JSON entry via logger.log_request
+        COMMANDS_PER_SESSION.observe(commands)
+        # log the session as one JSON entry via logger.log_request_async
         session_data = {
             "session_start": session_start,
             "username": username or "",
-            "transcript": transcript
+            "transcript": transcript.to_record()
         }
+        if held:
+            session_data["tarpit"] = held
+        if found:
+            session_data["iocs"] = ioc.to_record(found)
+        if reader.parser.events:
+            # raw option negotiation, useful to fingerprint clients/bots
+            session_data["negotiation"] = reader.parser.events
         # Use path "/telnet" and method "SESSION" to differentiate from HTTP logs
-        log_request(src_ip, SERVICE, "/telnet", "SESSION", session_data)
-
+        # queued for the background writer so the loop never waits on disk
+        await log_request_async(src_ip, SERVICE, "/telnet", "SESSION", session_data, session_id)
+        livefeed.publish("end", session_id, src_ip, SERVICE, commands=commands, tarpit=held)
+
+        if not held:
+            try:
+                writer.close()
+                await asyncio.wait_for(writer.wait_closed(), WRITE_TIMEOUT)
+            except:
+                # unread output must not keep the socket open
+                writer.transport.abort()
+
+async def report_rejections(interval=REJECT_REPORT_INTERVAL):
+    """Log refused/cut-short connections as one aggregated entry per interval."""
+    while True:
+        await asyncio.sleep(interval)
+        report = ADMISSION.take_report()
+        if report:
+            await log_request_async("-", SERVICE, "/telnet", "REJECTED", report)
+
+async def main(host=HOST, port=PORT, reuse_port=False, log_sink=None, metrics_listen=None, live_socket=None):
+    await logger.start_writer(sink=log_sink)
+    if await livefeed.start(live_socket):
+        print(f"Live events on {livefeed.PUBLISHER.path}")
+    # limit= caps how much StreamReader buffers while waiting for a newline
+    server = await asyncio.start_server(handle_client, host, port, reuse_port=reuse_port, limit=MAX_LINE)
+    reporter = asyncio.get_running_loop().create_task(report_rejections())
+    background = [reporter]
+    if metrics_listen:
+        # (host, port, unix_path): scrape endpoint for this process only
+        metrics.enable()
+        m_host, m_port, m_path = metrics_listen
+        scrape = await metrics.start_listener(m_host, m_port, m_path)
+        print(f"Metrics on {m_path or f'{m_host}:{m_port}'}/metrics")
+    if metrics.ENABLED:
+        background.append(asyncio.get_running_loop().create_task(metrics.monitor_loop_lag()))
+    addrs = ", ".join(str(sock.getsockname()) for sock in server.sockets)
+    print(f"Telnet honeypot listening on {addrs} (PID {os.getpid()}).")
+    # SIGTERM (sent by the supervisor) stops accepting and flushes the log
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, server.close)
+    try:
+        async with server:
+            await server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        for task in background:
+            task.cancel()
+        if metrics_listen:
+            scrape.close()
+        report = ADMISSION.take_report()
+        if report:
+            await log_request_async("-", SERVICE, "/telnet", "REJECTED", report)
+        await tarpit.shutdown()
+        livefeed.stop()
+        # flush queued sessions before exiting
+        await logger.stop_writer()
+
+# --- Multi-process mode ------------------------------------------------
+def worker_metrics_listen(metrics_listen, index):
+    # each worker has its own registry, so each gets its own scrape address
+    if not metrics_listen:
+        return None
+    m_host, m_port, m_path = metrics_listen
+    return (m_host, m_port + index if m_port else None, f"{m_path}.{index}" if m_path else None)
+
+def run_worker(index, host, port, log_mode, log_queue, metrics_listen=None, live_socket=None):
+    # Ctrl+C reaches the whole process group; only the supervisor acts on it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sink = None
+    if log_mode == "per-worker":
+        # every worker rotates into the shared manifest; logstore serializes
+        # that across processes with an flock (see RotatingLog)
+        base, ext = os.path.splitext(logger.LOG_FILE)
+        logger.LOG_FILE = f"{base}.worker{index}{ext}"
+    else:
+        sink = log_queue.put
+    # one publisher per worker; the dashboard follows every path.N (None: no feed)
+    asyncio.run(main(host, port, reuse_port=True, log_sink=sink,
+                     metrics_listen=worker_metrics_listen(metrics_listen, index),
+                     live_socket=f"{live_socket}.{index}" if live_socket else None))
+
+def run_log_process(log_queue):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logger.run_log_writer(log_queue)
+
+def supervise(workers, host=HOST, port=PORT, log_mode=LOG_MODE, metrics_listen=None, live_socket=None):
+    """Fork `workers` processes sharing the port via SO_REUSEPORT.
+
+    Crashed workers are restarted; SIGINT/SIGTERM stops them all, then the
+    single-writer log process (if used) drains its queue and exits.
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise SystemExit("--workers needs SO_REUSEPORT, which this platform does not support")
+    ctx = multiprocessing.get_context("fork")
+    log_queue = log_proc = None
+    if log_mode == "single-writer":
+        log_queue = ctx.Queue(maxsize=LOG_QUEUE_BATCHES)
+        log_proc = ctx.Process(target=run_log_process, args=(log_queue,), name="honeypot-log")
+        log_proc.start()
+
+    def spawn(i):
+        p = ctx.Process(target=run_worker, args=(i, host, port, log_mode, log_queue, metrics_listen, live_socket), name=f"honeypot-worker-{i}")
+        p.start()
+        return p
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    procs = {i: spawn(i) for i in range(workers)}
+    print(f"Supervisor {os.getpid()}: {workers} workers on {host}:{port}, log mode {log_mode}")
+    while not stopping:
+        time.sleep(0.5)
+        for i, p in list(procs.items()):
+            if not p.is_alive() and not stopping:
+                print(f"Worker {i} (pid {p.pid}) exited with {p.exitcode}, restarting")
+                time.sleep(RESTART_DELAY)
+                procs[i] = spawn(i)
+
+    for p in procs.values():
+        if p.is_alive():
+            p.terminate()
+    for p in procs.values():
+        p.join(SHUTDOWN_TIMEOUT)
+        if p.is_alive():
+            p.kill()
+            p.join()
+    if log_proc is not None:
+        log_queue.put(None)
+        log_proc.join()
+    print("All workers stopped.")
+
+def cli():
+    ap = argparse.ArgumentParser(description="Telnet IoT honeypot.")
+    ap.add_argument("--host", default=HOST)
+    ap.add_argument("--port", type=int, default=PORT)
+    ap.add_argument("--workers", type=int, default=1, help="Worker processes sharing the port via SO_REUSEPORT (default 1)")
+    ap.add_argument("--log-mode", choices=LOG_MODES, default=LOG_MODE,
+                    help="With --workers: one log file per worker, or one writer process for all_sessions.jsonl")
+    ap.add_argument("--metrics-port", type=int, help="Serve Prometheus /metrics on this local port (worker N uses port+N)")
+    ap.add_argument("--metrics-host", default="127.0.0.1", help="Address for --metrics-port (default 127.0.0.1)")
+    ap.add_argument("--metrics-socket", help="Serve /metrics on this Unix socket instead (worker N appends .N)")
+    ap.add_argument("--tarpit", action="store_true", help="Hold matching sessions in the tarpit (also HONEYPOT_TARPIT=1)")
+    ap.add_argument("--live-socket", help="Publish live session events on this Unix socket (worker N appends .N)")
+    args = ap.parse_args()
+    if args.tarpit:
+        tarpit.enable()
+    live_socket = args.live_socket or livefeed.SOCKET_PATH or None
+    metrics_listen = None
+    if args.metrics_port or args.metrics_socket:
+        metrics_listen = (args.metrics_host, args.metrics_port, args.metrics_socket)
+    if args.workers > 1:
+        supervise(args.workers, args.host, args.port, args.log_mode, metrics_listen, live_socket)
+    else:
         try:
-            writer.close()
-            await writer.wait_closed()
-        except:
+            asyncio.run(main(args.host, args.port, metrics_listen=metrics_listen, live_socket=live_socket))
+        except KeyboardInterrupt:
             pass
 
-async def main():
-    server = await asyncio.start_server(handle_client, HOST, PORT)
-    addrs = ", ".join(str(sock.getsockname()) for sock in server.sockets)
-    print(f"Telnet honeypot listening on {addrs} (PID will be this process).")
-    async with server:
-        await server.serve_forever()
-
 if __name__ == "__main__":
-    asyncio.run(main())
+    cli()
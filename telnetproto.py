@@ -0,0 +1,205 @@
+# telnetproto.py - incremental telnet protocol parser (IAC negotiation + line assembly)
+#
+# The parser is fed raw socket chunks and hands back clean command lines.
+# Option negotiation is answered the way a small embedded telnetd would,
+# and every negotiation is kept as an event string for fingerprinting
+# ("DO 1", "WILL 31", "SB 24 00787465726d", ...).
+#
+# Data is scanned with bytes.find() for IAC and newlines, so plain text
+# costs a few C-level searches per chunk instead of a Python step per byte.
+
+IAC, DONT, DO, WONT, WILL, SB, SE = 255, 254, 253, 252, 251, 250, 240
+NOP, AYT = 241, 246
+ECHO, SGA, TTYPE, NAWS = 1, 3, 24, 31
+TTYPE_SEND = 1
+
+COMMAND_NAMES = {DONT: "DONT", DO: "DO", WONT: "WONT", WILL: "WILL"}
+
+# options we agree to perform (client sends DO) / let the client perform (client sends WILL)
+LOCAL_OPTIONS = frozenset((SGA,))
+REMOTE_OPTIONS = frozenset((TTYPE, NAWS))
+
+MAX_LINE = 4096
+MAX_SUBNEG = 256   # bytes of one SB payload kept; the rest is dropped
+MAX_EVENTS = 64    # negotiation events kept per connection
+
+# parser states
+_DATA, _IAC, _OPT, _SB, _SB_IAC = range(5)
+
+class TelnetParser:
+    """Byte-level telnet state machine with fixed-size buffers.
+
+    feed(data) returns the complete lines found so far (bytes, without the
+    line ending); replies to negotiations collect in `replies` (take them
+    with take_replies()). A line longer than max_line sets `overflow` and
+    is cut, so memory per connection stays bounded whatever the client sends.
+    """
+
+    def __init__(self, max_line=MAX_LINE):
+        self.max_line = max_line
+        self.state = _DATA
+        self.line = bytearray()
+        self.overflow = False
+        self.cmd = 0
+        self.sb = bytearray()
+        self.events = []
+        self.replies = bytearray()
+        # RFC 1143 style: only answer requests that change an option's state,
+        # so two peers can never loop on WILL/DO
+        self.local = bytearray(256)
+        self.remote = bytearray(256)
+
+    def take_replies(self):
+        out = bytes(self.replies)
+        self.replies.clear()
+        return out
+
+    def feed(self, data):
+        lines = []
+        pos, end = 0, len(data)
+        while pos < end:
+            state = self.state
+            if state == _DATA:
+                idx = data.find(b"\xff", pos)
+                if idx < 0:
+                    self._text(data[pos:] if pos else data, lines)
+                    break
+                if idx > pos:
+                    self._text(data[pos:idx], lines)
+                # fast paths: a whole negotiation / subnegotiation inside this chunk
+                if idx + 2 < end:
+                    cmd = data[idx + 1]
+                    if cmd in COMMAND_NAMES:
+                        self._negotiate(cmd, data[idx + 2])
+                        pos = idx + 3
+                        continue
+                    if cmd == SB:
+                        se = data.find(b"\xff\xf0", idx + 2)
+                        if se >= 0 and data.find(b"\xff", idx + 2, se) < 0:
+                            self.sb[:] = data[idx + 2:se][:MAX_SUBNEG]
+                            self._subnegotiation()
+                            pos = se + 2
+                            continue
+                self.state = _IAC
+                pos = idx + 1
+            elif state == _IAC:
+                b = data[pos]
+                pos += 1
+                if b == IAC:
+                    self._text(b"\xff", lines)  # escaped 0xff data byte
+                    self.state = _DATA
+                elif b in COMMAND_NAMES:
+                    self.cmd = b
+                    self.state = _OPT
+                elif b == SB:
+                    self.sb.clear()
+                    self.state = _SB
+                else:
+                    if b == AYT:
+                        self.replies += b"\r\n[Yes]\r\n"
+                    if b != NOP:
+                        self._event(f"CMD {b}")
+                    self.state = _DATA
+            elif state == _OPT:
+                self._negotiate(self.cmd, data[pos])
+                pos += 1
+                self.state = _DATA
+            elif state == _SB:
+                idx = data.find(b"\xff", pos)
+                chunk = data[pos:] if idx < 0 else data[pos:idx]
+                room = MAX_SUBNEG - len(self.sb)
+                if room > 0:
+                    self.sb += chunk[:room]
+                if idx < 0:
+                    break
+                pos = idx + 1
+                self.state = _SB_IAC
+            else:  # _SB_IAC
+                b = data[pos]
+                if b == IAC:
+                    if len(self.sb) < MAX_SUBNEG:
+                        self.sb.append(IAC)
+                    pos += 1
+                    self.state = _SB
+                else:
+                    self._subnegotiation()
+                    if b == SE:
+                        pos += 1
+                        self.state = _DATA
+                    else:
+                        # missing SE: treat the byte as the start of a new command
+                        self.state = _IAC
+        return lines
+
+    def _text(self, seg, lines):
+        if not self.line and seg[-1:] == b"\n" and seg.find(b"\n") == len(seg) - 1 \
+                and len(seg) <= self.max_line and b"\x00" not in seg:
+            # the common case: exactly one complete line
+            lines.append(seg[:-2] if seg[-2:] == b"\r\n" else seg[:-1])
+            return
+        if seg[:1] == b"\x00" and self.line[-1:] == b"\r":
+            seg = b"\n" + seg[1:]  # CR NUL split across reads
+        if b"\x00" in seg:
+            # CR NUL is how NVT clients send a bare Enter
+            seg = seg.replace(b"\r\x00", b"\n").replace(b"\x00", b"")
+        if b"\n" not in seg:
+            self._append(seg)
+            return
+        parts = seg.split(b"\n")
+        rest = parts.pop()
+        if self.line:
+            self._append(parts[0])
+            parts[0] = bytes(self.line)
+            self.line.clear()
+        if max(map(len, parts)) > self.max_line:
+            self.overflow = True
+            parts = [p[:self.max_line] for p in parts]
+        lines.extend([p[:-1] if p.endswith(b"\r") else p for p in parts])
+        self._append(rest)
+
+    def _append(self, seg):
+        room = self.max_line - len(self.line)
+        if len(seg) > room:
+            self.overflow = True
+            seg = seg[:max(0, room)]
+        self.line += seg
+
+    def _negotiate(self, cmd, opt):
+        if len(self.events) < MAX_EVENTS:
+            self.events.append(f"{COMMAND_NAMES[cmd]} {opt}")
+        if cmd == DO:
+            if opt in LOCAL_OPTIONS:
+                if not self.local[opt]:
+                    self.local[opt] = 1
+                    self.replies += bytes((IAC, WILL, opt))
+            elif not self.local[opt]:
+                self.local[opt] = 2  # refused once; stay quiet on repeats
+                self.replies += bytes((IAC, WONT, opt))
+        elif cmd == DONT:
+            if self.local[opt] == 1:
+                self.local[opt] = 0
+                self.replies += bytes((IAC, WONT, opt))
+        elif cmd == WILL:
+            if opt in REMOTE_OPTIONS:
+                if not self.remote[opt]:
+                    self.remote[opt] = 1
+                    self.replies += bytes((IAC, DO, opt))
+                    if opt == TTYPE:
+                        # ask for the terminal type: a good client fingerprint
+                        self.replies += bytes((IAC, SB, TTYPE, TTYPE_SEND, IAC, SE))
+            elif not self.remote[opt]:
+                self.remote[opt] = 2
+                self.replies += bytes((IAC, DONT, opt))
+        elif cmd == WONT:
+            if self.remote[opt] == 1:
+                self.remote[opt] = 0
+                self.replies += bytes((IAC, DONT, opt))
+
+    def _subnegotiation(self):
+        if self.sb:
+            self._event(f"SB {self.sb[0]} {self.sb[1:].hex()}")
+        self.sb.clear()
+
+    def _event(self, text):
+        if len(self.events) < MAX_EVENTS:
+            self.events.append(text)
@@ -0,0 +1,39 @@
+# test_admission.py - global cap, per-IP concurrency and the per-IP token bucket
+from admission import AdmissionControl
+
+def test_token_bucket_refills_at_the_rate():
+    ac = AdmissionControl(per_ip_rate=2.0, per_ip_burst=3, per_ip_sessions=100)
+    assert [ac.admit("10.0.0.1", now=100.0) for _ in range(4)] == [None, None, None, "ip_rate"]
+    # half a second at 2/s is one token; another address has its own bucket
+    assert ac.admit("10.0.0.1", now=100.5) is None
+    assert ac.admit("10.0.0.1", now=100.5) == "ip_rate"
+    assert ac.admit("10.0.0.2", now=100.5) is None
+    # the bucket never holds more than the burst
+    assert [ac.admit("10.0.0.1", now=1000.0) for _ in range(4)] == [None, None, None, "ip_rate"]
+
+def test_concurrency_limits_and_release():
+    ac = AdmissionControl(max_sessions=3, per_ip_sessions=2, per_ip_burst=100)
+    assert ac.admit("a", now=1.0) is None and ac.admit("a", now=1.0) is None
+    assert ac.admit("a", now=1.0) == "ip_concurrency"
+    assert ac.admit("b", now=1.0) is None
+    assert ac.admit("c", now=1.0) == "global_cap"
+    ac.release("a")
+    assert ac.active == 2 and ac.admit("a", now=1.0) is None
+    report = ac.take_report()
+    assert report["rejected"] == {"ip_concurrency": 1, "global_cap": 1}
+    assert dict(report["top_ips"]) == {"a": 1, "c": 1}
+    assert ac.take_report() is None
+
+def test_idle_addresses_expire_and_the_table_is_bounded():
+    ac = AdmissionControl(per_ip_sessions=100, expiry=10.0, max_tracked=10)
+    ac.admit("busy", now=0.0)
+    for i in range(9):
+        ac.admit(f"idle{i}", now=float(i))
+        ac.release(f"idle{i}")
+    assert len(ac.ips) == 10
+    # over max_tracked: the oldest idle entries go, open sessions stay
+    ac.admit("new", now=9.5)
+    assert "busy" in ac.ips and "new" in ac.ips and len(ac.ips) <= 7
+    ac.release("new")
+    ac.sweep(100.0)
+    assert list(ac.ips) == ["busy"]
@@ -0,0 +1,30 @@
+# test_livefeed.py - who publishes live events, and where
+import asyncio
+
+import livefeed
+import logger
+import telenet_server
+
+def test_start_without_a_path_is_off(monkeypatch, tmp_path):
+    monkeypatch.setattr(livefeed, "SOCKET_PATH", str(tmp_path / "live.sock"))
+    assert asyncio.run(livefeed.start(None)) is None
+    assert not (tmp_path / "live.sock").exists()
+
+def worker_live_socket(monkeypatch, tmp_path, live_socket):
+    seen = {}
+
+    async def main(*args, **kwargs):
+        seen.update(kwargs)
+
+    monkeypatch.setattr(telenet_server, "main", main)
+    monkeypatch.setattr(telenet_server.signal, "signal", lambda *a: None)
+    monkeypatch.setattr(logger, "LOG_FILE", str(tmp_path / "all_sessions.jsonl"))
+    telenet_server.run_worker(2, "127.0.0.1", 0, "per-worker", None, live_socket=live_socket)
+    return seen["live_socket"]
+
+def test_worker_without_a_feed_does_not_publish(monkeypatch, tmp_path):
+    monkeypatch.setattr(livefeed, "SOCKET_PATH", str(tmp_path / "env.sock"))
+    assert worker_live_socket(monkeypatch, tmp_path, None) is None
+
+def test_worker_publishes_on_its_own_path(monkeypatch, tmp_path):
+    assert worker_live_socket(monkeypatch, tmp_path, "/run/live.sock") == "/run/live.sock.2"
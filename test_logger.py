@@ -0,0 +1,64 @@
+# test_logger.py - entry construction and the async writer
+import logger
+
+def test_src_info_is_looked_up_once_per_ip(monkeypatch):
+    calls = []
+    monkeypatch.setattr(logger.ipenrich, "lookup", lambda ip: calls.append(ip) or {"country": "ZZ"})
+    logger.src_info.cache_clear()
+    try:
+        for _ in range(3):
+            entry = logger.make_entry("192.0.2.7", "http", "/", "GET", {})
+        logger.make_entry("192.0.2.8", "http", "/", "GET", {})
+    finally:
+        logger.src_info.cache_clear()
+    assert calls == ["192.0.2.7", "192.0.2.8"]
+    assert entry["src_info"] == {"country": "ZZ"}
+    assert list(entry)[:3] == ["time", "session_id", "src_ip"]
+
+def test_no_src_info_without_a_match(monkeypatch):
+    monkeypatch.setattr(logger.ipenrich, "lookup", lambda ip: {})
+    logger.src_info.cache_clear()
+    try:
+        assert "src_info" not in logger.make_entry("192.0.2.9", "telnet", None, None, {})
+    finally:
+        logger.src_info.cache_clear()
+
+def run_writer(tmp_path, policy, n=10):
+    """Log n entries with log_request (no awaits in between) past a 2-entry queue."""
+    import asyncio
+    import json
+    import threading
+    threads = []
+
+    def sink(lines):
+        threads.append(threading.get_ident())
+        logger.append_lines(str(tmp_path / "log.jsonl"), lines)
+
+    async def main():
+        writer = await logger.start_writer(stats_interval=0, path=str(tmp_path / "log.jsonl"),
+                                           queue_size=2, policy=policy, sink=sink)
+        for i in range(n):
+            logger.log_request("192.0.2.1", "test", "/", "GET", {"n": i})
+        await logger.stop_writer()
+        return writer, threading.get_ident()
+
+    writer, loop_thread = asyncio.run(main())
+    with open(tmp_path / "log.jsonl") as f:
+        got = sorted(json.loads(ln)["data"]["n"] for ln in f)
+    return writer, got, loop_thread, threads
+
+def test_block_writes_through_off_the_loop(tmp_path):
+    writer, got, loop_thread, threads = run_writer(tmp_path, "block")
+    assert got == list(range(10))
+    assert writer.written == 10 and writer.dropped == 0
+    assert loop_thread not in threads
+
+def test_spill_is_merged_back(tmp_path):
+    writer, got, _, _ = run_writer(tmp_path, "spill")
+    assert got == list(range(10))
+    assert writer.spilled == 8
+    assert not (tmp_path / "log.jsonl.spill").exists()
+
+def test_drop_counts_what_it_loses(tmp_path):
+    writer, got, _, _ = run_writer(tmp_path, "drop")
+    assert got == [0, 1] and writer.dropped == 8
@@ -0,0 +1,87 @@
+# test_logindex.py - sidecar index: lookups, the unsorted tail, several writers
+import json
+
+import logindex
+import logstore
+
+def line(i, ip="10.0.0.1", sid=None):
+    entry = {"time": f"2024-05-01T10:00:{i % 60:02d}.000001", "session_id": sid or f"{i:032x}",
+             "src_ip": ip, "event": "cmd", "n": i}
+    return json.dumps(entry) + "\n"
+
+def make_log(tmp_path, n=10, codec="none"):
+    log = logstore.RotatingLog(tmp_path / "all_sessions.jsonl", max_bytes=0, interval=0, codec=codec)
+    for i in range(n):
+        log.write([line(i, ip="10.0.0.1" if i % 2 else "10.0.0.2")])
+    return log
+
+def test_lookup_by_ip_session_and_time(tmp_path):
+    log = make_log(tmp_path)
+    got = logindex.lookup(log.path, ip="10.0.0.1")
+    assert [e["n"] for e in got] == [1, 3, 5, 7, 9]
+    got = logindex.lookup(log.path, session_id=f"{4:032x}")
+    assert [e["n"] for e in got] == [4]
+    since, until = logstore.parse_time("2024-05-01T10:00:03"), logstore.parse_time("2024-05-01T10:00:05.5")
+    assert [e["n"] for e in logindex.lookup(log.path, since, until)] == [3, 4, 5]
+
+def test_sorted_runs_and_tail(tmp_path):
+    log = logstore.RotatingLog(tmp_path / "all_sessions.jsonl", max_bytes=0, interval=0, codec="none")
+    log.write([line(0)])
+    log.index.sort_every = 4
+    for i in range(1, 10):
+        log.write([line(i)])
+    assert logindex.load_meta(log.path)["sorted"] == 8
+    # two records in the sorted runs, one in the tail
+    got = logindex.lookup(log.path, ip="10.0.0.1")
+    assert [e["n"] for e in got] == list(range(10))
+
+def test_unindexed_lines_are_scanned_once(tmp_path):
+    log = make_log(tmp_path, n=4)
+    with open(log.path, "a") as f:
+        f.write(line(4, ip="10.0.0.1"))
+        f.write('{"time": "2024-05-01T10:00:05", "src_ip": "10.0.0.1", "partial')
+    got = logindex.lookup(log.path, ip="10.0.0.1")
+    assert [e["n"] for e in got] == [1, 3, 4]
+
+def test_two_writers_keep_offset_order(tmp_path):
+    # two RotatingLogs on one path stand in for server.py and telenet_server.py
+    a = logstore.RotatingLog(tmp_path / "all_sessions.jsonl", max_bytes=0, interval=0, codec="none")
+    b = logstore.RotatingLog(tmp_path / "all_sessions.jsonl", max_bytes=0, interval=0, codec="none")
+    for i in range(20):
+        (a if i % 3 else b).write([line(i)])
+    with open(logindex.index_path(a.path), "rb") as f:
+        data = f.read()
+    offsets = [logindex.RECORD.unpack_from(data, k)[0] for k in range(0, len(data), logindex.RECORD.size)]
+    assert offsets == sorted(offsets) and len(offsets) == 20
+    assert [e["n"] for e in logindex.lookup(a.path, ip="10.0.0.1")] == list(range(20))
+
+def test_out_of_order_records_are_not_duplicated(tmp_path):
+    log = make_log(tmp_path, n=6)
+    log._close()
+    # swap the last two records, as unserialized writers could leave them
+    idx = logindex.index_path(log.path)
+    with open(idx, "rb") as f:
+        data = f.read()
+    size = logindex.RECORD.size
+    with open(idx, "wb") as f:
+        f.write(data[:-2 * size] + data[-size:] + data[-2 * size:-size])
+    got = logindex.lookup(log.path)
+    assert [e["n"] for e in got] == list(range(6))
+
+def test_stale_index_falls_back(tmp_path):
+    log = make_log(tmp_path, n=6)
+    log._close()
+    with open(log.path, "w") as f:
+        f.write(line(0, ip="10.0.0.2"))
+    assert logindex.lookup(log.path, ip="10.0.0.2") is None
+    assert [e["n"] for e in logindex.find_entries([log.path], ip="10.0.0.2")] == [0]
+
+def test_build_compressed_segment(tmp_path):
+    log = make_log(tmp_path, n=8, codec="gzip")
+    log.rotate()
+    seg = tmp_path / logstore.load_manifest(tmp_path)["segments"][0]["file"]
+    assert str(seg).endswith(".gz")
+    got = logindex.lookup(seg, ip="10.0.0.2")
+    assert [e["n"] for e in got] == [0, 2, 4, 6]
+    assert logindex.build(seg) == 8
+    assert [e["n"] for e in logindex.lookup(seg, session_id=f"{5:032x}")] == [5]
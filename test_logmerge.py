@@ -0,0 +1,32 @@
+# test_logmerge.py - time-ordered merge of several log files
+import json
+from datetime import datetime
+
+import pytest
+
+import logmerge
+
+def write(path, minutes):
+    with open(path, "w", encoding="utf-8") as f:
+        for m in minutes:
+            f.write(json.dumps({"time": f"2024-05-01T10:{m:02d}:00Z", "session_id": f"s{m}"}) + "\n")
+        f.write("not json\n")
+
+def test_query_merges_by_time(tmp_path):
+    a, b = tmp_path / "a.jsonl", tmp_path / "b.jsonl"
+    write(a, [0, 3, 4, 9])
+    write(b, [1, 2, 5])
+    got = [e["session_id"] for e in logmerge.query([a, b], workers=1)]
+    assert got == ["s0", "s1", "s2", "s3", "s4", "s5", "s9"]
+    got = [e["session_id"] for e in logmerge.query([a, b], since=datetime(2024, 5, 1, 10, 2),
+                                                   until=datetime(2024, 5, 1, 10, 4), workers=1)]
+    assert got == ["s2", "s3", "s4"]
+
+def test_write_merged_refuses_an_input_as_output(tmp_path):
+    a, b = tmp_path / "a.jsonl", tmp_path / "b.jsonl"
+    write(a, [1])
+    write(b, [0])
+    assert logmerge.write_merged([a, b], tmp_path / "out.jsonl", workers=1) == 2
+    assert (tmp_path / "out.jsonl").read_text().splitlines()[0].startswith('{"time": "2024-05-01T10:00')
+    with pytest.raises(ValueError):
+        logmerge.write_merged([a, b], a, workers=1)
@@ -0,0 +1,72 @@
+# test_logstore.py - rotation, the segment manifest and several writers per file
+import json
+import os
+
+import logindex
+import logstore
+
+def line(i):
+    return json.dumps({"time": f"2024-05-01T10:{i // 60:02d}:{i % 60:02d}", "session_id": f"s{i}",
+                       "src_ip": "10.0.0.1", "n": i}) + "\n"
+
+def new_log(tmp_path, **kw):
+    kw = {"max_bytes": 0, "interval": 0, "codec": "gzip", **kw}
+    return logstore.RotatingLog(tmp_path / "all_sessions.jsonl", **kw)
+
+def read_all(tmp_path):
+    paths = logstore.select_segments(tmp_path)
+    return [e["n"] for e in logstore.iter_entries(paths)]
+
+def test_rotates_by_size_into_manifest(tmp_path):
+    log = new_log(tmp_path, max_bytes=len(line(0)) * 3)
+    for i in range(10):
+        log.write([line(i)])
+    segs = logstore.load_manifest(tmp_path)["segments"]
+    assert len(segs) == 3
+    assert all(s["file"].endswith(".jsonl.gz") and s["records"] == 3 for s in segs)
+    assert segs[0]["start"] == line(0)[10:29] and segs[0]["source"] == "all_sessions.jsonl"
+    assert read_all(tmp_path) == list(range(10))
+    # each segment took its index along
+    for s in segs:
+        assert os.path.exists(logindex.index_path(tmp_path / s["file"]))
+
+def test_select_segments_by_time(tmp_path):
+    log = new_log(tmp_path, max_bytes=len(line(0)) * 2)
+    for i in range(6):
+        log.write([line(i * 60)])
+    since = logstore.parse_time("2024-05-01T10:02:30")
+    until = logstore.parse_time("2024-05-01T10:03:30")
+    paths = logstore.select_segments(tmp_path, since, until)
+    # the segment holding 10:02 and 10:03, and the live file
+    assert len(paths) == 2 and paths[-1].endswith("all_sessions.jsonl")
+    assert [e["n"] for e in logstore.iter_entries(paths, since, until)] == [180]
+
+def test_follows_rotation_by_another_writer(tmp_path):
+    a, b = new_log(tmp_path), new_log(tmp_path)
+    a.write([line(0)])
+    b.write([line(1)])
+    a.rotate()
+    b.write([line(2)])  # must not land in the renamed segment
+    a.write([line(3)])
+    segs = logstore.load_manifest(tmp_path)["segments"]
+    assert len(segs) == 1 and segs[0]["records"] == 2
+    with open(a.path) as f:
+        assert [json.loads(ln)["n"] for ln in f] == [2, 3]
+    assert [e["n"] for e in logindex.lookup(a.path)] == [2, 3]
+
+def test_concurrent_rotations_keep_every_segment(tmp_path):
+    a, b = new_log(tmp_path), new_log(tmp_path)
+    for i in range(6):
+        (a if i % 2 else b).write([line(i)])
+        (b if i % 2 else a).rotate()
+    segs = logstore.load_manifest(tmp_path)["segments"]
+    assert sum(s["records"] for s in segs) == 6
+    assert read_all(tmp_path) == list(range(6))
+
+def test_replaced_file_is_picked_up(tmp_path):
+    log = new_log(tmp_path)
+    log.write([line(0), line(1)])
+    os.remove(log.path)
+    log.write([line(2)])
+    with open(log.path) as f:
+        assert [json.loads(ln)["n"] for ln in f] == [2]
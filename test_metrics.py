@@ -0,0 +1,62 @@
+# test_metrics.py - exposition format and the in-progress gauges
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import metrics
+import server
+import telenet_server
+
+def test_render_counters_gauges_histograms(monkeypatch):
+    monkeypatch.setattr(metrics, "ENABLED", True)
+    c = metrics.Counter("test_render_total", "doc", labels=("kind",))
+    g = metrics.Gauge("test_render_gauge", "doc")
+    h = metrics.Histogram("test_render_seconds", "doc", buckets=(0.1, 1.0))
+    c.labels('a"b').inc(2)
+    g.set(5)
+    h.observe(0.5)
+    text = metrics.render()
+    assert '# TYPE test_render_total counter\ntest_render_total{kind="a\\"b"} 2' in text
+    assert "test_render_gauge 5" in text
+    assert 'test_render_seconds_bucket{le="0.1"} 0\ntest_render_seconds_bucket{le="1.0"} 1' in text
+    assert 'test_render_seconds_bucket{le="+Inf"} 1\ntest_render_seconds_sum 0.5' in text
+
+def test_recording_is_off_until_enabled(monkeypatch):
+    monkeypatch.setattr(metrics, "ENABLED", False)
+    c = metrics.Counter("test_off_total", "doc")
+    c.inc()
+    assert c.labels().value == 0
+
+def test_http_gauge_survives_enabling_mid_request(monkeypatch):
+    monkeypatch.setattr(metrics, "ENABLED", False)
+    before = server.ACTIVE_REQUESTS.value
+
+    async def enabling(request):
+        metrics.enable()
+        return web.Response(text="ok")
+
+    async def run():
+        app = web.Application(middlewares=[server.instrument])
+        app.router.add_get("/", enabling)
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.get("/")
+            assert resp.status == 200
+
+    asyncio.run(run())
+    assert server.ACTIVE_REQUESTS.value == before
+
+def test_telnet_gauge_survives_enabling_mid_session(monkeypatch):
+    monkeypatch.setattr(metrics, "ENABLED", False)
+    before = telenet_server.ACTIVE_SESSIONS.value
+
+    async def serve_session(reader, writer, src_ip, persona=None):
+        metrics.enable()
+
+    class Writer:
+        def get_extra_info(self, name, default=None):
+            return ("192.0.2.1", 2323) if name == "peername" else default
+
+    monkeypatch.setattr(telenet_server, "serve_session", serve_session)
+    asyncio.run(telenet_server.handle_client(None, Writer()))
+    assert telenet_server.ACTIVE_SESSIONS.value == before
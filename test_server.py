@@ -0,0 +1,128 @@
+# test_server.py - the HTTP honeypot app
+import asyncio
+import json
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import logger
+import metrics
+import server
+
+@pytest.fixture
+def log_file(tmp_path, monkeypatch):
+    path = tmp_path / "all_sessions.jsonl"
+    monkeypatch.setattr(logger, "LOG_FILE", str(path))
+    return path
+
+def logged(path):
+    with open(path) as f:
+        return [json.loads(ln) for ln in f]
+
+def request(method, path, **kwargs):
+    async def run():
+        async with TestClient(TestServer(server.make_app())) as client:
+            resp = await client.request(method, path, **kwargs)
+            return resp.status, resp.headers.get("Content-Type", ""), await resp.read()
+    return asyncio.run(run())
+
+def test_metrics_are_not_public_by_default(log_file, monkeypatch):
+    monkeypatch.setattr(metrics, "ENABLED", True)
+    monkeypatch.setattr(server, "PUBLIC_METRICS", False)
+    status, ctype, body = request("GET", "/metrics")
+    assert b"honeypot_" not in body
+    assert [e["path"] for e in logged(log_file)] == ["/metrics"]
+
+def test_metrics_on_the_decoy_port_when_opted_in(log_file, monkeypatch):
+    monkeypatch.setattr(metrics, "ENABLED", True)
+    monkeypatch.setattr(server, "PUBLIC_METRICS", True)
+    status, ctype, body = request("GET", "/metrics")
+    assert status == 200 and ctype.startswith("text/plain") and b"honeypot_sessions_total" in body
+    assert not log_file.exists() or logged(log_file) == []
+
+def test_post_round_trips_through_replay(log_file):
+    import types
+    import aiohttp
+    import replay
+
+    posts = [({"data": {"username": "admin", "password": "1234"}}),
+             ({"data": b'{"cmd": "reboot"}', "headers": {"Content-Type": "application/json"}})]
+
+    async def run():
+        async with TestClient(TestServer(server.make_app())) as client:
+            for kwargs in posts:
+                resp = await client.post("/cgi-bin/login", **kwargs)
+                await resp.read()
+            await server.logger.stop_writer()  # flush, then replay what was logged
+            recorded = logged(log_file)
+            await server.logger.start_writer()
+            args = types.SimpleNamespace(host=client.host, port=client.port, run_id="t", server_log=None)
+            stats = types.SimpleNamespace(latencies=[], closed_at={})
+            async with aiohttp.ClientSession() as http:
+                for n, sess in enumerate(recorded):
+                    await replay.run_http_session(sess, n, args, http, stats)
+        return recorded
+
+    recorded = asyncio.run(run())
+    entries = logged(log_file)
+    assert len(entries) == 4
+    form, raw = entries[2]["data"], entries[3]["data"]
+    assert form["form"] == {"username": "admin", "password": "1234"} == recorded[0]["data"]["form"]
+    assert raw["body"]["text"] == '{"cmd": "reboot"}' and raw["body"]["content_type"] == "application/json"
+    assert raw["body"]["sha256"] == recorded[1]["data"]["body"]["sha256"]
+
+class Content:
+    """request.content handing out fixed chunks, then raising `fail` if set."""
+
+    def __init__(self, chunks, fail=None):
+        self.chunks = list(chunks)
+        self.fail = fail
+
+    async def read(self, n):
+        if self.chunks:
+            return self.chunks.pop(0)
+        if self.fail is not None:
+            raise self.fail
+        return b""
+
+class Request(dict):
+    def __init__(self, content):
+        super().__init__()
+        self.content = content
+
+@pytest.fixture
+def body_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "BODY_DIR", str(tmp_path / "bodies"))
+    monkeypatch.setattr(server, "BODY_CAP", 16)
+    monkeypatch.setattr(server, "BODY_PREVIEW", 4)
+    return tmp_path / "bodies"
+
+def capture(chunks, fail=None):
+    return asyncio.run(server.capture_body(Request(Content(chunks, fail))))
+
+def test_small_body_stays_inline(body_dir):
+    record, body = capture([b"user=a", b"&pw=b"])
+    assert body == b"user=a&pw=b" and record["size"] == 11
+    assert "stored" not in record and not body_dir.exists()
+
+def test_large_body_spills_to_its_hash(body_dir):
+    import hashlib
+    data = [b"x" * 10, b"y" * 10, b"z" * 10]
+    record, body = capture(data)
+    digest = hashlib.sha256(b"".join(data)).hexdigest()
+    assert body is None and record["sha256"] == digest and record["preview"] == "xxxx"
+    with open(body_dir / record["stored"], "rb") as f:
+        assert f.read() == b"".join(data)
+    # the same upload again shares the file
+    assert capture(data)[0]["stored"] == record["stored"]
+    assert [p.name for p in body_dir.rglob("*") if p.is_file()] == [f"{digest}.bin"]
+
+def test_body_past_max_is_truncated(body_dir, monkeypatch):
+    monkeypatch.setattr(server, "BODY_MAX", 12)
+    record, body = capture([b"a" * 10, b"b" * 10, b"c" * 10])
+    assert record["truncated"] == "max_size" and record["size"] == 12 and body == b"a" * 10 + b"bb"
+
+def test_cancel_leaves_no_partial_file(body_dir):
+    with pytest.raises(asyncio.CancelledError):
+        capture([b"x" * 20, b"y" * 20], fail=asyncio.CancelledError())
+    assert not [p for p in body_dir.rglob("*") if p.is_file()]
@@ -0,0 +1,127 @@
+# test_sessionbrowser.py - row tables, time ranges, the table bound and find()
+import json
+from datetime import datetime
+
+import columnar
+import logmerge
+import logstore
+import sessionbrowser
+import transcriptstore
+
+def entry(i, ip="10.0.0.1", service="telnet", text="uname -a", minute=None):
+    minute = i if minute is None else minute
+    t0 = f"2024-05-01T10:{minute:02d}:00"
+    return {"time": t0 + ".000000Z", "session_id": f"s{i}", "src_ip": ip, "service": service,
+            "data": {"username": "root", "transcript": {"v": 2, "t0": t0, "ev": [[0, "i", text]]}}}
+
+def write(path, entries, mode="w"):
+    with open(path, mode, encoding="utf-8") as f:
+        for e in entries:
+            f.write(json.dumps(e) + "\n")
+
+def sids(browser, tables, **kw):
+    q = browser.query(tables, **kw)
+    return [row["session_id"] for row in q.page(0)]
+
+def test_query_pages_and_loads(tmp_path):
+    path = tmp_path / "all_sessions.jsonl"
+    write(path, [entry(i, ip=f"10.0.0.{i}", service="http" if i % 2 else "telnet") for i in range(6)])
+    browser = sessionbrowser.SessionBrowser(tmp_path, workers=1)
+    tables = browser.tables([path])
+    assert sorted(browser.services(tables)) == ["http", "telnet"]
+    assert sids(browser, tables) == ["s5", "s4", "s3", "s2", "s1", "s0"]
+    assert sids(browser, tables, service=["http"], sort="oldest") == ["s1", "s3", "s5"]
+    assert sids(browser, tables, ip="10.0.0.0/30", sort="oldest") == ["s0", "s1", "s2", "s3"]
+    q = browser.query(tables, command="UNAME", page_size=4)
+    assert q.total == 6 and q.pages == 2 and len(q.page(1)) == 2
+    row = q.page(0)[0]
+    assert browser.load(row)["session_id"] == row["session_id"]
+    assert q.tokens() == {"uname": 6}
+
+def test_tail_read_and_rewrite(tmp_path):
+    path = tmp_path / "all_sessions.jsonl"
+    write(path, [entry(i) for i in range(3)])
+    browser = sessionbrowser.SessionBrowser(tmp_path, workers=1)
+    browser.tables([path])
+    browser.tables([path])
+    assert (browser.loads, browser.hits, browser.tails) == (1, 1, 0)
+    write(path, [entry(i) for i in range(3, 5)], mode="a")
+    tables = browser.tables([path])
+    assert browser.tails == 1 and len(tables[0]) == 5
+    # a rewritten file is read again, not appended to
+    write(path, [entry(9)])
+    tables = browser.tables([path])
+    assert browser.loads == 2 and sids(browser, tables) == ["s9"]
+
+def test_time_range_keeps_only_matching_rows(tmp_path):
+    path = tmp_path / "all_sessions.jsonl"
+    write(path, [entry(i) for i in range(10)])
+    browser = sessionbrowser.SessionBrowser(tmp_path, workers=1)
+    since, until = datetime(2024, 5, 1, 10, 3), datetime(2024, 5, 1, 10, 5, 30)
+    tables = browser.tables([path], since, until)
+    assert len(tables[0]) == 3
+    assert sids(browser, tables, sort="oldest") == ["s3", "s4", "s5"]
+    # another range is another table; the whole file is one more
+    assert len(browser.tables([path])[0]) == 10
+    assert len(browser.logs) == 2
+
+def test_tables_are_bounded(tmp_path):
+    paths = []
+    for n in range(4):
+        paths.append(tmp_path / f"all_sessions.worker{n}.jsonl")
+        write(paths[-1], [entry(n)])
+    browser = sessionbrowser.SessionBrowser(tmp_path, max_tables=2, workers=1)
+    for p in paths:
+        browser.tables([p])
+    assert [key[0] for key in browser.logs] == [str(p) for p in paths[2:]]
+    # the least recently used goes first
+    browser.tables([paths[2]])
+    browser.tables([paths[0]])
+    assert [key[0] for key in browser.logs] == [str(paths[2]), str(paths[0])]
+
+def test_cold_loads_in_the_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(logmerge, "PARALLEL_MIN_BYTES", 0)
+    paths = []
+    for n in range(3):
+        paths.append(tmp_path / f"all_sessions.worker{n}.jsonl")
+        write(paths[-1], [entry(n * 10 + i) for i in range(3)])
+    browser = sessionbrowser.SessionBrowser(tmp_path, workers=2)
+    tables = browser.tables(paths)
+    assert [t.path for t in tables] == [str(p) for p in paths]
+    assert browser.query(tables).total == 9
+    # stat taken before the load: an append is a tail read, not a reload
+    write(paths[1], [entry(19)], mode="a")
+    tables = browser.tables(paths)
+    assert (browser.loads, browser.hits, browser.tails) == (3, 2, 1)
+    assert browser.query(tables).total == 10
+
+def test_find_reads_matching_entries_only(tmp_path):
+    log = logstore.RotatingLog(tmp_path / "all_sessions.jsonl", max_bytes=0, interval=0, codec="gzip")
+    log.write([json.dumps(entry(i, ip=f"10.0.0.{i % 3}")) + "\n" for i in range(9)])
+    browser = sessionbrowser.SessionBrowser(tmp_path, workers=1)
+    found = browser.find([log.path], ip="10.0.0.1")
+    assert sids(browser, found, sort="oldest") == ["s1", "s4", "s7"]
+    found = browser.find([log.path], session_id="s5")
+    row = browser.query(found).page(0)[0]
+    assert browser.load(row)["session_id"] == "s5"
+    assert browser.find([log.path], ip="10.9.9.9") == []
+    assert not browser.logs  # finds are not cached
+
+def test_compacted_segment_keeps_refs(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcriptstore, "STORE_DIR", str(tmp_path / "transcripts"))
+    entries = [entry(i) for i in range(3)]
+    for e in entries:
+        transcriptstore.dedup_entry(e)
+    seg = tmp_path / "all_sessions.jsonl.1"
+    write(seg, entries)
+    index = columnar.load_index(tmp_path)
+    index["segments"][seg.name] = columnar.compact_segment(seg, tmp_path, "npy")
+    columnar.save_index(tmp_path, index)
+    browser = sessionbrowser.SessionBrowser(tmp_path, workers=1)
+    tables = browser.tables([seg], datetime(2024, 5, 1, 10, 1), None)
+    assert tables[0].events_table is not None
+    assert sids(browser, tables, sort="oldest") == ["s1", "s2"]
+    q = browser.query(tables)
+    # identical transcripts: one campaign, counted from the table's "ref" column
+    assert q.counts("ref") == {transcriptstore.dedup_entry(entry(0))["data"]["transcript"]["ref"]: 2}
+    assert q.tokens() == {"uname": 2}
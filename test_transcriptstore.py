@@ -0,0 +1,43 @@
+# test_transcriptstore.py - content-addressed transcript dedup
+import transcript
+import transcriptstore
+
+def session(t0, lines, step=700):
+    ev = []
+    for i, (d, text) in enumerate(lines):
+        ev.append([i * step, d, text])
+    return {"v": 2, "t0": t0, "ev": ev}
+
+LINES = [("o", "login: "), ("i", "admin\r"), ("o", "Password: "), ("i", "admin  "), ("i", "cat /proc/cpuinfo")]
+
+def stored_files(store):
+    return [p for p in store.rglob("*.json")]
+
+def test_identical_transcripts_share_one_ref(tmp_path):
+    a = transcriptstore.dedup(session("2024-05-01T10:00:00", LINES), tmp_path)
+    b = transcriptstore.dedup(session("2024-05-02T11:30:00", LINES, step=1500), tmp_path)
+    assert a["v"] == b["v"] == 3 and a["ref"] == b["ref"]
+    assert a["ms"] != b["ms"]
+    assert len(stored_files(tmp_path)) == 1
+
+def test_dedup_is_byte_exact(tmp_path):
+    variants = [LINES, [(d, t.rstrip()) for d, t in LINES], [(d, t.upper()) for d, t in LINES]]
+    refs = {transcriptstore.dedup(session("2024-05-01T10:00:00", v), tmp_path)["ref"] for v in variants}
+    assert len(refs) == 3 and len(stored_files(tmp_path)) == 3
+
+def test_hydrate_gives_back_the_text_as_sent(tmp_path):
+    rec = session("2024-05-01T10:00:00", LINES)
+    ref = transcriptstore.dedup(dict(rec), tmp_path)
+    with transcriptstore._lock:
+        transcriptstore._cache.clear()  # read back from disk
+    assert transcriptstore.hydrate(ref, tmp_path) == rec["ev"]
+
+def test_missing_ref_is_a_marker(tmp_path):
+    ev = transcriptstore.hydrate({"v": 3, "ref": "0" * 32, "ms": [5]}, tmp_path)
+    assert ev[0][:2] == [5, "x"] and "not in the store" in ev[0][2]
+
+def test_entry_keeps_other_fields(tmp_path):
+    entry = {"data": {"username": "admin", "transcript": session("2024-05-01T10:00:00", LINES)}}
+    transcriptstore.dedup_entry(entry, tmp_path)
+    assert entry["data"]["username"] == "admin"
+    assert transcript.ref(entry) == entry["data"]["transcript"]["ref"]
@@ -0,0 +1,192 @@
+# transcript.py - compact session transcripts and a reader for every stored format
+#
+# Version 2 records (written by the telnet server and simulate.py):
+#
+#   "transcript": {"v": 2, "t0": "2025-01-01T00:00:00.123456Z",
+#                  "ev": [[0, "o", "login: "], [1520, "i", "admin"], ...]}
+#
+# Each event is [milliseconds since t0, direction, text] with direction
+# "i" (client), "o" (honeypot) or "x" (marker, e.g. truncation). Older
+# records hold a list of {"ts", "dir", "text"} dicts, and some imported logs
+# a top-level "events" list of {"dir": "recv"/"send", "data"}. The logger
+# stores version 2 records as version 3 references into the deduplicating
+# transcript store ({"v": 3, "t0", "ref": hash, "ms": [offsets]}, see
+# transcriptstore.py). events() reads all of them.
+import json
+import os
+import time
+from array import array
+from datetime import datetime, timedelta
+
+import logstore
+import transcriptstore
+
+VERSION = 2
+# per-session caps; events past either are dropped and a marker is added
+MAX_EVENTS = int(os.environ.get("HONEYPOT_TRANSCRIPT_MAX_EVENTS", "2000"))
+MAX_BYTES = int(os.environ.get("HONEYPOT_TRANSCRIPT_MAX_BYTES", str(256 * 1024)))
+
+DIR_CODES = {"in": "i", "out": "o", "recv": "i", "send": "o"}
+DIR_NAMES = {"i": "in", "o": "out", "x": "meta"}
+_IN, _OUT, _MARK = ord("i"), ord("o"), ord("x")
+
+def _iso(t):
+    return t.isoformat() + "Z"
+
+class Recorder:
+    """Transcript buffer: offsets in an int array, one byte per direction.
+
+    Times are taken from the monotonic clock relative to the session start,
+    so recording an event costs one clock read and three appends.
+    """
+
+    __slots__ = ("t0", "start", "offsets", "dirs", "texts", "size",
+                 "max_events", "max_bytes", "dropped", "dropped_bytes")
+
+    def __init__(self, max_events=MAX_EVENTS, max_bytes=MAX_BYTES):
+        self.t0 = datetime.utcnow()
+        self.start = time.monotonic()
+        self.offsets = array("I")
+        self.dirs = bytearray()
+        self.texts = []
+        self.size = 0
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        self.dropped_bytes = 0
+
+    def add(self, dir_, text):
+        # `size` counts characters: cheap, and close to bytes for this traffic
+        if self.dropped or len(self.texts) >= self.max_events or self.size + len(text) > self.max_bytes:
+            # once truncated, stay truncated so the transcript has no holes
+            self.dropped += 1
+            self.dropped_bytes += len(text)
+            return
+        self.offsets.append(int((time.monotonic() - self.start) * 1000))
+        self.dirs.append(_IN if dir_ == "in" else _OUT)
+        self.texts.append(text)
+        self.size += len(text)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def to_record(self):
+        ev = [[o, chr(d), t] for o, d, t in zip(self.offsets, self.dirs, self.texts)]
+        record = {"v": VERSION, "t0": _iso(self.t0), "ev": ev}
+        if self.dropped:
+            ms = int((time.monotonic() - self.start) * 1000)
+            ev.append([ms, "x", f"[truncated: {self.dropped} events, {self.dropped_bytes} chars not recorded]"])
+            record["truncated"] = {"events": self.dropped, "chars": self.dropped_bytes}
+        return record
+
+def make_record(t0, events):
+    """A version 2 record from (offset_ms, dir, text) tuples (dir "in"/"out"/...)."""
+    return {"v": VERSION, "t0": t0 if isinstance(t0, str) or t0 is None else _iso(t0),
+            "ev": [[int(o), DIR_CODES.get(d, "x"), t] for o, d, t in events]}
+
+# --- Reading ---------------------------------------------------------------
+def raw(session):
+    """The stored transcript object of a log entry (list, dict or None)."""
+    if not isinstance(session, dict):
+        return None
+    data = session.get("data")
+    if isinstance(data, dict) and data.get("transcript"):
+        return data["transcript"]
+    return session.get("transcript") or None
+
+def ref(session):
+    """Transcript store hash of a deduplicated transcript (the campaign id), else None."""
+    t = raw(session)
+    return t.get("ref") if isinstance(t, dict) else None
+
+def start_time(session):
+    """Session start as a naive UTC datetime, if known."""
+    t = raw(session)
+    if isinstance(t, dict) and t.get("t0"):
+        return logstore.parse_time(t["t0"])
+    data = session.get("data") if isinstance(session.get("data"), dict) else {}
+    return logstore.parse_time(data.get("session_start") or session.get("session_start") or "") or None
+
+def events(session):
+    """[(offset_ms, dir, text)] for any stored format.
+
+    dir is "in"/"out"/"meta" for transcripts and the stored value
+    ("recv"/"send") for events lists. offset_ms is None when a record
+    has no usable time for that event.
+    """
+    t = raw(session)
+    if isinstance(t, dict):
+        stored = transcriptstore.hydrate(t) if "ref" in t else t.get("ev", ())
+        return [(ev[0], DIR_NAMES.get(ev[1], ev[1]), ev[2]) for ev in stored if len(ev) >= 3]
+    if isinstance(t, list):
+        items, key, tkey = t, "text", "ts"
+    elif isinstance(session, dict) and isinstance(session.get("events"), list):
+        items, key, tkey = session["events"], "data", "time"
+    else:
+        return []
+    base = start_time(session)
+    out = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        ts = logstore.parse_time(item[tkey]) if item.get(tkey) else None
+        if base is None:
+            base = ts
+        offset = int((ts - base) / timedelta(milliseconds=1)) if ts is not None and base is not None else None
+        out.append((offset, str(item.get("dir", "")), str(item.get(key) or item.get("payload") or "")))
+    return out
+
+def timestamp(session, offset_ms):
+    """ISO time of an event offset (None if the session start is unknown)."""
+    base = start_time(session)
+    if base is None or offset_ms is None:
+        return None
+    return _iso(base + timedelta(milliseconds=offset_ms))
+
+def to_text(session):
+    """Readable text of whatever a log entry recorded (the dashboard's transcript box)."""
+    if not isinstance(session, dict):
+        return ""
+    # recorded telnet transcript (any version): offset from session start, direction, text
+    stored = raw(session)
+    if isinstance(stored, (list, dict)):
+        lines = []
+        for offset, d, text in events(session):
+            time_str = f"[+{offset / 1000:.3f}s] " if offset is not None else ""
+            label = {"in": "IN ", "out": "OUT", "meta": "---"}.get(d, d.upper()[:3])
+            lines.append(f"{time_str}{label} {str(text).rstrip()}")
+        if lines:
+            return "\n".join(lines)
+    # direct 'transcript'
+    if "transcript" in session and session["transcript"]:
+        return session["transcript"] if isinstance(session["transcript"], str) else json.dumps(session["transcript"], indent=2)
+    # events array
+    if "events" in session and isinstance(session["events"], list):
+        lines = []
+        for e in session["events"]:
+            if isinstance(e, dict):
+                t = e.get("time", "")
+                d = e.get("dir", "")
+                msg = e.get("data") or e.get("payload") or e.get("message") or ""
+                # simple color hints: recv (client) vs send (server) with emojis
+                prefix = "👤" if d == "recv" else "💻" if d == "send" else ""
+                time_str = f"[{t}] " if t else ""
+                lines.append(f"{time_str}{prefix} {msg.strip()}")
+            else:
+                lines.append(str(e))
+        return "\n".join(lines).strip()
+    # http-style: request.body
+    if "request" in session and isinstance(session["request"], dict):
+        req = session["request"]
+        first = f"{req.get('method','')} {req.get('path','')}".strip()
+        body = req.get("body")
+        if body:
+            return f"{first}\n\n{json.dumps(body, indent=2) if isinstance(body, (dict, list)) else str(body)}"
+        return first
+    # fallback: stringify known keys
+    for key in ("payload", "body", "data"):
+        if key in session and session[key]:
+            val = session[key]
+            return json.dumps(val, indent=2) if isinstance(val, (dict, list)) else str(val)
+    # nothing found
+    return ""
@@ -0,0 +1,125 @@
+# transcriptstore.py - content-addressed store for transcripts repeated by bots
+#
+# Botnets replay the same login and command sequence over and over, so most
+# session transcripts differ only in their timing. Before a session is
+# logged its transcript is reduced to the [direction, text] pairs, text
+# exactly as sent (CRs and trailing whitespace are evidence too), and
+# hashed; the pairs are written once to
+#
+#   logs/transcripts/<first 2 hex>/<hash>.json      {"ev": [["o", "login:"], ["i", "admin"], ...]}
+#
+# and the log line keeps a reference plus its own timing:
+#
+#   "transcript": {"v": 3, "t0": "...", "ref": "<hash>", "ms": [0, 1520, ...]}
+#
+# transcript.events() rehydrates references through get(), which keeps the
+# most recently used transcripts in an LRU cache. The hash doubles as a
+# campaign id: rollups count sessions per hash.
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+
+BASE_DIR = os.path.dirname(__file__)
+STORE_DIR = os.environ.get("HONEYPOT_TRANSCRIPT_STORE", os.path.join(BASE_DIR, "logs", "transcripts"))
+ENABLED = os.environ.get("HONEYPOT_TRANSCRIPT_DEDUP", "1") not in ("", "0", "false", "no")
+VERSION = 3
+CACHE_SIZE = int(os.environ.get("HONEYPOT_TRANSCRIPT_CACHE", "4096"))
+KNOWN_SIZE = 65536  # hashes this process has seen stored (skips the exists() check)
+
+STORED = metrics.Counter("honeypot_transcripts_total", "Logged transcripts by dedup outcome", labels=("outcome",))
+STORED_NEW = STORED.labels("new")
+STORED_DUPLICATE = STORED.labels("duplicate")
+
+_lock = threading.Lock()
+_cache = OrderedDict()   # hash -> tuple of (dir, text)
+_known = OrderedDict()   # (store dir, hash) -> None
+
+def event_pairs(ev):
+    """[[dir, text], ...] of version 2 events: no timing, text unchanged."""
+    return [[e[1], str(e[2])] for e in ev if len(e) >= 3]
+
+def content_hash(pairs):
+    blob = json.dumps(pairs, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return hashlib.blake2b(blob, digest_size=16).hexdigest()
+
+def path_for(h, store_dir=None):
+    return os.path.join(store_dir or STORE_DIR, h[:2], f"{h}.json")
+
+def _remember(table, key, value, size):
+    table[key] = value
+    table.move_to_end(key)
+    if len(table) > size:
+        table.popitem(last=False)
+
+def put(pairs, store_dir=None):
+    """Store [dir, text] pairs (once); returns their hash."""
+    store_dir = store_dir or STORE_DIR
+    h = content_hash(pairs)
+    key = (store_dir, h)
+    with _lock:
+        if key in _known:
+            _known.move_to_end(key)
+            STORED_DUPLICATE.inc()
+            return h
+    path = path_for(h, store_dir)
+    if os.path.exists(path):
+        STORED_DUPLICATE.inc()
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written whole then renamed: processes storing the same hash race harmlessly
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"ev": pairs}, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+        STORED_NEW.inc()
+    with _lock:
+        _remember(_known, key, None, KNOWN_SIZE)
+        # the logger's rollup reads the entry right after this
+        _remember(_cache, h, tuple((d, t) for d, t in pairs), CACHE_SIZE)
+    return h
+
+def get(h, store_dir=None):
+    """The (dir, text) pairs stored under `h`, or None if the store lacks it."""
+    with _lock:
+        pairs = _cache.get(h)
+        if pairs is not None:
+            _cache.move_to_end(h)
+            return pairs
+    try:
+        with open(path_for(h, store_dir), "r", encoding="utf-8") as f:
+            pairs = tuple((d, t) for d, t in json.load(f)["ev"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    with _lock:
+        _remember(_cache, h, pairs, CACHE_SIZE)
+    return pairs
+
+def dedup(record, store_dir=None):
+    """A version 3 reference for a version 2 transcript record (others unchanged)."""
+    if not isinstance(record, dict) or record.get("v") != 2 or not isinstance(record.get("ev"), list):
+        return record
+    pairs = event_pairs(record["ev"])
+    out = {"v": VERSION, "t0": record.get("t0"), "ref": put(pairs, store_dir),
+           "ms": [e[0] for e in record["ev"] if len(e) >= 3]}
+    if "truncated" in record:
+        out["truncated"] = record["truncated"]
+    return out
+
+def dedup_entry(entry, store_dir=None):
+    """Replace the transcript of a log entry with its reference, in place."""
+    data = entry.get("data")
+    if isinstance(data, dict) and isinstance(data.get("transcript"), dict):
+        data["transcript"] = dedup(data["transcript"], store_dir)
+    return entry
+
+def hydrate(record, store_dir=None):
+    """Version 2 events ([ms, dir, text]) for a version 3 record; a marker event if the store lacks it."""
+    pairs = get(record.get("ref", ""), store_dir)
+    ms = record.get("ms") or []
+    if pairs is None:
+        return [[ms[0] if ms else 0, "x", f"[transcript {record.get('ref')} not in the store]"]]
+    return [[o, d, t] for o, (d, t) in zip(ms, pairs)]